@@ -0,0 +1,63 @@
+import argparse
+import sys
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from benchmark.generator import LAYOUTS, generate_repo  # noqa: E402
+from benchmark.runner import SCENARIOS, run_benchmark, compare_results  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate = subparsers.add_parser('generate', help='generate a synthetic java repository')
+    generate.add_argument('--output', '-o', required=True, help='path of the repository to create')
+    generate.add_argument('--layout', choices=sorted(LAYOUTS), default='maven', help='build layout')
+    generate.add_argument('--files', type=int, default=200, help='number of java files')
+    generate.add_argument('--file-lines', type=int, default=150, help='number of lines of each java file')
+    generate.add_argument('--duplication', type=float, default=0.1,
+                          help='ratio of files containing a duplicated block')
+    generate.add_argument('--commits', type=int, default=5, help='number of commits')
+    generate.add_argument('--dirty-files', type=int, default=10,
+                          help='number of files modified in the working tree after the last commit')
+    generate.add_argument('--seed', type=int, default=0, help='random seed')
+
+    run = subparsers.add_parser('run', help='time the checker against a repository')
+    run.add_argument('--repo', '-r', required=True, help='path of the repository to check')
+    run.add_argument('--tool', '-t', default=path.join(path.dirname(path.dirname(path.abspath(__file__))), 'tool_set'),
+                     help='path of check tool set parent directory')
+    run.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma separated, of {', '.join(SCENARIOS)}")
+    run.add_argument('--plugins', default='checkstyle,pmd,spotbugs,javancss,simian',
+                     help='list of check types that will be executed')
+    run.add_argument('--repeat', type=int, default=3, help='number of runs of each scenario')
+    run.add_argument('--jobs', '-j', type=int, default=0, help='number of plugins to run concurrently')
+    run.add_argument('--cache', action='store_true', help='use a fresh result cache shared by the runs')
+    run.add_argument('--result', help='path of the json result file')
+
+    compare = subparsers.add_parser('compare', help='compare two benchmark results')
+    compare.add_argument('base', help='baseline json result file')
+    compare.add_argument('new', help='new json result file')
+    compare.add_argument('--threshold', type=float, default=0.05, help='relative change reported as a regression')
+
+    args = parser.parse_args()
+    if args.command == 'generate':
+        info = generate_repo(args.output, layout=args.layout, files=args.files, file_lines=args.file_lines,
+                             duplication=args.duplication, commits=args.commits, dirty_files=args.dirty_files,
+                             seed=args.seed)
+        print(f"generated {info['files']} java files in {info['path']}")
+        return 0
+    if args.command == 'run':
+        scenarios = [item for item in args.scenarios.split(',') if item]
+        unknown = [item for item in scenarios if item not in SCENARIOS]
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(unknown)}")
+        run_benchmark(args.repo, args.tool, scenarios=scenarios, plugins=args.plugins, repeat=args.repeat,
+                      jobs=args.jobs, enable_cache=args.cache, result_file=args.result)
+        return 0
+    return compare_results(args.base, args.new, args.threshold)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
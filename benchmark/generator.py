@@ -0,0 +1,223 @@
+import os
+import random
+import struct
+from os import path
+
+import git
+
+# 不同构建工具的源代码目录和class文件目录
+LAYOUTS = {
+    'maven': {
+        'build_file': ('pom.xml', '<project>\n  <modelVersion>4.0.0</modelVersion>\n'
+                                  '  <groupId>com.example</groupId>\n  <artifactId>{name}</artifactId>\n'
+                                  '  <version>1.0.0</version>\n</project>\n'),
+        'classes': {'main': path.join('target', 'classes'), 'test': path.join('target', 'test-classes')},
+    },
+    'gradle': {
+        'build_file': ('build.gradle', "plugins {{\n    id 'java'\n}}\n\ngroup = 'com.example'\nversion = '1.0.0'\n"),
+        'classes': {'main': path.join('build', 'classes', 'java', 'main'),
+                    'test': path.join('build', 'classes', 'java', 'test')},
+    },
+}
+
+PACKAGES = ['service', 'repository', 'controller', 'model', 'util', 'config']
+
+# 重复代码块，按照duplication比例插入到部分文件中，用于触发simian的重复代码检查
+DUPLICATED_BLOCK = [
+    '    public int duplicated{index}(int[] values) {{',
+    '        int total = 0;',
+    '        for (int i = 0; i < values.length; i++) {{',
+    '            if (values[i] % 2 == 0) {{',
+    '                total += values[i] * 2;',
+    '            }} else if (values[i] % 3 == 0) {{',
+    '                total += values[i] * 3;',
+    '            }} else {{',
+    '                total -= values[i];',
+    '            }}',
+    '            if (total > 100000) {{',
+    '                total = total / 2;',
+    '            }}',
+    '        }}',
+    '        String text = String.valueOf(total);',
+    '        if (text.length() > 5) {{',
+    '            text = text.substring(0, 5);',
+    '        }}',
+    '        StringBuilder builder = new StringBuilder();',
+    '        for (char c : text.toCharArray()) {{',
+    '            builder.append(c).append(\',\');',
+    '        }}',
+    '        return builder.length() + total;',
+    '    }}',
+]
+
+
+def generate_method(rnd, index):
+    """
+    生成一个方法，方法中混合了常见的代码规范问题，如魔法数字、过长的行和未使用的变量
+    :param rnd: 随机数生成器
+    :param index: 方法序号
+    :return: 代码行列表
+    """
+    name = f'method{index}'
+    lines = [f'    public int {name}(int value, String label) {{']
+    lines.append(f'        int unused{index} = {rnd.randint(1, 1000)};')
+    for i in range(rnd.randint(3, 8)):
+        kind = rnd.random()
+        if kind < 0.3:
+            lines.append(f'        if (value > {rnd.randint(1, 100)}) {{')
+            lines.append(f'            value = value - {rnd.randint(1, 9)};')
+            lines.append('        }')
+        elif kind < 0.5:
+            lines.append(f'        for (int i{i} = 0; i{i} < {rnd.randint(2, 20)}; i{i}++) {{')
+            lines.append(f'            value += i{i};')
+            lines.append('        }')
+        elif kind < 0.6:
+            lines.append(f'        String message{i} = "{name} value is " + value + " and the label is " + label'
+                         f' + " which is a very long line";')
+        else:
+            lines.append(f'        value = value * {rnd.randint(2, 7)} + {rnd.randint(0, 50)};')
+    lines.append('        return value;')
+    lines.append('    }')
+    lines.append('')
+    return lines
+
+
+def generate_java_source(rnd, package, class_name, file_lines, duplicated):
+    """
+    生成java源代码
+    :param rnd: 随机数生成器
+    :param package: 包名
+    :param class_name: 类名
+    :param file_lines: 源代码的目标行数
+    :param duplicated: 是否插入重复代码块
+    :return: 源代码字符串
+    """
+    lines = [f'package {package};', '', 'import java.util.ArrayList;', 'import java.util.List;', '',
+             f'public class {class_name} {{', '', '    private List<String> items = new ArrayList<>();', '']
+    if duplicated:
+        lines.extend(line.format(index='') for line in DUPLICATED_BLOCK)
+        lines.append('')
+    index = 0
+    while len(lines) < file_lines - 1:
+        lines.extend(generate_method(rnd, index))
+        index += 1
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def generate_class_stub(class_name, source_file):
+    """
+    生成最小的class文件，只包含类名、父类和SourceFile属性，可以被spotbugs加载分析
+    :param class_name: 类的全限定名，使用'/'分隔
+    :param source_file: 源代码文件名
+    :return: class文件内容
+    """
+
+    def utf8(text):
+        data = text.encode('utf-8')
+        return struct.pack('>BH', 1, len(data)) + data
+
+    constant_pool = b''.join([
+        utf8(class_name),  # 1
+        struct.pack('>BH', 7, 1),  # 2 this class
+        utf8('java/lang/Object'),  # 3
+        struct.pack('>BH', 7, 3),  # 4 super class
+        utf8('SourceFile'),  # 5
+        utf8(source_file),  # 6
+    ])
+    return b''.join([
+        struct.pack('>IHH', 0xCAFEBABE, 0, 52),
+        struct.pack('>H', 7),
+        constant_pool,
+        # access flags, this class, super class, interfaces, fields, methods
+        struct.pack('>HHHHHH', 0x0021, 2, 4, 0, 0, 0),
+        # SourceFile属性
+        struct.pack('>HHIH', 1, 5, 2, 6),
+    ])
+
+
+def _write(file_path, content):
+    os.makedirs(path.dirname(file_path), exist_ok=True)
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    with open(file_path, mode, **({} if mode == 'wb' else {'encoding': 'utf-8', 'newline': '\n'})) as fp:
+        fp.write(content)
+
+
+def _commit(repo, message, index):
+    # 固定提交时间和作者，相同的参数生成相同的提交
+    date = f'2024-01-01T00:{index // 60:02d}:{index % 60:02d}+00:00'
+    env = {'GIT_AUTHOR_DATE': date, 'GIT_COMMITTER_DATE': date}
+    with repo.git.custom_environment(**env):
+        repo.git.commit('-q', '-m', message)
+
+
+def generate_repo(target_path, *, layout='maven', files=200, file_lines=150, duplication=0.1, commits=5,
+                  test_ratio=0.2, dirty_files=10, seed=0):
+    """
+    生成用于性能测试的java仓库
+    :param target_path: 仓库目录，不能已存在
+    :param layout: 目录结构，maven或gradle
+    :param files: java文件数量
+    :param file_lines: 每个java文件的行数
+    :param duplication: 包含重复代码块的文件比例
+    :param commits: 提交数量，第一次提交添加全部文件，之后每次提交修改部分文件
+    :param test_ratio: 测试代码文件的比例
+    :param dirty_files: 最后一次提交之后，工作区中修改的文件数量，用于mode=2
+    :param seed: 随机数种子，相同的参数和种子生成相同的仓库
+    :return: 仓库信息dict
+    """
+    if path.exists(target_path):
+        raise FileExistsError(f'{target_path} already exists')
+    if layout not in LAYOUTS:
+        raise ValueError(f'unknown layout {layout}')
+    rnd = random.Random(seed)
+    config = LAYOUTS[layout]
+    name = path.basename(path.abspath(target_path))
+
+    sources = []
+    for i in range(files):
+        scope = 'test' if rnd.random() < test_ratio else 'main'
+        package = f'com.example.{PACKAGES[i % len(PACKAGES)]}.m{i // 50}'
+        class_name = f'Sample{i}Test' if scope == 'test' else f'Sample{i}'
+        java_file = path.join('src', scope, 'java', *package.split('.'), f'{class_name}.java')
+        class_file = path.join(config['classes'][scope], *package.split('.'), f'{class_name}.class')
+        sources.append((java_file, class_file, package, class_name, rnd.random() < duplication))
+
+    os.makedirs(target_path)
+    repo = git.Repo.init(target_path)
+    with repo.config_writer() as writer:
+        writer.set_value('user', 'name', 'benchmark')
+        writer.set_value('user', 'email', 'benchmark@example.com')
+    build_file, build_content = config['build_file']
+    _write(path.join(target_path, build_file), build_content.format(name=name))
+    _write(path.join(target_path, '.gitignore'), f"{config['classes']['main'].split(os.sep)[0]}/\ncheck_result/\n")
+
+    def write_sources(items, revision):
+        for java_file, class_file, package, class_name, duplicated in items:
+            lines = file_lines + revision % 7
+            _write(path.join(target_path, java_file),
+                   generate_java_source(rnd, package, class_name, lines, duplicated))
+            _write(path.join(target_path, class_file),
+                   generate_class_stub(f"{package.replace('.', '/')}/{class_name}", f'{class_name}.java'))
+
+    write_sources(sources, 0)
+    repo.git.add('-A')
+    _commit(repo, 'initial commit', 0)
+    changed_per_commit = max(1, files // 20)
+    for revision in range(1, commits):
+        write_sources(rnd.sample(sources, min(changed_per_commit, len(sources))), revision)
+        repo.git.add('-A')
+        _commit(repo, f'change {revision}', revision)
+    dirty = rnd.sample(sources, min(dirty_files, len(sources)))
+    write_sources(dirty, commits)
+
+    return {
+        'path': path.abspath(target_path),
+        'layout': layout,
+        'files': files,
+        'file_lines': file_lines,
+        'duplication': duplication,
+        'commits': commits,
+        'dirty_files': [path.join(path.abspath(target_path), item[0]) for item in dirty],
+        'seed': seed,
+    }
@@ -0,0 +1,198 @@
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from os import path
+
+import git
+
+# 场景名称到检查参数的映射，files场景检查工作区中修改的文件
+SCENARIOS = {
+    'mode1': {'mode': '1'},
+    'mode2': {'mode': '2'},
+    'mode3': {'mode': '3'},
+    'files': {'mode': '2', 'files': True},
+}
+
+
+def read_plugin_times(trace_file):
+    """
+    从trace文件中读取每个插件的耗时
+    :param trace_file: chrome trace格式的文件
+    :return: dict，插件名称到耗时的映射，单位秒
+    """
+    with open(trace_file, 'r', encoding='utf-8') as fp:
+        events = json.load(fp)['traceEvents']
+    times = {}
+    for event in events:
+        if event.get('ph') == 'X' and event.get('cat') == 'plugin':
+            times[event['name']] = times.get(event['name'], 0) + event['dur'] / 1e6
+    return times
+
+
+def get_changed_files(repo_path):
+    """
+    获取工作区中相对于HEAD修改的java文件
+    :param repo_path: 仓库目录
+    :return: 文件全路径列表
+    """
+    repo = git.Repo(repo_path)
+    return [path.join(repo.working_tree_dir, name)
+            for name in repo.git.diff('--name-only', '-z', 'HEAD').split('\0') if name.endswith('.java')]
+
+
+def run_scenario(repo_path, tool_set_path, scenario, *, plugins, jobs=None, enable_cache=False, cache_dir=None):
+    """
+    执行一次检查，记录总耗时和每个插件的耗时
+    :param repo_path: 仓库目录
+    :param tool_set_path: 工具集根目录
+    :param scenario: 场景名称
+    :param plugins: 需要执行的插件列表
+    :param jobs: 并发执行的插件数量
+    :param enable_cache: 是否使用检查结果缓存
+    :param cache_dir: 检查结果缓存目录
+    :return: dict
+    """
+    from checker import check
+
+    options = dict(SCENARIOS[scenario])
+    if options.pop('files', False):
+        options['files'] = ','.join(get_changed_files(repo_path))
+    output_path = tempfile.mkdtemp(prefix='style-checker-bench-')
+    trace_file = path.join(output_path, 'trace.json')
+    try:
+        start = time.perf_counter()
+        status = check(
+            repo_path,
+            tool_set_path,
+            output_path,
+            enable_web=False,
+            port=0,
+            enable_exclude=False,
+            plugins=plugins,
+            jobs=jobs,
+            enable_cache=enable_cache,
+            cache_dir=cache_dir,
+            trace_file=trace_file,
+            **options,
+        )
+        wall = time.perf_counter() - start
+        plugin_times = read_plugin_times(trace_file) if path.exists(trace_file) else {}
+    finally:
+        shutil.rmtree(output_path, ignore_errors=True)
+    return {'scenario': scenario, 'status': status, 'wall': wall, 'plugins': plugin_times}
+
+
+def summarize(runs):
+    """
+    计算每个场景的耗时中位数和最小值
+    :param runs: run_scenario的结果列表
+    :return: dict，场景名称到统计结果的映射
+    """
+    summary = {}
+    for scenario in dict.fromkeys(run['scenario'] for run in runs):
+        items = [run for run in runs if run['scenario'] == scenario]
+        walls = [run['wall'] for run in items]
+        plugin_names = dict.fromkeys(name for run in items for name in run['plugins'])
+        summary[scenario] = {
+            'median': statistics.median(walls),
+            'min': min(walls),
+            'plugins': {name: statistics.median(run['plugins'].get(name, 0) for run in items)
+                        for name in plugin_names},
+        }
+    return summary
+
+
+def get_checker_revision():
+    try:
+        return git.Repo(path.dirname(path.dirname(path.abspath(__file__)))).head.commit.hexsha
+    except (git.InvalidGitRepositoryError, git.NoSuchPathError, ValueError):
+        return ''
+
+
+def run_benchmark(repo_path, tool_set_path, *, scenarios=tuple(SCENARIOS), plugins='checkstyle,pmd,spotbugs,javancss,simian',
+                  repeat=3, jobs=None, enable_cache=False, result_file=None):
+    """
+    对仓库执行多个场景的检查，每个场景重复执行repeat次
+    :param repo_path: 仓库目录
+    :param tool_set_path: 工具集根目录
+    :param scenarios: 场景名称列表
+    :param plugins: 需要执行的插件列表
+    :param repeat: 每个场景的执行次数
+    :param jobs: 并发执行的插件数量
+    :param enable_cache: 是否使用检查结果缓存，开启时第一次执行之后为热缓存的耗时
+    :param result_file: 结果文件路径，为空时不写入文件
+    :return: dict，包含运行环境、每次执行的结果和统计结果
+    """
+    cache_dir = tempfile.mkdtemp(prefix='style-checker-bench-cache-') if enable_cache else None
+    runs = []
+    try:
+        for scenario in scenarios:
+            for i in range(repeat):
+                run = run_scenario(repo_path, tool_set_path, scenario, plugins=plugins, jobs=jobs,
+                                   enable_cache=enable_cache, cache_dir=cache_dir)
+                run['repeat'] = i
+                runs.append(run)
+                print(f"{scenario} #{i}: {run['wall']:.3f}s, status {run['status']}")
+    finally:
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    result = {
+        'meta': {
+            'checker_revision': get_checker_revision(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repo': path.abspath(repo_path),
+            'plugins': plugins,
+            'repeat': repeat,
+            'jobs': jobs,
+            'cache': enable_cache,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'runs': runs,
+        'summary': summarize(runs),
+    }
+    if result_file:
+        with open(result_file, 'w', encoding='utf-8') as fp:
+            json.dump(result, fp, ensure_ascii=False, indent=2)
+        print(f'benchmark result written to {result_file}')
+    return result
+
+
+def compare_results(base_file, new_file, threshold=0.05):
+    """
+    比较两次性能测试的结果，输出每个场景和插件耗时中位数的变化
+    :param base_file: 基准结果文件
+    :param new_file: 新的结果文件
+    :param threshold: 变化比例超过该值时标记为变快或变慢
+    :return: 有场景变慢时返回1，否则返回0
+    """
+    with open(base_file, 'r', encoding='utf-8') as fp:
+        base = json.load(fp)['summary']
+    with open(new_file, 'r', encoding='utf-8') as fp:
+        new = json.load(fp)['summary']
+
+    def line(name, old, current):
+        if not old:
+            return f'{name:<24}{old:>10.3f}{current:>10.3f}', False
+        ratio = (current - old) / old
+        mark = 'slower' if ratio > threshold else 'faster' if ratio < -threshold else ''
+        return f'{name:<24}{old:>10.3f}{current:>10.3f}{ratio:>+9.1%} {mark}', mark == 'slower'
+
+    regressed = False
+    print(f"{'scenario/plugin':<24}{'base':>10}{'new':>10}{'change':>9}")
+    for scenario in base:
+        if scenario not in new:
+            continue
+        text, slower = line(scenario, base[scenario]['median'], new[scenario]['median'])
+        regressed = regressed or slower
+        print(text)
+        for plugin, old in base[scenario]['plugins'].items():
+            if plugin in new[scenario]['plugins']:
+                print(line(f'  {plugin}', old, new[scenario]['plugins'][plugin])[0])
+    return 1 if regressed else 0
@@ -0,0 +1,43 @@
+import importlib
+
+from util.startup import record_import
+from util.util import need_run_check
+
+# 插件名称，触发插件执行的名称列表，插件模块，插件入口，插件检查的语言
+# 插件模块在需要执行时才导入，只执行部分插件时不需要加载其他插件依赖的库
+PLUGINS = [
+    ("checkstyle", ("checkstyle",), "check.checkstyle", "run_checkstyle_check", "java"),
+    ("simian", ("simian",), "check.simian", "run_simian_check", "java"),
+    ("pmd", ("pmd",), "check.pmd", "run_pmd_check", "java"),
+    ("spotbugs", ("spotbugs", "findbugs"), "check.spotbugs", "run_spotbugs_check", "java"),
+    ("javancss", ("javancss",), "check.javancss", "run_javancss_check", "java"),
+    ("pylint", ("pylint",), "check.pylint", "run_pylint_check", "python"),
+]
+
+
+def load_plugin(module_name, func_name):
+    """
+    导入插件模块，获取插件入口
+    :param module_name: 插件模块名称
+    :param func_name: 插件入口函数名称
+    :return: 插件入口函数
+    """
+    with record_import(module_name):
+        module = importlib.import_module(module_name)
+    return getattr(module, func_name)
+
+
+def get_plugins(plugins, languages=None):
+    """
+    根据插件列表导入需要执行的插件
+    :param plugins: 需要执行的插件列表
+    :param languages: 只返回检查这些语言的插件，为空时不限制
+    :return: 列表，元素为(name, func, language)
+    """
+    result = []
+    for name, triggers, module_name, func_name, language in PLUGINS:
+        if languages is not None and language not in languages:
+            continue
+        if any(need_run_check(trigger, plugins) for trigger in triggers):
+            result.append((name, load_plugin(module_name, func_name), language))
+    return result
@@ -2,11 +2,24 @@ import os
 import shutil
 from os import path
 
-import pathspec
 from lxml import etree
 
+from util.baseline import patch_report
+from util.cache import hash_config
+from util.changed_lines import filter_report
+from util.daemon import run_java_tool
 from util.decorators import timer, print_log
-from util.util import filter_files, run, read_from_exclude_files, ant_to_regex
+from util.executor import get_cpu_count, run_tasks
+from util.trace import trace_span
+from util.exclude import filter_excluded
+from util.util import save_file_list
+from util.xml_stream import iter_children, rewrite_xml
+
+# 排除测试代码时，全量检查中不检查的文件
+TEST_PATTERNS = ("**/*Test.java", "**/Test*.java")
+
+# 每个分片至少包含的文件数量，文件过少时分片的启动开销超过并行带来的收益
+MIN_SHARD_FILES = 20
 
 
 @timer
@@ -19,21 +32,32 @@ def run_checkstyle_check(check_params):
     """
     if check_params.mode == "3":
         return run_in_all_mode(
-            check_params.project_path,
+            check_params.changed_java_files,
             check_params.tool_set_path,
             check_params.output_path,
             enable_exclude=check_params.enable_exclude,
             exclude_files_path=check_params.exclude_files_path,
             exclude_test=check_params.exclude_test,
+            incremental_scope=check_params.incremental_scopes.get("checkstyle"),
+            result_cache=check_params.result_cache,
+            shards=check_params.checkstyle_shards,
         )
     else:
-        return run_in_editing_mode(
+        ret = run_in_editing_mode(
             check_params.tool_set_path,
             check_params.output_path,
             check_params.changed_java_files,
             enable_exclude=check_params.enable_exclude,
             exclude_files_path=check_params.exclude_files_path,
+            result_cache=check_params.result_cache,
+            shards=check_params.checkstyle_shards,
         )
+        if check_params.changed_lines is not None and ret >= 0:
+            ret = filter_report(
+                path.join(check_params.output_path, "Checkstyle_Result.xml"),
+                check_params.changed_lines,
+            )
+        return ret
 
 
 def run_in_editing_mode(
@@ -43,6 +67,8 @@ def run_in_editing_mode(
     *,
     enable_exclude=False,
     exclude_files_path=None,
+    result_cache=None,
+    shards=1,
 ):
     """
     执行checkstyle检测
@@ -51,6 +77,8 @@ def run_in_editing_mode(
     :param changed_java_files: 执行检查的java源代码文件
     :param enable_exclude: 是否开启例外配置
     :param exclude_files_path: 例外文件的目录
+    :param result_cache: 检查结果缓存，为空时不使用缓存
+    :param shards: 分片数量，大于1时将文件切分后并行执行，0表示根据cpu数量自动选择
     :return:
     """
     if len(changed_java_files) == 0:
@@ -58,12 +86,9 @@ def run_in_editing_mode(
         return -1
 
     if enable_exclude:
-        left_java_files = filter_files(
-            exclude_files_path,
-            "CheckStyle_Conf.txt",
-            changed_java_files,
-            match=lambda pattern, file: pattern_match(file, pattern),
-        )[:]
+        left_java_files = filter_excluded(
+            exclude_files_path, "checkstyle", changed_java_files
+        )
     else:
         left_java_files = changed_java_files[:]
     if len(left_java_files) == 0:
@@ -74,111 +99,327 @@ def run_in_editing_mode(
     checkstyle_base_file_path = path.join(
         tool_set_path, checkstyle_path, "google_checks.xml"
     )
-    temp_checkstyle_base_file_path = create_temp_checkstyle_base_file(
-        checkstyle_base_file_path, output_path
-    )
     output_file = path.join(output_path, "Checkstyle_Result.xml")
-    cmd = [
-        "java",
-        f'-Dcheckstyle.suppressions.file={path.join(tool_set_path, checkstyle_path, "suppressions.xml")}',
-        "-jar",
-        path.join(tool_set_path, checkstyle_path, checkstyle_jar_name),
-        "-c",
-        temp_checkstyle_base_file_path,
-        "-f",
-        "xml",
-        "-o",
-        output_file,
-    ]
+    properties = {
+        "checkstyle.suppressions.file": path.join(
+            tool_set_path, checkstyle_path, "suppressions.xml"
+        )
+    }
+
+    config_hash = hash_config(
+        checkstyle_jar_name,
+        checkstyle_base_file_path,
+        properties["checkstyle.suppressions.file"],
+    )
+
+    def run(java_files):
+        temp_checkstyle_base_file_path = create_temp_checkstyle_base_file(
+            checkstyle_base_file_path, output_path
+        )
+        ret = run_checkstyle(
+            tool_set_path,
+            temp_checkstyle_base_file_path,
+            properties,
+            java_files,
+            output_file,
+            shards=shards,
+        )
+        os.remove(temp_checkstyle_base_file_path)
+        return ret
+
+    return run_with_cache(result_cache, config_hash, left_java_files, output_file, run)
+
+
+def run_with_cache(result_cache, config_hash, java_files, output_file, run):
+    """
+    使用检查结果缓存执行checkstyle，只检查缓存中没有结果的文件，再将缓存中的结果合并到检查结果文件中
+    :param result_cache: 检查结果缓存，为空时检查全部文件
+    :param config_hash: checkstyle配置的hash
+    :param java_files: 执行检查的java文件
+    :param output_file: xml格式的检查结果文件
+    :param run: 执行检查的函数，参数为需要检查的文件列表，返回checkstyle的退出码
+    :return:
+    """
+    cached_results = {}
+    if result_cache is not None:
+        cached_results, java_files = result_cache.lookup(
+            "checkstyle", config_hash, java_files
+        )
+        if len(java_files) == 0:
+            merge_checkstyle_results(output_file, cached_results)
+            return count_checkstyle_errors(cached_results)
 
-    cmd.extend(left_java_files)
-    ret = run(cmd)
-    os.remove(temp_checkstyle_base_file_path)
+    ret = run(java_files)
+
+    if result_cache is not None and path.exists(output_file):
+        result_cache.store(
+            "checkstyle",
+            config_hash,
+            read_checkstyle_results(output_file, java_files),
+        )
+    if cached_results:
+        merge_checkstyle_results(output_file, cached_results)
+        ret += count_checkstyle_errors(cached_results)
     return ret
 
 
+def read_checkstyle_results(result_file, java_files):
+    """
+    从checkstyle检查结果文件中读取每个文件的检查结果
+    :param result_file: checkstyle xml格式的检查结果文件
+    :param java_files: 执行检查的文件列表
+    :return: dict，文件到检查结果的映射，检查结果为(标签, 属性)列表
+    """
+    files = set(java_files)
+    results = {}
+    for node in iter_children(result_file):
+        if node.tag != "file":
+            continue
+        name = node.attrib.get("name", "")
+        if name in files:
+            results[name] = [[child.tag, dict(child.attrib)] for child in node]
+    return results
+
+
+def merge_checkstyle_results(result_file, cached_results):
+    """
+    将缓存中的检查结果合并到checkstyle检查结果文件中
+    :param result_file: checkstyle xml格式的检查结果文件，不存在时新建
+    :param cached_results: 文件到检查结果的映射
+    :return:
+    """
+
+    def cached_nodes():
+        for name in sorted(cached_results):
+            file_node = etree.Element("file", {"name": name})
+            for tag, attrib in cached_results[name]:
+                etree.SubElement(file_node, tag, attrib)
+            yield file_node
+
+    rewrite_xml(result_file, [(result_file, None)], root=("checkstyle", {"version": "8.30"}), extra=cached_nodes())
+
+
+def count_checkstyle_errors(cached_results):
+    """
+    统计缓存结果中错误级别的违规数量，与checkstyle的退出码保持一致
+    :param cached_results: 文件到检查结果的映射
+    :return:
+    """
+    return sum(
+        1
+        for items in cached_results.values()
+        for tag, attrib in items
+        if tag == "error" and attrib.get("severity") == "error"
+    )
+
+
 def run_in_all_mode(
-    project_path,
+    java_files,
     tool_set_path,
     output_path,
     *,
     enable_exclude=False,
     exclude_files_path=None,
     exclude_test=False,
+    incremental_scope=None,
+    result_cache=None,
+    shards=1,
 ):
     """
     执行checkstyle检测
-    :param project_path: 项目目录
+    :param java_files: 工程中的全部java文件
     :param tool_set_path: 工具集根路径
     :param output_path: 检查结果文件输出路径
     :param enable_exclude: 是否开启例外配置
     :param exclude_files_path: 例外文件的目录
     :param exclude_test: 排除测试代码
+    :param incremental_scope: 相对于基线的增量范围，为空时检查全部java文件
+    :param result_cache: 检查结果缓存，为空时不使用缓存
+    :param shards: 分片数量，大于1时将文件切分后并行执行，0表示根据cpu数量自动选择
     :return:
     """
-    checkstyle_jar_name = "checkstyle-8.30-all.jar"
+    output_file = path.join(output_path, "Checkstyle_Result.xml")
+    if incremental_scope is not None:
+        java_files = incremental_scope.changed_files
+    if enable_exclude:
+        # 例外的文件直接从文件列表中去掉，不再交给checkstyle解析之后再屏蔽结果
+        java_files = filter_excluded(
+            exclude_files_path,
+            "checkstyle",
+            java_files,
+            kind="ant",
+            extra_patterns=TEST_PATTERNS if exclude_test else (),
+        )
+    if incremental_scope is not None and len(java_files) == 0:
+        patch_report(incremental_scope, output_file)
+        return 0
+    if len(java_files) == 0:
+        print("no files to run checkstyle check")
+        return -1
     checkstyle_path = "checkstyle-8.30"
     checkstyle_base_file_path = path.join(
         tool_set_path, checkstyle_path, "google_checks.xml"
     )
-    temp_checkstyle_base_file_path = create_temp_checkstyle_base_file(
-        checkstyle_base_file_path, output_path
-    )
-    output_file = path.join(output_path, "Checkstyle_Result.xml")
-    suppression_file = path.join(output_path, "suppressions.xml")
     base_suppression_file = path.join(
         tool_set_path, checkstyle_path, "suppressions.xml"
     )
-    shutil.copy(base_suppression_file, suppression_file)
+    # 全量检查时suppressions.xml同时作为xpath过滤的配置，与编辑模式的检查结果分开缓存
+    config_hash = hash_config(
+        "checkstyle-8.30-all.jar",
+        checkstyle_base_file_path,
+        base_suppression_file,
+        "suppression-xpath-filter",
+    )
 
-    if enable_exclude:
-        save_suppression_file(exclude_files_path, suppression_file, exclude_test)
+    def run(java_files):
+        temp_checkstyle_base_file_path = create_temp_checkstyle_base_file(
+            checkstyle_base_file_path, output_path
+        )
+        suppression_file = path.join(output_path, "suppressions.xml")
+        shutil.copy(base_suppression_file, suppression_file)
 
-    cmd = [
-        "java",
-        f"-Dcheckstyle.suppressions.file={suppression_file}",
-        "-jar",
-        path.join(tool_set_path, checkstyle_path, checkstyle_jar_name),
+        properties = {"checkstyle.suppressions.file": suppression_file}
+        ret = run_checkstyle(
+            tool_set_path,
+            temp_checkstyle_base_file_path,
+            properties,
+            java_files,
+            output_file,
+            shards=shards,
+        )
+        os.remove(temp_checkstyle_base_file_path)
+        os.remove(suppression_file)
+        return ret
+
+    ret = run_with_cache(result_cache, config_hash, java_files, output_file, run)
+
+    if incremental_scope is not None:
+        patch_report(incremental_scope, output_file)
+    return ret
+
+
+def run_checkstyle(
+    tool_set_path,
+    config_file,
+    properties,
+    java_files,
+    output_file,
+    *,
+    shards=1,
+):
+    """
+    执行checkstyle，分片数量大于1时将文件切分为多个分片并行执行，再按照分片顺序合并检查结果
+    常驻JVM进程可用时各分片在常驻进程的多个线程中执行，否则每个分片启动一个JVM
+    :param tool_set_path: 工具集根路径
+    :param config_file: checkstyle配置文件
+    :param properties: 传递给checkstyle的系统属性
+    :param java_files: 执行检查的java文件
+    :param output_file: xml格式的检查结果文件
+    :param shards: 分片数量，0表示根据cpu数量自动选择
+    :return: 各分片的退出码之和，即错误级别的问题数量
+    """
+    file_shards = split_shards(java_files, get_shard_count(shards, len(java_files)))
+    if len(file_shards) <= 1:
+        return run_checkstyle_shard(
+            tool_set_path, config_file, properties, java_files, output_file
+        )
+    base_name = path.splitext(output_file)[0]
+    shard_files = [f"{base_name}.{index}.xml" for index in range(len(file_shards))]
+    tasks = [
+        (
+            f"checkstyle-shard-{index}",
+            run_checkstyle_shard,
+            (tool_set_path, config_file, properties, files, shard_file),
+            {},
+        )
+        for index, (files, shard_file) in enumerate(zip(file_shards, shard_files))
+    ]
+    results = run_tasks(tasks, len(tasks))
+    # 分片是连续的文件区间，按照分片顺序合并后与不分片执行时的文件顺序一致
+    rewrite_xml(
+        output_file,
+        [(shard_file, None) for shard_file in shard_files],
+        root=("checkstyle", {"version": "8.30"}),
+    )
+    for shard_file in shard_files:
+        if path.exists(shard_file):
+            os.remove(shard_file)
+    failed = [name for name, ret in results.items() if ret is None or ret < 0]
+    if failed:
+        print(f"checkstyle shards failed: {', '.join(failed)}")
+        return -2
+    return sum(results.values())
+
+
+def run_checkstyle_shard(
+    tool_set_path, config_file, properties, java_files, output_file
+):
+    """
+    启动一次checkstyle检查，文件列表通过@argfile传入，避免文件较多时超过命令行长度限制
+    :param tool_set_path: 工具集根路径
+    :param config_file: checkstyle配置文件
+    :param properties: 传递给checkstyle的系统属性
+    :param java_files: 执行检查的java文件
+    :param output_file: xml格式的检查结果文件
+    :return: checkstyle的退出码
+    """
+    file_list = path.splitext(output_file)[0] + "_files.txt"
+    save_file_list(file_list, java_files, quote=True)
+    tool_args = [
         "-c",
-        temp_checkstyle_base_file_path,
+        config_file,
         "-f",
         "xml",
         "-o",
         output_file,
-        project_path,
+        f"@{file_list}",
     ]
-    ret = run(cmd)
-    os.remove(temp_checkstyle_base_file_path)
-    os.remove(suppression_file)
-
-    if os.path.exists(output_file):
-        temp_result_file = path.join(output_path, "Checkstyle_Result_1.xml")
-        filter_xml_nodes(output_file, temp_result_file)
-        os.remove(output_file)
-        shutil.copy(temp_result_file, output_file)
-        os.remove(temp_result_file)
+    cmd = [
+        "java",
+        *[f"-D{key}={value}" for key, value in properties.items()],
+        "-jar",
+        path.join(tool_set_path, "checkstyle-8.30", "checkstyle-8.30-all.jar"),
+        *tool_args,
+    ]
+    ret = run_java_tool("checkstyle", tool_set_path, tool_args, cmd, properties)
+    os.remove(file_list)
     return ret
 
 
-def filter_xml_nodes(input_file, output_file):
-    tree = etree.parse(input_file)
-    root = tree.getroot()
-
-    for node in root.findall(".//"):
-        if node.tag == "file":
-            name = node.attrib.get("name", "")
-            if not name.endswith(".java"):
-                root.remove(node)
-
-    tree.write(output_file, encoding="utf-8", xml_declaration=True)
+def get_shard_count(shards, file_count):
+    """
+    计算实际使用的分片数量
+    :param shards: 用户指定的分片数量，0表示根据cpu数量自动选择
+    :param file_count: 执行检查的文件数量
+    :return: 分片数量，保证每个分片至少包含MIN_SHARD_FILES个文件
+    """
+    shards = get_cpu_count() if not shards or shards < 1 else shards
+    return max(1, min(shards, file_count // MIN_SHARD_FILES))
 
 
-def pattern_match(filename, pattern):
-    patterns = [pattern]
-    spec = pathspec.PathSpec.from_lines("gitwildmatch", patterns)
-    return spec.match_file(filename)
+def split_shards(files, count):
+    """
+    按照文件大小将文件列表切分为count个连续的分片，各分片的文件大小之和尽量接近
+    :param files: 文件列表
+    :param count: 分片数量
+    :return: 分片列表，每个分片为文件列表，不包含空的分片
+    """
+    if count <= 1:
+        return [list(files)] if files else []
+    sizes = [path.getsize(file) if path.isfile(file) else 0 for file in files]
+    total = sum(sizes) or 1
+    shards = [[]]
+    accumulated = 0
+    for file, size in zip(files, sizes):
+        # 累计大小超过当前分片的目标边界时开始新的分片
+        if shards[-1] and len(shards) < count and accumulated >= total * len(shards) / count:
+            shards.append([])
+        shards[-1].append(file)
+        accumulated += size
+    return shards
 
 
+@trace_span("config")
 def create_temp_checkstyle_base_file(
     checkstyle_base_file_path, full_output_path
 ):
@@ -202,40 +443,3 @@ def create_temp_checkstyle_base_file(
         fp.writelines(new_lines)
 
     return result_file
-
-
-def save_suppression_file(exclude_files_path, suppression_file, exclude_test):
-    """
-    修改基础suppression文件，将不执行检查的文件添加进去
-    :param exclude_files_path:  排除文件路径
-    :param suppression_file: 例外文件路径
-    :param exclude_test:
-    :return:
-    """
-    tree = etree.parse(suppression_file)
-    root = tree.getroot()
-    exclude_file = path.join(exclude_files_path, "CheckStyle_Conf.txt")
-    if exclude_test:
-        suppress_element = etree.Element(
-            "suppress", {"checks": "", "files": ant_to_regex("**/*Test.java")}
-        )
-        root.append(suppress_element)
-        suppress_element = etree.Element(
-            "suppress", {"checks": "", "files": ant_to_regex("**/Test*.java")}
-        )
-        root.append(suppress_element)
-    exclude_files = read_from_exclude_files(exclude_file)
-    for exclude_file in exclude_files:
-        suppression_element = etree.Element(
-            "suppress", {"checks": "", "files": ant_to_regex(exclude_file)}
-        )
-        root.append(suppression_element)
-    doc = etree.ElementTree(root)
-    doc.write(
-        suppression_file,
-        pretty_print=True,
-        xml_declaration=True,
-        encoding="UTF-8",
-        doctype='<!DOCTYPE suppressions PUBLIC "-//Puppy Crawl//DTD Suppressions 1.1//EN"'
-        ' "http://www.puppycrawl.com/dtds/suppressions_1_1.dtd">',
-    )
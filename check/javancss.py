@@ -1,55 +1,127 @@
 import os
-import re
 from os import path
+from types import SimpleNamespace
 from xml.etree import cElementTree
 
 import lizard
 from lxml import etree
 
+from util.cache import hash_config
 from util.decorators import timer, print_log
-from util.util import filter_files
+from util.trace import trace_span
+from util.exclude import filter_excluded
 
 
 @timer
 @print_log('javancss')
-def run_javancss_check(tool_set_path, output_path, changed_java_files, *,
-                       enable_exclude=False,
-                       exclude_files_path=None):
+def run_javancss_check(check_params):
     """
     执行圈复杂度检测，检测阈值为10
     使用检测工具中自带的lizard.py文件执行检查，不强制要求执行环境中安装lizard模块
-    :param tool_set_path: 检查工具集路径
-    :param output_path: 检插结果文件输出路径
-    :param changed_java_files: 执行检查的java源代码文件
-    :param enable_exclude: 是否开启例外文件配置
-    :param exclude_files_path: 例外文件目录
+    :param check_params: 检查参数
     :return:
     """
+    tool_set_path = check_params.tool_set_path
+    output_path = check_params.output_path
+    changed_java_files = check_params.changed_java_files
+    enable_exclude = check_params.enable_exclude
+    exclude_files_path = check_params.exclude_files_path
     if len(changed_java_files) == 0:
         print('no files to run javancss check')
         return -1
     output_file = path.join(output_path, 'Lizard_Result.xml')
     if enable_exclude:
-        left_java_files = filter_files(exclude_files_path, 'JavaNCSS_Conf.txt', changed_java_files,
-                                       match=lambda pattern, filename: re.search(pattern, filename) is not None)[:]
+        left_java_files = filter_excluded(exclude_files_path, 'javancss', changed_java_files)
     else:
         left_java_files = changed_java_files[:]
     if len(left_java_files) == 0:
         print('no files to run javancss check')
         return -1
-    generate_lizard_xml_file(left_java_files, output_file)
+    results = analyze_files(left_java_files, check_params.result_cache)
+    if check_params.changed_lines is not None:
+        results = filter_functions(results, check_params.changed_lines)
+        if not results:
+            print('no changed functions to report')
+            return 0
+    generate_lizard_xml_file(results, output_file)
     convert_lizard_xml_to_html(tool_set_path, output_path)
     return 0
 
 
-def generate_lizard_xml_file(source_files, output_file):
+@trace_span("lizard")
+def analyze_files(source_files, result_cache=None):
     """
-    使用lizard.py执行文件分析，生成xml文件
+    使用lizard.py执行文件分析，内容未变化的文件直接使用缓存中的分析结果
     :param source_files: 需要执行分析的文件列表
+    :param result_cache: 检查结果缓存，为空时不使用缓存
+    :return: 与source_files顺序一致的分析结果列表
+    """
+    cached = {}
+    misses = source_files
+    config_hash = hash_config('lizard', getattr(lizard, 'version', ''))
+    if result_cache is not None:
+        cached, misses = result_cache.lookup('lizard', config_hash, source_files)
+    analyzed = {source_file: lizard.analyze_file(source_file) for source_file in misses}
+    if result_cache is not None and analyzed:
+        result_cache.store('lizard', config_hash,
+                           {source_file: dump_file_result(result) for source_file, result in analyzed.items()})
+    return [analyzed[source_file] if source_file in analyzed else load_file_result(source_file, cached[source_file])
+            for source_file in source_files]
+
+
+def filter_functions(results, changed_lines):
+    """
+    只保留包含新增或修改的行的函数，没有保留函数的文件不再输出
+    :param results: lizard的文件分析结果列表
+    :param changed_lines: 文件全路径到ChangedLines的映射
+    :return: 过滤后的文件分析结果列表
+    """
+    filtered = []
+    for result in results:
+        lines = changed_lines.get(path.normpath(result.filename))
+        if lines is None:
+            filtered.append(result)
+            continue
+        functions = [function for function in result.function_list
+                     if lines.overlaps(function.start_line, function.end_line)]
+        if functions:
+            filtered.append(SimpleNamespace(filename=result.filename, function_list=functions))
+    return filtered
+
+
+def dump_file_result(result):
+    """
+    将lizard的文件分析结果转换为可以缓存的数据
+    :param result: lizard的文件分析结果
+    :return: list，每个函数的度量数据
+    """
+    return [{'long_name': function.long_name,
+             'start_line': function.start_line,
+             'end_line': function.end_line,
+             'nloc': function.nloc,
+             'cyclomatic_complexity': function.cyclomatic_complexity}
+            for function in result.function_list]
+
+
+def load_file_result(source_file, functions):
+    """
+    从缓存数据中还原lizard的文件分析结果，只包含生成结果文件需要的属性
+    :param source_file: 文件路径
+    :param functions: 缓存的函数度量数据
+    :return:
+    """
+    function_list = [SimpleNamespace(filename=source_file, **function) for function in functions]
+    return SimpleNamespace(filename=source_file, function_list=function_list)
+
+
+@trace_span("xml")
+def generate_lizard_xml_file(results, output_file):
+    """
+    根据lizard的分析结果，生成xml文件
+    :param results: lizard的文件分析结果列表
     :param output_file: 输出文件
     :return:
     """
-    results = [lizard.analyze_file(source_file) for source_file in source_files]
 
     xml = cElementTree.Element("xml")
     xsl = r'type="text/xsl" href="https://raw.githubusercontent.com/terryyin/lizard/master/lizard.xsl"'
@@ -125,6 +197,7 @@ def convert_lizard_xml_to_html(tool_set_path, output_path):
     os.remove(xml_path)
 
 
+@trace_span("xslt")
 def convert_xml_to_html(xml_path, html_path, xsl_path):
     """
     将lizard xml格式的结果转换成html
@@ -1,12 +1,19 @@
+import hashlib
+import math
 import os.path
-import shutil
 from os import path
-import re
-
-import xml.etree.ElementTree as cElementTree
 
+from util.baseline import patch_report
+from util.cache import hash_config
+from util.changed_lines import filter_report
+from util.daemon import run_java_tool
 from util.decorators import timer, print_log
-from util.util import filter_files, run, is_windows, read_from_exclude_files
+from util.exclude import filter_excluded
+from util.executor import get_cpu_count
+from util.util import get_cache_dir, is_windows, save_file_list
+
+# 每个分析线程至少分析的文件数量，文件较少时多线程的调度开销超过收益
+MIN_THREAD_FILES = 50
 
 
 @timer
@@ -17,22 +24,46 @@ def run_pmd_check(check_params):
     :param check_params: 检查参数
     :return:
     """
+    incremental_scope = check_params.incremental_scopes.get("pmd")
+    cache_file = None
+    if check_params.result_cache is not None:
+        # pmd只把本次分析的文件写回缓存，分析全部文件和只分析变动文件的检查使用不同的缓存文件，
+        # 避免编辑模式的检查覆盖全量检查的缓存
+        full = check_params.mode == "3" and incremental_scope is None
+        cache_file = get_cache_file(
+            check_params.project_path,
+            check_params.tool_set_path,
+            enable_exclude=check_params.enable_exclude,
+            exclude_files_path=check_params.exclude_files_path,
+            scope="all" if full else "changed",
+        )
     if check_params.mode == "3":
         return run_in_all_mode(
             check_params.tool_set_path,
             check_params.output_path,
-            check_params.project_path,
+            check_params.changed_java_files,
             enable_exclude=check_params.enable_exclude,
             exclude_files_path=check_params.exclude_files_path,
+            incremental_scope=incremental_scope,
+            cache_file=cache_file,
         )
     else:
-        return run_in_editing_mode(
+        ret = run_in_editing_mode(
             check_params.tool_set_path,
             check_params.output_path,
             check_params.changed_java_files,
             enable_exclude=check_params.enable_exclude,
             exclude_files_path=check_params.exclude_files_path,
+            cache_file=cache_file,
         )
+        # pmd发现问题时退出码为4，过滤之后没有问题时视为成功
+        if check_params.changed_lines is not None and ret == 4:
+            errors = filter_report(
+                path.join(check_params.output_path, "JavaPMD_Result.xml"),
+                check_params.changed_lines,
+            )
+            ret = 4 if errors else 0
+        return ret
 
 
 def run_in_editing_mode(
@@ -41,7 +72,8 @@ def run_in_editing_mode(
     changed_java_files,
     *,
     enable_exclude=False,
-    exclude_files_path=None
+    exclude_files_path=None,
+    cache_file=None
 ):
     """
     执行pmd检测
@@ -50,60 +82,51 @@ def run_in_editing_mode(
     :param changed_java_files: 执行检查的java源代码文件
     :param enable_exclude: 是否开启例外配置
     :param exclude_files_path: 例外文件目录
+    :param cache_file: pmd增量分析缓存文件，为空时不使用缓存
     :return:
     """
     if len(changed_java_files) == 0:
         print("no files to run pmd check")
         return -1
     output_file = path.join(output_path, "JavaPMD_Result.xml")
-    program = "pmd.bat" if is_windows() else "run.sh"
-    base_rule_path = path.join(
-        tool_set_path, "pmd-6.35.0", "rulesets", "quickstart.xml"
-    )
-    rule_full_name = os.path.join(output_path, "pmd-rules.xml")
-    shutil.copy(base_rule_path, rule_full_name)
-
     if enable_exclude:
-        create_temp_pmd_rule_file(
-            base_rule_path,
-            os.path.join(exclude_files_path, "JavaPMD_Conf.txt"),
-            rule_full_name,
+        left_java_files = filter_excluded(
+            exclude_files_path, "pmd", changed_java_files
         )
-        left_java_files = filter_files(
-            exclude_files_path,
-            "JavaPMD_Conf.txt",
-            changed_java_files,
-            match=lambda pattern, filename: re.search(pattern, filename) is not None,
-        )[:]
     else:
         left_java_files = changed_java_files[:]
     if len(left_java_files) == 0:
         print("no files to run pmd check")
         return -1
-    cmd = [
-        path.join(tool_set_path, "pmd-6.35.0", "bin", program),
-        "-d",
-        ",".join(left_java_files),
+    # 文件列表通过-filelist传入，变动文件较多时逗号拼接的-d参数会超过命令行长度限制
+    file_list = path.join(output_path, "pmd_files.txt")
+    save_file_list(file_list, left_java_files)
+    tool_args = [
+        "-filelist",
+        file_list,
         "-R",
-        rule_full_name,
+        get_rule_path(tool_set_path),
         "-f",
         "xml",
         "-r",
         output_file,
+        *get_analysis_options(len(left_java_files), cache_file),
     ]
-    ret = run(cmd)
-    if rule_full_name:
-        os.remove(rule_full_name)
+    cmd = [*get_pmd_command(tool_set_path), *tool_args]
+    ret = run_java_tool("pmd", tool_set_path, tool_args, cmd)
+    os.remove(file_list)
     return ret
 
 
 def run_in_all_mode(
     tool_set_path,
     output_path,
-    project_path,
+    java_files,
     *,
     enable_exclude=False,
-    exclude_files_path=None
+    exclude_files_path=None,
+    incremental_scope=None,
+    cache_file=None
 ):
     """
     执行pmd检测
@@ -111,56 +134,114 @@ def run_in_all_mode(
     :param output_path: 检查结果文件输出路径
     :param enable_exclude: 是否开启例外配置
     :param exclude_files_path: 例外文件目录
-    :param project_path: 项目工程目录
+    :param java_files: 工程中的全部java文件
+    :param incremental_scope: 相对于基线的增量范围，为空时检查全部java文件
+    :param cache_file: pmd增量分析缓存文件，为空时不使用缓存
     :return:
     """
     output_file = path.join(output_path, "JavaPMD_Result.xml")
-    program = "pmd.bat" if is_windows() else "run.sh"
+    if incremental_scope is not None:
+        java_files = incremental_scope.changed_files
+    if enable_exclude:
+        # 例外的文件直接从文件列表中去掉，不再交给pmd解析之后通过exclude-pattern屏蔽
+        java_files = filter_excluded(exclude_files_path, "pmd", java_files)
+    if incremental_scope is not None and len(java_files) == 0:
+        patch_report(incremental_scope, output_file)
+        return 0
+    if len(java_files) == 0:
+        print("no files to run pmd check")
+        return -1
 
-    base_rule_path = path.join(
-        tool_set_path, "pmd-6.35.0", "rulesets", "quickstart.xml"
-    )
-    rule_full_name = os.path.join(output_path, "pmd-rules.xml")
-    shutil.copy(base_rule_path, rule_full_name)
-    cmd = [
-        path.join(tool_set_path, "pmd-6.35.0", "bin", program),
-        "-d",
-        project_path,
+    # 文件列表通过-filelist传入，避免命令行过长
+    file_list = path.join(output_path, "pmd_files.txt")
+    save_file_list(file_list, java_files)
+    tool_args = [
+        "-filelist",
+        file_list,
         "-R",
-        rule_full_name,
+        get_rule_path(tool_set_path),
         "-f",
         "xml",
         "-r",
         output_file,
+        *get_analysis_options(len(java_files), cache_file),
     ]
-    if enable_exclude:
-        create_temp_pmd_rule_file(
-            base_rule_path,
-            os.path.join(exclude_files_path, "JavaPMD_Conf.txt"),
-            rule_full_name,
-        )
-    ret = run(cmd)
-    if rule_full_name:
-        os.remove(rule_full_name)
+    cmd = [*get_pmd_command(tool_set_path), *tool_args]
+    ret = run_java_tool("pmd", tool_set_path, tool_args, cmd)
+    os.remove(file_list)
+    if incremental_scope is not None:
+        patch_report(incremental_scope, output_file)
     return ret
 
 
-def create_temp_pmd_rule_file(base_rule_path, exclude_file, rule_full_name):
+def get_rule_path(tool_set_path):
     """
-    修改基础base rule文件，将不执行检查的文件添加进去
-    :param base_rule_path:  pmd rule文件的路径
-    :param exclude_file:  排除文件路径
-    :param rule_full_name: 生成新的pmd rule文件的全路径
+    获取pmd使用的规则文件
+    :param tool_set_path: 工具集根路径
     :return:
     """
-    exclude_files = read_from_exclude_files(exclude_file)
-    cElementTree.register_namespace("", "http://pmd.sourceforge.net/ruleset/2.0.0")
-    cElementTree.register_namespace("", "http://pmd.sourceforge.net/ruleset/2.0.0")
-    tree = cElementTree.parse(base_rule_path)
-    root = tree.getroot()
-    for exclude_file in exclude_files:
-        new_node = cElementTree.Element("exclude-pattern")
-        new_node.text = exclude_file
-        root.append(new_node)
-        pass
-    tree.write(rule_full_name, encoding="utf-8", xml_declaration=True)
+    return path.join(tool_set_path, "pmd-6.35.0", "rulesets", "quickstart.xml")
+
+
+def get_analysis_options(file_count, cache_file=None):
+    """
+    获取pmd的分析线程数量和增量分析缓存参数
+    线程数量根据可用的cpu数量和文件数量计算，每个线程至少分析MIN_THREAD_FILES个文件
+    :param file_count: 执行检查的文件数量
+    :param cache_file: pmd增量分析缓存文件，为空时不使用缓存
+    :return: 参数列表
+    """
+    threads = max(1, min(get_cpu_count(), math.ceil(file_count / MIN_THREAD_FILES)))
+    options = ["-threads", str(threads)]
+    if cache_file:
+        options.extend(["-cache", cache_file])
+    return options
+
+
+def get_cache_file(
+    project_path,
+    tool_set_path,
+    *,
+    enable_exclude=False,
+    exclude_files_path=None,
+    scope="all"
+):
+    """
+    获取工程的pmd增量分析缓存文件，规则文件或例外配置变化之后使用新的缓存文件，旧的缓存文件被删除
+    pmd根据文件内容的校验和判断文件是否变化，未变化的文件直接使用缓存中的问题，不再解析和类型推断
+    :param project_path: 工程目录
+    :param tool_set_path: 工具集根路径
+    :param enable_exclude: 是否开启例外配置
+    :param exclude_files_path: 例外文件目录
+    :param scope: all表示分析工程中全部文件的检查，changed表示只分析变动文件的检查，两者使用不同的缓存文件
+    :return: 缓存文件的全路径
+    """
+    config_hash = hash_config(
+        "pmd-6.35.0",
+        get_rule_path(tool_set_path),
+        path.join(exclude_files_path, "JavaPMD_Conf.txt")
+        if enable_exclude and exclude_files_path
+        else "",
+        enable_exclude,
+    )
+    project_key = hashlib.sha1(path.abspath(project_path).encode()).hexdigest()[:16]
+    cache_dir = get_cache_dir("pmd", project_key)
+    cache_name = f"{config_hash}-{scope}.cache"
+    for name in os.listdir(cache_dir):
+        if name.endswith(".cache") and not name.startswith(f"{config_hash}-"):
+            try:
+                os.remove(path.join(cache_dir, name))
+            except OSError:
+                pass
+    return path.join(cache_dir, cache_name)
+
+
+def get_pmd_command(tool_set_path):
+    """
+    获取启动pmd的命令，linux/mac平台下的run.sh需要指定应用名称
+    :param tool_set_path: 工具集根路径
+    :return: 命令列表
+    """
+    if is_windows():
+        return [path.join(tool_set_path, "pmd-6.35.0", "bin", "pmd.bat")]
+    return [path.join(tool_set_path, "pmd-6.35.0", "bin", "run.sh"), "pmd"]
@@ -1,6 +1,6 @@
 import os
 from pylint import lint
-from contextlib import redirect_stdout, redirect_stderr
+from pylint.reporters.text import TextReporter
 
 from util.decorators import timer, print_log
 
@@ -15,12 +15,11 @@ def run_pylint_check(check_params):
     """
     if check_params.mode == "3":
         return run_in_all_mode(
-            check_params.project_path,
             check_params.tool_set_path,
             check_params.output_path,
+            check_params.changed_python_files,
             enable_exclude=check_params.enable_exclude,
             exclude_files_path=check_params.exclude_files_path,
-            exclude_test=check_params.exclude_test,
         )
     else:
         return run_in_editing_mode(
@@ -62,25 +61,22 @@ def run_in_editing_mode(
 
 
 def run_in_all_mode(
-    project_path,
     tool_set_path,
     output_path,
+    python_files,
     *,
     enable_exclude=False,
     exclude_files_path=None,
-    exclude_test=False,
 ):
     """
     对所有文件执行pylint检查
-    :param project_path 工程目录
     :param tool_set_path: 检查工具集路径
     :param output_path: 检插结果文件输出路径
+    :param python_files: 工程中的全部python文件，已按照.gitignore和是否排除测试文件过滤
     :param enable_exclude: 是否开启例外文件配置
     :param exclude_files_path: 例外文件目录
-    :param exclude_test 排除测试文件
     :return:
     """
-    python_files = get_python_files(project_path, exclude_test)
     if len(python_files) == 0:
         print("no files to run pylint check")
         return -1
@@ -107,33 +103,14 @@ def run_pylint(
     check_result_file = os.path.join(output_path, "Pylint.txt")
     rcfile_path = os.path.join(tool_set_path, "pylint", ".pylintrc")
     args = [
-        f"--output-format=text",
         "--reports=y",
         "--recursive=y",
         *python_files,
         f"--rcfile={rcfile_path}",
     ]
 
+    # 通过reporter写入结果文件，而不是替换全局的stdout，以便与其他插件并发执行
     with open(check_result_file, "w", encoding="utf-8") as f:
-        with redirect_stdout(f), redirect_stderr(f):
-            lint.Run(args, exit=False)
-            return 0
-
-
-def get_python_files(directory, exclude_test):
-    """
-    获取目录下的所有python文件
-    :param directory: 目录
-    :param exclude_test: 排除test代码
-    :return:
-    """
-    reserved_path_patterns = [".", "/node_modules/", "/dist/", "build/"]
-    python_files = []
-    for root, _, files in os.walk(directory):
-        if not any(pattern in root for pattern in reserved_path_patterns):
-            for file in files:
-                if file.endswith(".py"):
-                    if not exclude_test or "/tests/" not in root:
-                        python_files.append(os.path.join(root, file))
+        lint.Run(args, reporter=TextReporter(f), exit=False)
+        return 0
 
-    return python_files
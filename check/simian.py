@@ -3,49 +3,112 @@ from os import path
 
 from lxml import etree
 
+from util.cache import hash_file
+from util.daemon import run_java_tool
 from util.decorators import timer, print_log
-from util.util import filter_files, run
+from util.duplicates import DuplicateIndex, analyze_file, find_duplicates, write_simian_xml
+from util.trace import trace_span
+from util.exclude import filter_excluded
+from util.source import get_repo, get_all_files, get_blob_ids
+from util.toolchain import get_java_version
+from util.util import save_file_list
 
 
 @timer
 @print_log('simian')
-def run_simian_check(tool_set_path, output_path, changed_java_files, *, enable_exclude=False, exclude_files_path=None):
+def run_simian_check(check_params):
     """
     执行重复代码检测，阈值为20行
-    :param tool_set_path: 工具集根路径
-    :param output_path: 检查结果文件输出路径
-    :param changed_java_files: 执行检查的java源代码文件
-    :param enable_exclude: 是否开启例外配置
-    :param exclude_files_path: 例外配置文件目录
+    默认在工程级的重复代码索引中查找变动的文件与整个工程的重复代码，duplicate_engine为simian时使用simian jar包只检查变动的文件之间的重复
+    :param check_params: 检查参数
     :return:
     """
+    tool_set_path = check_params.tool_set_path
+    output_path = check_params.output_path
+    changed_java_files = check_params.changed_java_files
+    enable_exclude = check_params.enable_exclude
+    exclude_files_path = check_params.exclude_files_path
     if len(changed_java_files) == 0:
         print('no files to run simian check')
         return -1
     output_file = path.join(output_path, 'Simian_Result.xml')
-    cmd = [
-        'java',
-        '-jar',
-        path.join(tool_set_path, 'simian-2.3.33', 'simian-2.3.33.jar'),
-        '-threshold=20',
-        f'-formatter=xml:{output_file}'
-    ]
 
     if enable_exclude:
-        left_java_files = filter_files(exclude_files_path, 'Simian_Conf.txt', changed_java_files,
-                                       match=lambda pattern, filename: pattern in filename)[:]
+        left_java_files = filter_excluded(exclude_files_path, 'simian', changed_java_files)
     else:
         left_java_files = changed_java_files[:]
     if len(left_java_files) == 0:
         print('no files to run simian check')
         return -1
 
-    cmd.extend(left_java_files)
-    ret = run(cmd)
+    if check_params.duplicate_engine == 'index':
+        ret = run_duplicate_index(check_params, left_java_files, output_file)
+        convert_simian_xml_to_html(tool_set_path, output_path)
+        return ret
+
+    options = ['-threshold=20', f'-formatter=xml:{output_file}']
+    jar_args = ['-jar', path.join(tool_set_path, 'simian-2.3.33', 'simian-2.3.33.jar'), *options]
+    # simian本身不支持@argfile，常驻JVM进程中由进程展开文件列表
+    file_list = path.join(output_path, 'simian_files.txt')
+    save_file_list(file_list, left_java_files, quote=True)
+    tool_args = [*options, f'@{file_list}']
+    temp_files = [file_list]
+    if get_java_version() >= 9:
+        # java 9之后启动器支持@argfile，参数文件中可以包含-jar之后的程序参数，避免超过命令行长度限制
+        launcher_file = path.join(output_path, 'simian_args.txt')
+        save_file_list(launcher_file, [*jar_args, *left_java_files], quote=True)
+        cmd = ['java', f'@{launcher_file}']
+        temp_files.append(launcher_file)
+    else:
+        cmd = ['java', *jar_args, *left_java_files]
+    ret = run_java_tool('simian', tool_set_path, tool_args, cmd)
+    for temp_file in temp_files:
+        os.remove(temp_file)
     convert_simian_xml_to_html(tool_set_path, output_path)
     return ret
 
 
+def run_duplicate_index(check_params, java_files, output_file):
+    """
+    更新工程的重复代码索引，只重新分析内容变化的文件，然后在索引中查找变动的文件的重复代码
+    :param check_params: 检查参数
+    :param java_files: 需要检查的java文件
+    :param output_file: simian格式的xml结果文件
+    :return: 发现重复代码返回1，否则返回0
+    """
+    project_path = check_params.project_path
+    repo = get_repo(project_path)
+    output_path = path.abspath(check_params.output_path)
+    # 结果目录中提取的提交范围文件不属于工程
+    all_java_files = [file for file in get_all_files(repo, project_path, check_params.exclude_test)[0]
+                      if path.commonpath([path.abspath(file), output_path]) != output_path]
+    if check_params.enable_exclude:
+        all_java_files = filter_excluded(check_params.exclude_files_path, 'simian', all_java_files)
+    blob_ids = get_blob_ids(repo, all_java_files)
+    for file in all_java_files:
+        if file not in blob_ids:
+            blob_ids[file] = hash_file(file)
+    index = DuplicateIndex(project_path)
+    try:
+        index.sync(blob_ids)
+        # 提交范围中提取的文件与工作区中的原文件是同一个文件，不作为重复对象
+        extract_path = path.join(output_path, 'range_source')
+        ignored_paths = {}
+        sources = []
+        for file in java_files:
+            source = index.get_source_by_path(file) if file in blob_ids else analyze_file(file)
+            if source is None:
+                continue
+            sources.append(source)
+            if path.commonpath([path.abspath(file), extract_path]) == extract_path:
+                ignored_paths[file] = {path.join(repo.working_tree_dir, path.relpath(file, extract_path))}
+        duplicates = find_duplicates(index, sources, ignored_paths)
+    finally:
+        index.close()
+    write_simian_xml(output_file, duplicates, sources)
+    return 1 if duplicates else 0
+
+
 def convert_simian_xml_to_html(tool_set_path, output_path):
     """
     将simian检查结果文件转换为html格式
@@ -60,6 +123,7 @@ def convert_simian_xml_to_html(tool_set_path, output_path):
     os.remove(xml_path)
 
 
+@trace_span("xslt")
 def convert_xml_to_html(xml_path, html_path, xsl_path):
     """
     将lizard xml格式的结果转换成html
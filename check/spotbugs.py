@@ -1,80 +1,295 @@
 import os
 from os import path
 
+from lxml import etree
+
+from util.cache import hash_config
+from util.class_index import ClassIndex, split_source_path
 from util.decorators import timer, print_log
-from util.util import filter_files, run
+from util.trace import trace_span
+from util.exclude import filter_excluded
+from util.executor import get_cpu_count, run_tasks
+from util.modules import discover_modules, get_aux_classpath, hash_classpath
+from util.util import run
+from util.xml_stream import iter_children, rewrite_xml
 
 
 @timer
 @print_log('spotbugs')
-def run_spotbugs_check(project_path, tool_path, output_path, changed_java_files, *,
-                       enable_exclude=False, exclude_files_path=None):
+def run_spotbugs_check(check_params):
     """
     执行spotbugs检测
-    :param project_path: 工程目录
-    :param tool_path: 工具集根目录
-    :param output_path: 检查结果文件输出路径
-    :param changed_java_files: 执行检查的java源代码文件
-    :param enable_exclude: 是否开启例外文件配置
-    :param exclude_files_path: 例外文件目录
+    :param check_params: 检查参数
     :return:
     """
+    tool_path = check_params.tool_set_path
+    output_path = check_params.output_path
+    changed_java_files = check_params.changed_java_files
+    enable_exclude = check_params.enable_exclude
+    exclude_files_path = check_params.exclude_files_path
     if len(changed_java_files) == 0:
         print('no files to run spotbugs check')
         return -1
 
     if enable_exclude:
-        left_java_files = filter_files(exclude_files_path, 'FindBugs_Conf.txt', changed_java_files,
-                                       match=lambda pattern, filename: pattern in filename.replace('.java', '.class')
-                                       )[:]
+        left_java_files = filter_excluded(exclude_files_path, 'spotbugs', changed_java_files)
     else:
         left_java_files = changed_java_files[:]
     if len(left_java_files) == 0:
         print('no files to run spotbugs check')
         return -1
-    class_names = [get_class_name(java_file) for java_file in left_java_files]
-    class_files = [path.join(project_path, class_name) for class_name in class_names if class_name]
-    class_files_path = path.join(output_path, 'spotbugs_analysis.ini')
-    save_analysis_class_files(class_files_path, class_files)
+    class_index = ClassIndex()
+    class_files = {java_file: class_index.get_class_files(java_file) for java_file in left_java_files}
+    java_files = [java_file for java_file in left_java_files if class_files[java_file]]
     output_file = path.join(output_path, 'SpotBugs_Result.html')
+    xml_file = path.join(output_path, 'SpotBugs_Result.xml')
+    result_cache = check_params.result_cache
+    changed_lines = check_params.changed_lines
+    analysis_options = ['-medium', '-omitVisitors', 'FindReturnRef']
+
+    module_files = group_by_module(java_files)
+    modules = discover_modules(check_params.project_path)
+    aux_classpaths = {module: get_aux_classpath(module, modules) if module else [] for module in module_files}
+    cached_results = {}
+    class_blob_ids = {}
+    config_hash = hash_config('spotbugs-4.8.3', *analysis_options)
+    if result_cache is not None:
+        # spotbugs分析的是class文件，使用源代码文件编译生成的全部class文件的内容和模块的辅助类路径作为缓存key
+        classpath_hashes = {module: hash_classpath(classpath) for module, classpath in aux_classpaths.items()}
+        class_blob_ids = {java_file: hash_config(*class_files[java_file], classpath_hashes[module])
+                          for module, files in module_files.items() for java_file in files}
+        cached_results, java_files = result_cache.lookup('spotbugs', config_hash, java_files, class_blob_ids)
+        module_files = group_by_module(java_files)
+
+    ret = 0
+    results = {}
+    # 合并多个模块、合并缓存或者过滤结果时，需要按照文件重新生成结果文件
+    rebuild = len(module_files) > 1 or bool(cached_results) or changed_lines is not None
+    if java_files or not cached_results:
+        # 只有一个模块并且不需要重新生成结果文件时，spotbugs直接生成html，不再单独转换
+        ret, results = analyze_modules(tool_path, output_path, module_files, class_files, aux_classpaths,
+                                       analysis_options, None if rebuild else output_file,
+                                       read_results=rebuild or result_cache is not None)
+        if result_cache is not None:
+            result_cache.store('spotbugs', config_hash,
+                               {java_file: bugs for java_file, bugs in results.items() if java_file}, class_blob_ids)
+
+    if rebuild:
+        bugs = {**results, **cached_results}
+        if changed_lines is not None:
+            bugs = filter_spotbugs_results(bugs, changed_lines)
+        write_bug_instances(xml_file, bugs)
+        ret = convert_spotbugs_xml_to_html(tool_path, xml_file, output_file) or ret
+    return ret
+
+
+def group_by_module(java_files):
+    """
+    按照模块对java文件分组
+    :param java_files: java文件列表
+    :return: dict，模块目录到java文件列表的映射，不在标准源代码目录中的文件属于空字符串表示的模块
+    """
+    module_files = {}
+    for java_file in java_files:
+        parts = split_source_path(java_file)
+        module_files.setdefault(parts[0] if parts else '', []).append(java_file)
+    return module_files
+
+
+def analyze_modules(tool_path, output_path, module_files, class_files, aux_classpaths, analysis_options,
+                    html_file=None, read_results=True):
+    """
+    每个模块启动一个spotbugs并行分析，辅助类路径中包含模块的依赖，第一个模块的结果文件作为SpotBugs_Result.xml
+    每个模块的问题在该模块自己的结果文件中对应到java文件，不同模块中相对路径相同的文件不会混淆
+    :param tool_path: 工具集根目录
+    :param output_path: 检查结果输出目录
+    :param module_files: 模块目录到java文件列表的映射
+    :param class_files: java文件到class文件列表的映射
+    :param aux_classpaths: 模块目录到辅助类路径的映射
+    :param analysis_options: spotbugs分析参数
+    :param html_file: 不为空时同时直接生成html格式的检查结果，只在一个模块时使用
+    :param read_results: 是否读取每个文件的问题，多个模块时总是读取
+    :return: (spotbugs退出码中最大的一个, java文件到BugInstance节点字符串列表的映射)，
+        没有对应文件的问题记录在空字符串下，分析失败的模块中的文件不包含在内
+    """
+    xml_file = path.join(output_path, 'SpotBugs_Result.xml')
+    module_names = sorted(module_files) or ['']
+    if len(module_names) == 1:
+        module = module_names[0]
+        java_files = module_files.get(module, [])
+        ret = analyze_module(tool_path, java_files, class_files, aux_classpaths.get(module, []), analysis_options,
+                             xml_file, html_file)
+        results = read_spotbugs_results(xml_file, java_files) if read_results and path.exists(xml_file) else {}
+        return ret, results
+    module_xml_files = [path.join(output_path, f'SpotBugs_Result.{index}.xml') for index in range(len(module_names))]
+    tasks = [
+        (f"spotbugs-{path.basename(module) or 'root'}", analyze_module,
+         (tool_path, module_files[module], class_files, aux_classpaths[module], analysis_options, module_xml_file),
+         {})
+        for module, module_xml_file in zip(module_names, module_xml_files)
+    ]
+    ret_values = run_tasks(tasks, min(len(tasks), get_cpu_count()))
+    results = {}
+    existing = [(module, module_xml_file) for module, module_xml_file in zip(module_names, module_xml_files)
+                if path.exists(module_xml_file)]
+    for module, module_xml_file in existing:
+        for java_file, bugs in read_spotbugs_results(module_xml_file, module_files[module]).items():
+            results.setdefault(java_file, []).extend(bugs)
+    # 第一个模块的结果文件保留Project等节点，问题由调用方按照文件重新写入
+    if existing:
+        os.replace(existing[0][1], xml_file)
+        for _, module_xml_file in existing[1:]:
+            os.remove(module_xml_file)
+    if any(ret is None for ret in ret_values.values()):
+        return 2, results
+    return max(ret_values.values()), results
+
+
+def analyze_module(tool_path, java_files, class_files, aux_classpath, analysis_options, xml_file, html_file=None):
+    """
+    启动一次spotbugs分析，class文件和辅助类路径都通过文件传入，避免命令行过长
+    :param tool_path: 工具集根目录
+    :param java_files: 分析的java文件
+    :param class_files: java文件到class文件列表的映射
+    :param aux_classpath: 辅助类路径
+    :param analysis_options: spotbugs分析参数
+    :param xml_file: xml格式的检查结果文件
+    :param html_file: 不为空时同时生成html格式的检查结果
+    :return: spotbugs退出码
+    """
+    base_name = path.splitext(xml_file)[0]
+    class_files_path = f'{base_name}_analysis.ini'
+    save_analysis_class_files(class_files_path,
+                              [class_file for java_file in java_files for class_file in class_files[java_file]])
     cmd = [
         'java',
         '-jar',
         path.join(tool_path, 'spotbugs-4.8.3', 'lib', 'spotbugs.jar'),
         '-textui',
         '-quiet',
-        '-medium',
-        '-omitVisitors',
-        'FindReturnRef',
-        f'-html={output_file}',
-        '-analyzeFromFile',
-        class_files_path
+        *analysis_options,
+        f'-xml:withMessages={xml_file}',
     ]
+    if html_file:
+        cmd.append(f'-html={html_file}')
+    aux_classpath_path = f'{base_name}_auxclasspath.ini'
+    if aux_classpath:
+        save_analysis_class_files(aux_classpath_path, aux_classpath)
+        cmd.extend(['-auxclasspathFromFile', aux_classpath_path])
+    cmd.extend(['-analyzeFromFile', class_files_path])
     ret = run(cmd)
-    os.remove(class_files_path)
+    for temp_file in (class_files_path, aux_classpath_path):
+        if path.exists(temp_file):
+            os.remove(temp_file)
     return ret
 
 
-def get_class_name(java_file):
+def read_spotbugs_results(xml_file, java_files):
+    """
+    从一个模块的spotbugs xml格式的检查结果中读取每个java文件的问题列表
+    sourcepath是相对于源代码目录的路径，只在同一个模块中唯一，java_files必须是同一个模块中的文件
+    :param xml_file: spotbugs xml格式的检查结果文件
+    :param java_files: 执行检查的java文件列表
+    :return: dict，java文件到BugInstance节点字符串列表的映射，没有对应文件的问题记录在空字符串下
+    """
+    source_paths = {get_source_path(java_file): java_file for java_file in java_files}
+    results = {java_file: [] for java_file in java_files}
+    for bug in iter_children(xml_file):
+        if bug.tag != 'BugInstance':
+            continue
+        source_line = bug.find('SourceLine')
+        if source_line is None:
+            source_line = bug.find('Class/SourceLine')
+        java_file = source_paths.get(source_line.attrib.get('sourcepath', '')) if source_line is not None else None
+        results.setdefault(java_file or '', []).append(etree.tostring(bug, encoding='unicode'))
+    return results
+
+
+def write_bug_instances(xml_file, bugs):
+    """
+    使用每个文件的问题替换spotbugs xml格式的检查结果中的全部BugInstance节点
+    :param xml_file: spotbugs xml格式的检查结果文件，不存在时新建
+    :param bugs: java文件到BugInstance节点字符串列表的映射
+    :return:
+    """
+    bug_nodes = [etree.fromstring(bug) for java_file in sorted(bugs) for bug in bugs[java_file]]
+    exists = path.exists(xml_file)
+    inserted = False
+
+    # BugInstance节点需要位于Project节点之后
+    def insert_bugs(node):
+        nonlocal inserted
+        if node.tag == 'BugInstance':
+            return None
+        if inserted or node.tag == 'Project':
+            return node
+        inserted = True
+        return [*bug_nodes, node]
+
+    def remaining_bugs():
+        if not exists:
+            yield etree.Element('Project', {'projectName': ''})
+        if not inserted:
+            yield from bug_nodes
+
+    root = ('BugCollection', {'version': '4.8.3', 'sequence': '0', 'timestamp': '0', 'analysisTimestamp': '0',
+                              'release': ''})
+    rewrite_xml(xml_file, [(xml_file, insert_bugs)], root=root, extra=remaining_bugs())
+
+
+def filter_spotbugs_results(bugs, changed_lines):
+    """
+    过滤每个文件的问题，只保留位于新增或修改的行上的问题
+    :param bugs: java文件到BugInstance节点字符串列表的映射
+    :param changed_lines: 文件全路径到ChangedLines的映射
+    :return: 过滤后的映射
+    """
+
+    def keep(java_file, bug):
+        lines = changed_lines.get(path.normpath(java_file)) if java_file else None
+        if lines is None:
+            return True
+        source_line = etree.fromstring(bug).find('SourceLine')
+        if source_line is None or 'start' not in source_line.attrib:
+            return True
+        start = int(source_line.attrib['start'])
+        return lines.overlaps(start, int(source_line.attrib.get('end') or start))
+
+    return {java_file: [bug for bug in items if keep(java_file, bug)] for java_file, items in bugs.items()}
+
+
+@trace_span("subprocess")
+def convert_spotbugs_xml_to_html(tool_path, xml_file, html_file):
+    """
+    将spotbugs xml格式的检查结果转换成html
+    :param tool_path: 工具集根目录
+    :param xml_file: xml格式的检查结果文件
+    :param html_file: html格式的检查结果文件
+    :return:
+    """
+    cmd = [
+        'java',
+        '-cp',
+        path.join(tool_path, 'spotbugs-4.8.3', 'lib', 'spotbugs.jar'),
+        'edu.umd.cs.findbugs.PrintingBugReporter',
+        '-html',
+        xml_file,
+        html_file,
+    ]
+    return run(cmd)
+
+
+def get_source_path(java_file):
     """
-    从java文件名中获取对应的class文件名
+    获取java文件相对于源代码根目录的路径，与spotbugs结果中的sourcepath一致
     :param java_file: java 文件全路径
     :return:
     """
-    patterns = [(path.join('target', 'classes'), path.join('target', 'test-classes')),
-                (path.join('build', 'classes', 'java', 'main'), path.join('build', 'classes', 'java', 'test')),
-                (path.join('build', 'classes'), path.join('build', 'test-classes'))]
-    for pattern in patterns:
-        if 'src/main/java' in java_file:
-            class_file = java_file.replace('src/main/java', pattern[0])
-        elif 'src/test/java' in java_file:
-            class_file = java_file.replace('src/test/java', pattern[1])
-        else:
-            return ''
-        class_file = class_file.replace('/', os.sep).replace('.java', '.class')
-        if path.exists(class_file):
-            return class_file
-    return ''
+    java_file = java_file.replace(os.sep, '/')
+    for source_root in ('src/main/java/', 'src/test/java/'):
+        if source_root in java_file:
+            return java_file.partition(source_root)[-1]
+    return path.basename(java_file)
 
 
 def get_package_name(java_file):
@@ -90,6 +305,7 @@ def get_package_name(java_file):
         return java_file.partition('src.test.java.')[-1].partition('.java')[0]
 
 
+@trace_span("config")
 def save_analysis_class_files(full_name, class_files):
     """
     将要执行spotbugs分析的class文件的路径写入到文件中
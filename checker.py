@@ -1,31 +1,74 @@
+import sys
+
+from util.startup import install_import_profiler, print_startup_profile
+
+if "--startup-profile" in sys.argv:
+    install_import_profiler()
+
 import argparse
 import os
-import subprocess
+import shutil
+import threading
+import time
 from os import path
 from collections import namedtuple
 
-
-from check.checkstyle import run_checkstyle_check
-from check.javancss import run_javancss_check
-from check.pmd import run_pmd_check
-from check.simian import run_simian_check
-from check.spotbugs import run_spotbugs_check
-from check.pylint import run_pylint_check
+from check import get_plugins
+from util.cache import ResultCache, DEFAULT_CACHE_SIZE
+from util.coordinator import InstanceCoordinator
+from util.daemon import start_daemon, stop_daemon, daemon_status
 from util.decorators import print_log
-from util.server import start_web_page, kill_process_using_name, kill_process_using_port
+from util.executor import run_tasks, resolve_jobs, combine_status
+from util.server import start_web_page, kill_process_using_port
 from util.source import (
+    get_files_list,
     get_given_files,
     get_changed_files,
     get_repo,
     get_repo_from_file,
     get_last_committed_files,
+    get_blob_ids,
+    get_range_files,
+    get_all_files,
 )
+from util.toolchain import probe_tool
 from util.util import (
-    check_app_executable,
-    need_run_check,
     delete_result_file,
-    is_run_in_package_mode,
 )
+from util.trace import enable_trace, span, write_trace
+
+CheckParams = namedtuple(
+    "CheckParams",
+    [
+        "project_path",
+        "tool_set_path",
+        "output_path",
+        "changed_java_files",
+        "changed_python_files",
+        "enable_exclude",
+        "exclude_files_path",
+        "exclude_test",
+        "mode",
+        "result_cache",
+        "incremental_scopes",
+        "changed_lines",
+        "checkstyle_shards",
+        "duplicate_engine",
+    ],
+)
+
+def get_plugin_tasks(plugins, check_params, languages=None):
+    """
+    根据插件列表生成需要执行的检查任务
+    :param plugins: 需要执行的插件列表
+    :param check_params: 检查参数
+    :param languages: 只执行检查这些语言的插件，为空时不限制
+    :return: 任务列表，元素为(name, func, args, kwargs)
+    """
+    return [
+        (name, func, (check_params,), {})
+        for name, func, _ in get_plugins(plugins, languages)
+    ]
 
 
 @print_log("all")
@@ -44,6 +87,22 @@ def check(
     plugins="checkstyle,pmd,spotbugs,javancss,simian,findbugs",
     auto_open=False,
     file=None,
+    jobs=None,
+    enable_cache=True,
+    cache_dir=None,
+    cache_size=DEFAULT_CACHE_SIZE,
+    use_baseline=False,
+    rebuild_baseline=False,
+    watch=False,
+    debounce=0.5,
+    trace_file=None,
+    repo=None,
+    shared_cache=None,
+    report=None,
+    commit_range=None,
+    changed_lines_only=False,
+    checkstyle_shards=1,
+    duplicate_engine="index",
 ):
     """
     执行代码规范检查
@@ -60,26 +119,38 @@ def check(
     :param plugins: 需要执行的插件列表
     :param auto_open: 在设置开启web server的前提下是否自动打开浏览器
     :param file: 一个文件路径用来获取当前文件所在的git仓库
-    :return:
+    :param jobs: 并发执行的插件数量，为空时根据cpu数量和cgroup配额自动探测，为1时顺序执行
+    :param enable_cache: 是否使用检查结果缓存，内容和配置未变化的文件直接使用缓存的检查结果
+    :param cache_dir: 检查结果缓存目录，为空时使用用户缓存目录
+    :param cache_size: 检查结果缓存的最大字节数
+    :param use_baseline: mode=3时，只检查相对于基线变动的文件，并使用本次结果修补基线生成完整的检查结果
+    :param rebuild_baseline: mode=3时，执行全量检查并重新记录基线
+    :param watch: 首次检查完成后常驻运行，监听工程中文件的保存，只对保存的文件重新执行相关的插件
+    :param debounce: watch模式下的防抖时间，单位秒，连续的保存操作结束之后才执行检查
+    :param trace_file: 记录各阶段耗时的trace文件路径，为空字符串时写入检查结果目录下的trace.json，为None时不记录
+    :param repo: 已打开的git仓库，为空时根据工程目录或者file打开
+    :param shared_cache: 多次检查共享的检查结果缓存，为空时每次检查打开新的缓存
+    :param report: dict，不为空时写入每个插件的返回值和检查结果目录
+    :param commit_range: 提交范围，不为空时检查范围内变动的文件，优先于mode
+    :param changed_lines_only: 检查结果中只保留新增或修改的行上的问题，只在mode为1、2或指定提交范围时生效
+    :param checkstyle_shards: checkstyle的分片数量，大于1时将文件切分后并行执行，0表示根据cpu数量自动选择
+    :param duplicate_engine: 重复代码检查的实现，index使用工程级的重复代码索引，simian使用simian jar包
+    :return: 全部插件执行成功返回0，否则返回非0
     """
+    if trace_file is not None:
+        enable_trace()
 
-    try:
-        check_app_executable(["java", "-version"])
-    except FileNotFoundError | subprocess.CalledProcessError:
+    if probe_tool("java") is None:
         print("java is not executable")
         return -1
 
-    try:
-        check_app_executable(["git", "-v"])
-    except FileNotFoundError | subprocess.CalledProcessError:
+    if probe_tool("git") is None:
         print("git is not executable")
         return -1
 
-    if is_run_in_package_mode():
-        kill_process_using_name("style-checker")
-
     if enable_web:
-        kill_process_using_port(port)
+        with span("kill process using port", "server"):
+            kill_process_using_port(port)
 
     if not path.exists(project_path):
         print("project does not exist")
@@ -87,16 +158,9 @@ def check(
     if not path.exists(tool_set_path):
         print("tool set does not exist")
         return -1
-    repo = get_repo(project_path) if file is None else get_repo_from_file(file)
+    if repo is None:
+        repo = get_repo(project_path) if file is None else get_repo_from_file(file)
     git_address = repo.working_tree_dir
-    changed_java_files = []
-    if files is not None:
-        changed_java_files, _ = get_given_files(files, exclude_test)
-    elif mode == "1":
-        changed_java_files, _ = get_last_committed_files(repo, exclude_test)
-    elif mode == "2":
-        changed_java_files, _ = get_changed_files(repo, exclude_test)
-
     full_output_path = (
         output_path if output_path else path.join(project_path, "check_result")
     )
@@ -104,85 +168,439 @@ def check(
         os.makedirs(full_output_path)
     else:
         print("delete result files first")
-        delete_result_file(full_output_path)
+        with span("delete result files", "output"):
+            delete_result_file(full_output_path)
+
+    changed_java_files = []
+    changed_python_files = []
+    # 获取文件列表时已经得到的blob id，为None时根据git索引计算
+    blob_ids = None
+    if files is not None:
+        changed_java_files, _, changed_python_files = get_given_files(
+            files, exclude_test
+        )
+    elif commit_range:
+        (
+            changed_java_files,
+            _,
+            changed_python_files,
+            blob_ids,
+        ) = get_range_files(
+            repo,
+            commit_range,
+            path.join(full_output_path, "range_source"),
+            exclude_test,
+        )
+    elif mode == "1":
+        changed_java_files, _, changed_python_files = get_last_committed_files(
+            repo, exclude_test
+        )
+    elif mode == "2":
+        (
+            changed_java_files,
+            _,
+            changed_python_files,
+            blob_ids,
+        ) = get_changed_files(repo, exclude_test)
+    elif mode == "3":
+        changed_java_files, _, changed_python_files = get_all_files(
+            repo, project_path, exclude_test
+        )
+
+    changed_lines = None
+    if changed_lines_only:
+        if files is None and (commit_range or mode in ("1", "2")):
+            from util.changed_lines import get_changed_lines
+
+            changed_lines = get_changed_lines(
+                repo, mode, commit_range, path.join(full_output_path, "range_source")
+            )
+        else:
+            print("--changed-lines-only only works in mode 1, mode 2 or with --range")
 
     if not exclude_files_path:
         exclude_files_path = path.join(git_address, "CI_Config")
 
-    CheckParams = namedtuple(
-        "CheckParams",
-        [
-            "project_path",
-            "tool_set_path",
-            "output_path",
-            "changed_java_files",
-            "enable_exclude",
-            "exclude_files_path",
-            "exclude_test",
-            "mode",
-        ],
-    )
+    incremental_scopes = {}
+    baseline_config_hash = None
+    if mode == "3" and (use_baseline or rebuild_baseline):
+        from util.baseline import (
+            get_baseline_config_hash,
+            load_baseline,
+            get_incremental_scopes,
+        )
+
+        baseline_config_hash = get_baseline_config_hash(
+            tool_set_path, exclude_files_path, enable_exclude, exclude_test
+        )
+        if not rebuild_baseline:
+            incremental_scopes = get_incremental_scopes(
+                repo,
+                project_path,
+                load_baseline(project_path, baseline_config_hash),
+                exclude_test,
+            )
+
+    result_cache = None
+    if enable_cache:
+        if blob_ids is None:
+            blob_ids = get_blob_ids(repo, changed_java_files + changed_python_files)
+        if shared_cache is not None:
+            result_cache = shared_cache.fork(blob_ids)
+        else:
+            result_cache = ResultCache(cache_dir, cache_size, blob_ids)
 
     check_params = CheckParams(
         project_path,
         tool_set_path,
         full_output_path,
         changed_java_files,
+        changed_python_files,
         enable_exclude,
         exclude_files_path,
         exclude_test,
         mode,
+        result_cache,
+        incremental_scopes,
+        changed_lines,
+        checkstyle_shards,
+        duplicate_engine,
     )
 
-    if need_run_check("checkstyle", plugins):
-        run_checkstyle_check(check_params=check_params)
+    with span("run plugins"):
+        results = run_tasks(
+            get_plugin_tasks(plugins, check_params), resolve_jobs(jobs)
+        )
+    status = combine_status(results)
+    if report is not None:
+        report.update(results=results, output_path=full_output_path)
+    if baseline_config_hash is not None:
+        from util.baseline import save_baseline
 
-    if need_run_check("simian", plugins):
-        run_simian_check(
-            tool_set_path,
+        save_baseline(
+            repo,
+            project_path,
             full_output_path,
-            changed_java_files,
-            enable_exclude=enable_exclude,
-            exclude_files_path=exclude_files_path,
+            baseline_config_hash,
+            [name for name, ret in results.items() if ret is not None],
+        )
+    print(f"check results:{results}, status:{status}")
+    if trace_file is not None:
+        trace_file = trace_file or path.join(full_output_path, "trace.json")
+        write_trace(trace_file)
+
+    try:
+        if watch:
+            if enable_web:
+                threading.Thread(
+                    target=start_web_page,
+                    args=(full_output_path, port, auto_open),
+                    daemon=True,
+                ).start()
+            watch_changes(
+                check_params._replace(mode="2"),
+                plugins,
+                jobs=resolve_jobs(jobs),
+                debounce=debounce,
+                trace_file=trace_file,
+            )
+        elif enable_web:
+            start_web_page(full_output_path, port, auto_open)
+    except KeyboardInterrupt as e:
+        print(e)
+    finally:
+        if result_cache is not None:
+            result_cache.close()
+    return status
+
+
+def watch_changes(check_params, plugins, *, jobs=1, debounce=0.5, trace_file=None):
+    """
+    监听工程中文件的保存，对保存的文件重新执行相关的插件，检查结果原地更新到结果目录
+    :param check_params: 检查参数，文件列表在每次检查时替换为保存的文件
+    :param plugins: 需要执行的插件列表
+    :param jobs: 并发执行的插件数量
+    :param debounce: 防抖时间，单位秒
+    :param trace_file: trace文件路径，每次检查之后更新，为None时不记录
+    :return:
+    """
+    from util.baseline import BASELINE_REPORTS, IncrementalScope, patch_report
+    from util.watch import watch_project
+
+    output_path = check_params.output_path
+    result_cache = check_params.result_cache
+
+    def on_change(files):
+        java_files, _, python_files = get_files_list(
+            "", files, check_params.exclude_test
         )
+        languages = set()
+        if java_files:
+            languages.add("java")
+        if python_files:
+            languages.add("python")
+        tasks = get_plugin_tasks(plugins, check_params, languages)
+        if not tasks:
+            return
+        print(f"files changed: {', '.join(files)}")
+        if result_cache is not None:
+            # 文件内容已变化，丢弃之前记录的blob id
+            for file in files:
+                result_cache.blob_ids.pop(file, None)
 
-    if need_run_check("pmd", plugins):
-        run_pmd_check(check_params)
+        # checkstyle和pmd的结果文件按文件修补，未保存的文件保留之前的检查结果
+        scopes = {}
+        for name, _, _, _ in tasks:
+            report = BASELINE_REPORTS.get(name)
+            report_file = path.join(output_path, report) if report else None
+            if report_file and path.exists(report_file):
+                previous_file = f"{report_file}.watch"
+                shutil.move(report_file, previous_file)
+                scopes[report_file] = IncrementalScope(
+                    previous_file, java_files, java_files
+                )
 
-    if need_run_check("spotbugs", plugins) or need_run_check("findbugs", plugins):
-        run_spotbugs_check(
-            project_path,
-            tool_set_path,
-            full_output_path,
-            changed_java_files,
-            enable_exclude=enable_exclude,
-            exclude_files_path=exclude_files_path,
+        params = check_params._replace(
+            changed_java_files=java_files, changed_python_files=python_files
         )
+        if check_params.changed_lines is not None:
+            from util.changed_lines import get_changed_lines
 
-    if need_run_check("javancss", plugins):
-        run_javancss_check(
-            tool_set_path,
-            full_output_path,
-            changed_java_files,
-            enable_exclude=enable_exclude,
-            exclude_files_path=exclude_files_path,
+            params = params._replace(
+                changed_lines=get_changed_lines(
+                    get_repo(check_params.project_path), "2"
+                )
+            )
+        with span("run plugins", files=len(files)):
+            results = run_tasks(
+                [(name, func, (params,), {}) for name, func, _, _ in tasks], jobs
+            )
+        for report_file, scope in scopes.items():
+            patch_report(scope, report_file)
+            os.remove(scope.baseline_file)
+        print(f"check results:{results}, status:{combine_status(results)}")
+        if trace_file is not None:
+            write_trace(trace_file)
+
+    print("watching for changes, press Ctrl+C to stop")
+    watch_project(
+        check_params.project_path,
+        on_change,
+        ignored=[output_path],
+        debounce=debounce,
+    )
+
+
+def check_single_instance(job):
+    """
+    同一个工程只运行一个检查进程，已有进程在运行时将任务交给该进程执行
+    运行中的进程在当前检查结束后执行最新提交的任务；开启web server时进程常驻，web server在多次检查之间保持运行
+    :param job: check的参数，路径需要是绝对路径
+    :return: 本进程执行的最后一次检查的结果，任务交给其他进程时返回0
+    """
+    coordinator = InstanceCoordinator(job["project_path"])
+    for _ in range(50):
+        if coordinator.acquire():
+            break
+        pid = coordinator.hand_over(job)
+        if pid is not None:
+            print(f"check handed over to the running instance, pid {pid}")
+            return 0
+        # 持有锁的进程正在启动或者退出，稍后重试
+        time.sleep(0.2)
+    else:
+        print("can not reach the running instance, check in this process")
+        return check(**job)
+
+    web_started = False
+    status = 0
+    try:
+        while job is not None:
+            status = check(**{**job, "enable_web": False})
+            if job["enable_web"] and not web_started:
+                output_path = job["output_path"] or path.join(
+                    job["project_path"], "check_result"
+                )
+                threading.Thread(
+                    target=start_web_page,
+                    args=(output_path, job["port"], job["auto_open"]),
+                    daemon=True,
+                ).start()
+                web_started = True
+            next_job = coordinator.next_job(wait=web_started)
+            # 工程、工具集和结果目录使用本进程自己的配置
+            job = {**job, **next_job} if next_job is not None else None
+    except KeyboardInterrupt as e:
+        print(e)
+    finally:
+        coordinator.close()
+    return status
+
+
+def create_job_runner(tool_set_path, *, jobs=None, enable_cache=True, shared_cache=None):
+    """
+    创建在同一个进程中多次执行检查的函数，多次检查之间复用已打开的git仓库和检查结果缓存
+    :param tool_set_path: 执行检查使用的工具集的路径
+    :param jobs: 每次检查中并发执行的插件数量
+    :param enable_cache: 是否使用检查结果缓存
+    :param shared_cache: 多次检查共享的检查结果缓存
+    :return: 函数，参数为(check参数, 检查详情dict)，返回检查的退出码
+    """
+    repos = {}
+
+    def run_job(params, report):
+        project_path = params["project_path"]
+        # 同一个工程的任务依次执行，不会同时使用同一个仓库对象
+        if project_path not in repos:
+            repos[project_path] = get_repo(project_path)
+        params.setdefault("jobs", jobs)
+        params.setdefault("enable_exclude", False)
+        params.setdefault("output_path", None)
+        return check(
+            tool_set_path=tool_set_path,
+            enable_web=False,
+            port=0,
+            enable_cache=enable_cache,
+            repo=repos[project_path],
+            shared_cache=shared_cache,
+            report=report,
+            **params,
         )
 
-    if need_run_check("pylint", plugins):
-        run_pylint_check(check_params)
+    return run_job
+
 
+def serve(tool_set_path, port, *, workers=2, max_queue=100, jobs=None, enable_cache=True,
+          cache_dir=None, cache_size=DEFAULT_CACHE_SIZE, roots=None):
+    """
+    以服务方式运行，通过本机的http json接口接收检查任务
+    多次检查之间复用已打开的git仓库、检查结果缓存、已导入的插件和常驻JVM进程中加载的规则
+    :param tool_set_path: 执行检查使用的工具集的路径
+    :param port: 服务端口
+    :param workers: 同时执行的任务数量
+    :param max_queue: 等待执行的任务数量上限
+    :param jobs: 每个任务中并发执行的插件数量
+    :param enable_cache: 是否使用检查结果缓存
+    :param cache_dir: 检查结果缓存目录
+    :param cache_size: 检查结果缓存的最大字节数
+    :param roots: 允许检查的目录列表，为空时不限制工程目录
+    :return:
+    """
+    from util.service import CheckService
+    from util.server import run_service_server
+
+    if probe_tool("java") is None or probe_tool("git") is None:
+        print("java and git need to be executable")
+        return -1
+    # 常驻JVM进程不可用时，检查仍然启动新的JVM执行
+    start_daemon(tool_set_path)
+    shared_cache = ResultCache(cache_dir, cache_size) if enable_cache else None
+    run_job = create_job_runner(
+        tool_set_path, jobs=jobs, enable_cache=enable_cache, shared_cache=shared_cache
+    )
+    service = CheckService(run_job, workers=workers, max_queue=max_queue)
+    service.start()
     try:
-        if enable_web:
-            start_web_page(full_output_path, port, auto_open)
+        run_service_server(service, port, roots=roots)
     except KeyboardInterrupt as e:
         print(e)
+    finally:
+        service.stop()
+        if shared_cache is not None:
+            shared_cache.close()
     return 0
 
 
+def run_batch(tool_set_path, manifest_file, output_path, *, workers=2, jobs=None,
+              enable_cache=True, cache_dir=None, cache_size=DEFAULT_CACHE_SIZE):
+    """
+    在同一个进程中批量检查多个仓库或提交范围
+    各检查项共享插件、常驻JVM进程、工作线程和检查结果缓存，按工程轮流执行，同一个工程的检查项依次执行
+    :param tool_set_path: 执行检查使用的工具集的路径
+    :param manifest_file: 批量检查清单文件
+    :param output_path: 批量检查结果目录，每个检查项的结果在其中的子目录
+    :param workers: 同时执行的检查项数量
+    :param jobs: 每个检查项中并发执行的插件数量
+    :param enable_cache: 是否使用检查结果缓存
+    :param cache_dir: 检查结果缓存目录
+    :param cache_size: 检查结果缓存的最大字节数
+    :return: 全部检查项的退出码中最大的一个，有检查项执行失败时返回2
+    """
+    from util.batch import load_manifest, schedule_entries, write_summary
+    from util.service import CheckService
+
+    try:
+        entries = schedule_entries(load_manifest(manifest_file))
+    except (OSError, ValueError) as e:
+        print(f"invalid batch manifest {manifest_file}: {e}")
+        return 2
+    if probe_tool("java") is None or probe_tool("git") is None:
+        print("java and git need to be executable")
+        return -1
+    start_daemon(tool_set_path)
+    shared_cache = ResultCache(cache_dir, cache_size) if enable_cache else None
+    run_job = create_job_runner(
+        tool_set_path, jobs=jobs, enable_cache=enable_cache, shared_cache=shared_cache
+    )
+    service = CheckService(
+        run_job, workers=workers, max_queue=len(entries), history=len(entries)
+    )
+    submitted = []
+    for name, params in entries:
+        params["output_path"] = path.join(output_path, name)
+        submitted.append((name, service.submit(params)))
+    print(f"begin to check {len(submitted)} batch entries with {workers} workers")
+    service.start()
+    records = []
+    status = 0
+    try:
+        for name, job in submitted:
+            job.done.wait()
+            os.makedirs(job.params["output_path"], exist_ok=True)
+            with open(
+                path.join(job.params["output_path"], "check.log"), "w", encoding="utf-8"
+            ) as fp:
+                fp.write(job.log.read())
+            print(f"{name} {job.status}:{job.exit_status}")
+            if job.status != "finished" or job.exit_status is None or job.exit_status < 0:
+                status = 2
+            else:
+                status = max(status, job.exit_status)
+            records.append(
+                {
+                    "name": name,
+                    "project": job.params["project_path"],
+                    "mode": job.params["mode"],
+                    "range": job.params.get("commit_range"),
+                    "status": job.status,
+                    "exit_status": job.exit_status,
+                    "results": job.results,
+                    "output_path": job.params["output_path"],
+                    "duration": (job.finished or job.started or job.created)
+                    - (job.started or job.created),
+                }
+            )
+    finally:
+        service.stop()
+        if shared_cache is not None:
+            shared_cache.close()
+    records.sort(key=lambda record: record["name"])
+    summary_file = write_summary(output_path, records)
+    print(f"batch check finished:{status}, summary: {summary_file}")
+    return status
+
+
+def get_absolute_path(file_path):
+    return path.abspath(file_path) if file_path else file_path
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "--project", "-p", required=True, help="path of project directory"
+        "--project",
+        "-p",
+        required=False,
+        help="path of project directory, required unless --jvm-daemon, --serve or --batch is given",
     )
     parser.add_argument(
         "--tool",
@@ -240,8 +658,181 @@ def main():
         required=False,
         help="whether to open browser after check",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        required=False,
+        type=int,
+        default=0,
+        help="number of plugins to run concurrently, 0 to detect from cpu count and cgroup quota",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        required=False,
+        help="do not reuse cached per-file results of unchanged files",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        required=False,
+        help="directory of the result cache, defaults to the user cache directory",
+    )
+    parser.add_argument(
+        "--cache-size",
+        required=False,
+        type=int,
+        default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+        help="max size of the result cache in MB",
+    )
+    parser.add_argument(
+        "--baseline",
+        action="store_true",
+        required=False,
+        help="in mode 3, only check files changed since the stored baseline and patch the baseline report",
+    )
+    parser.add_argument(
+        "--rebuild-baseline",
+        action="store_true",
+        required=False,
+        help="in mode 3, check the whole project and record the result as the new baseline",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        required=False,
+        help="stay resident after the first check and re-check files when they are saved",
+    )
+    parser.add_argument(
+        "--debounce",
+        required=False,
+        type=float,
+        default=0.5,
+        help="seconds to wait after the last save before re-checking in watch mode",
+    )
+    parser.add_argument(
+        "--range",
+        required=False,
+        help="check files changed in a commit range such as origin/main..HEAD, overrides --mode",
+    )
+    parser.add_argument(
+        "--changed-lines-only",
+        action="store_true",
+        required=False,
+        help="only report violations on added or modified lines in mode 1, mode 2 or with --range",
+    )
+    parser.add_argument(
+        "--checkstyle-shards",
+        required=False,
+        type=int,
+        default=1,
+        help="split checkstyle files into size-balanced shards checked in parallel, 0 to use the cpu count",
+    )
+    parser.add_argument(
+        "--duplicate-engine",
+        required=False,
+        choices=("index", "simian"),
+        default="index",
+        help="index to look up changed files in the persistent project-wide duplicate index, simian to run the simian jar",
+    )
+    parser.add_argument(
+        "--trace",
+        required=False,
+        nargs="?",
+        const="",
+        help="write a chrome trace json of every pipeline stage, defaults to trace.json in the output directory",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        required=False,
+        help="run as a local http service that accepts check jobs on --port",
+    )
+    parser.add_argument(
+        "--service-workers",
+        required=False,
+        type=int,
+        default=2,
+        help="number of jobs the service runs at the same time",
+    )
+    parser.add_argument(
+        "--service-queue",
+        required=False,
+        type=int,
+        default=100,
+        help="max number of jobs waiting in the service queue",
+    )
+    parser.add_argument(
+        "--service-root",
+        required=False,
+        action="append",
+        help="directory the service is allowed to check, can be given more than once; job paths must stay inside the project or these directories",
+    )
+    parser.add_argument(
+        "--batch",
+        required=False,
+        help="check every repository or commit range listed in a json manifest in one process",
+    )
+    parser.add_argument(
+        "--batch-workers",
+        required=False,
+        type=int,
+        default=2,
+        help="number of batch entries checked at the same time",
+    )
+    parser.add_argument(
+        "--no-single-instance",
+        action="store_true",
+        required=False,
+        help="check in this process even if another instance is checking the same project",
+    )
+    parser.add_argument(
+        "--startup-profile",
+        action="store_true",
+        required=False,
+        help="print the import time of every module loaded before the check starts",
+    )
+    parser.add_argument(
+        "--jvm-daemon",
+        required=False,
+        choices=["start", "stop", "status"],
+        help="manage the warm jvm daemon used by checkstyle, pmd and simian",
+    )
 
     args = parser.parse_args()
+    if args.startup_profile:
+        get_plugins(args.plugins)
+        print_startup_profile()
+    if args.jvm_daemon == "start":
+        return start_daemon(args.tool)
+    if args.jvm_daemon == "stop":
+        return stop_daemon()
+    if args.jvm_daemon == "status":
+        return daemon_status()
+    if args.serve:
+        return serve(
+            get_absolute_path(args.tool),
+            args.port,
+            workers=args.service_workers,
+            max_queue=args.service_queue,
+            jobs=args.jobs,
+            enable_cache=not args.no_cache,
+            cache_dir=args.cache_dir,
+            cache_size=args.cache_size * 1024 * 1024,
+            roots=[get_absolute_path(root) for root in args.service_root or []],
+        )
+    if args.batch:
+        return run_batch(
+            get_absolute_path(args.tool),
+            get_absolute_path(args.batch),
+            get_absolute_path(args.output or "batch_result"),
+            workers=args.batch_workers,
+            jobs=args.jobs,
+            enable_cache=not args.no_cache,
+            cache_dir=args.cache_dir,
+            cache_size=args.cache_size * 1024 * 1024,
+        )
+    if not args.project:
+        parser.error("the following arguments are required: --project/-p")
     tool = args.tool
     project = args.project
     output = args.output
@@ -254,21 +845,48 @@ def main():
     files = args.files
     plugins = args.plugins
     auto_open = args.auto_open
-    check(
-        project,
-        tool,
-        output,
+    jobs = args.jobs
+    enable_cache = not args.no_cache
+    cache_dir = args.cache_dir
+    cache_size = args.cache_size * 1024 * 1024
+    use_baseline = args.baseline
+    rebuild_baseline = args.rebuild_baseline
+    watch = args.watch
+    debounce = args.debounce
+    trace_file = args.trace
+    if files:
+        files = ",".join(get_absolute_path(item) for item in files.split(","))
+    job = dict(
+        project_path=get_absolute_path(project),
+        tool_set_path=get_absolute_path(tool),
+        output_path=get_absolute_path(output),
         enable_web=enable_web,
         port=port,
         enable_exclude=enable_exclude,
-        exclude_files_path=exclude_files_path,
+        exclude_files_path=get_absolute_path(exclude_files_path),
         mode=mode,
         exclude_test=exclude_test,
         files=files,
         plugins=plugins,
         auto_open=auto_open,
+        jobs=jobs,
+        enable_cache=enable_cache,
+        cache_dir=get_absolute_path(cache_dir),
+        cache_size=cache_size,
+        use_baseline=use_baseline,
+        rebuild_baseline=rebuild_baseline,
+        watch=watch,
+        debounce=debounce,
+        trace_file=get_absolute_path(trace_file),
+        commit_range=args.range,
+        changed_lines_only=args.changed_lines_only,
+        checkstyle_shards=args.checkstyle_shards,
+        duplicate_engine=args.duplicate_engine,
     )
+    if watch or args.no_single_instance:
+        return check(**job)
+    return check_single_instance(job)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import hmac
+import json
+import mimetypes
+import urllib.parse
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler
+
+from util.service import FINISHED_STATES, QueueFullError, get_job_file, parse_job_params
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    检查服务的json接口
+
+    POST   /jobs                    提交任务
+    GET    /jobs                    任务列表
+    GET    /jobs/<id>               任务状态
+    DELETE /jobs/<id>               取消等待执行的任务
+    GET    /jobs/<id>/log?offset=N  从offset开始的任务日志
+    GET    /jobs/<id>/events        以ndjson格式持续输出任务日志和状态，直到任务结束
+    GET    /jobs/<id>/files/<name>  任务检查结果目录中的文件
+    GET    /health                  服务状态
+
+    除/health之外的请求需要携带Authorization: Bearer <token>，提交任务的请求体必须是application/json，
+    避免其他用户的进程或者浏览器中的网页通过本机端口提交任务
+    """
+    service = None
+    token = None
+    roots = None
+
+    def send_json(self, data, status=HTTPStatus.OK):
+        encoded = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def send_json_error(self, status, message):
+        self.send_json({'error': message}, status)
+
+    def _route(self):
+        """
+        解析请求路径
+        :return: (路径分段列表, 查询参数dict)
+        """
+        url = urllib.parse.urlsplit(self.path)
+        parts = [urllib.parse.unquote(part) for part in url.path.split('/') if part]
+        query = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        return parts, query
+
+    def _authorized(self):
+        """
+        校验请求中的令牌，校验失败时返回401
+        :return: 校验通过返回True
+        """
+        scheme, _, value = (self.headers.get('Authorization') or '').partition(' ')
+        if self.token and scheme.lower() == 'bearer' and hmac.compare_digest(value.strip(), self.token):
+            return True
+        self.send_json_error(HTTPStatus.UNAUTHORIZED, 'missing or invalid token')
+        return False
+
+    def _get_job(self, job_id):
+        job = self.service.get(job_id)
+        if job is None:
+            self.send_json_error(HTTPStatus.NOT_FOUND, f'job {job_id} does not exist')
+        return job
+
+    def do_POST(self):
+        parts, _ = self._route()
+        if parts != ['jobs']:
+            self.send_json_error(HTTPStatus.NOT_FOUND, 'not found')
+            return
+        if not self._authorized():
+            return
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            self.send_json_error(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, 'content type must be application/json')
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            params = parse_job_params(json.loads(self.rfile.read(length) or b'{}'), self.roots)
+        except ValueError as e:
+            self.send_json_error(HTTPStatus.BAD_REQUEST, str(e))
+            return
+        try:
+            job = self.service.submit(params)
+        except QueueFullError as e:
+            self.send_json_error(HTTPStatus.SERVICE_UNAVAILABLE, str(e))
+            return
+        self.send_json(job.to_dict(), HTTPStatus.ACCEPTED)
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) != 2 or parts[0] != 'jobs':
+            self.send_json_error(HTTPStatus.NOT_FOUND, 'not found')
+            return
+        if not self._authorized():
+            return
+        job = self._get_job(parts[1])
+        if job is None:
+            return
+        if not self.service.cancel(job.id):
+            self.send_json_error(HTTPStatus.CONFLICT, f'job {job.id} is {job.status}')
+            return
+        self.send_json(job.to_dict())
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ['health']:
+            self.send_json({'status': 'ok', **self.service.stats()})
+        elif not self._authorized():
+            return
+        elif parts == ['jobs']:
+            self.send_json([job.to_dict() for job in self.service.list()])
+        elif len(parts) >= 2 and parts[0] == 'jobs':
+            job = self._get_job(parts[1])
+            if job is None:
+                return
+            if len(parts) == 2:
+                self.send_json(job.to_dict())
+            elif parts[2:] == ['log']:
+                try:
+                    offset = int(query.get('offset', 0))
+                except ValueError:
+                    offset = -1
+                if offset < 0:
+                    self.send_json_error(HTTPStatus.BAD_REQUEST, 'offset must be a non-negative integer')
+                    return
+                text = job.log.read(offset)
+                self.send_json({'offset': offset + len(text), 'text': text, 'status': job.status})
+            elif parts[2:] == ['events']:
+                self.stream_events(job)
+            elif len(parts) >= 4 and parts[2] == 'files':
+                self.send_job_file(job, '/'.join(parts[3:]))
+            else:
+                self.send_json_error(HTTPStatus.NOT_FOUND, 'not found')
+        else:
+            self.send_json_error(HTTPStatus.NOT_FOUND, 'not found')
+
+    def stream_events(self, job):
+        """
+        以ndjson格式持续输出任务的日志和状态变化，任务结束后关闭连接
+        :param job: 任务
+        :return:
+        """
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        offset = 0
+        status = None
+        while True:
+            finished = job.status in FINISHED_STATES
+            events = []
+            text = job.log.read(offset)
+            if text:
+                offset += len(text)
+                events.append({'type': 'log', 'text': text})
+            if job.status != status:
+                status = job.status
+                events.append({'type': 'status', 'job': job.to_dict()})
+            try:
+                for event in events:
+                    self.wfile.write((json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8'))
+                self.wfile.flush()
+            except OSError:
+                return
+            if finished:
+                return
+            job.log.wait(offset, 1)
+
+    def send_job_file(self, job, name):
+        full_name = get_job_file(job, name)
+        if full_name is None:
+            self.send_json_error(HTTPStatus.NOT_FOUND, f'file {name} does not exist')
+            return
+        with open(full_name, 'rb') as fp:
+            content = fp.read()
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', mimetypes.guess_type(full_name)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
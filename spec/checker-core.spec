@@ -6,7 +6,8 @@ a = Analysis(
     pathex=['..\\.venv\\Lib\\site-packages'],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    hiddenimports=['check.checkstyle', 'check.simian', 'check.pmd', 'check.spotbugs', 'check.javancss',
+                   'check.pylint'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -6,7 +6,8 @@ a = Analysis(
     pathex=['..\\.venv\\Lib\\site-packages'],
     binaries=[],
     datas=[('../tool_set', 'tool_set')],
-    hiddenimports=[],
+    hiddenimports=['check.checkstyle', 'check.simian', 'check.pmd', 'check.spotbugs', 'check.javancss',
+                   'check.pylint'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
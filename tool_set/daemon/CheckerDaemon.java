@@ -0,0 +1,493 @@
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.File;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.OutputStreamWriter;
+import java.io.PrintStream;
+import java.io.Writer;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.nio.file.StandardCopyOption;
+import java.security.MessageDigest;
+import java.security.Permission;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.Map;
+import java.util.Properties;
+import java.util.UUID;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.atomic.AtomicInteger;
+
+/**
+ * style-checker 的常驻JVM工作进程。
+ *
+ * 进程启动后加载checkstyle、pmd、simian的jar包，并通过本地socket接收检查任务，避免每次检查都重新启动JVM。
+ * 每个工具使用独立的类加载器，避免工具之间的依赖冲突；checkstyle解析后的配置按内容缓存在内存中。
+ *
+ * 启动方式（java 11+ 源文件模式）：
+ * java CheckerDaemon.java state_file tool_set_path [idle_timeout_seconds]
+ *
+ * 请求协议（UTF-8，按行）：token、命令（RUN/PING/SHUTDOWN），RUN命令之后依次为工具名称、参数个数和参数。
+ * 参数中以 -D 开头并位于工具参数之前的项作为系统属性传递给工具。
+ * 响应协议（UTF-8，按行）：若干 OUT 行，之后以 EXIT、UNSUPPORTED 或 ERROR 行结束。
+ */
+public class CheckerDaemon {
+
+    private static final Map<String, ClassLoader> LOADERS = new ConcurrentHashMap<>();
+
+    private static final Map<String, Object> CHECKSTYLE_CONFIGS = new ConcurrentHashMap<>();
+
+    private static final InheritableThreadLocal<PrintStream> JOB_OUT = new InheritableThreadLocal<>();
+
+    private static final AtomicInteger ACTIVE_JOBS = new AtomicInteger();
+
+    private static volatile long lastActive = System.currentTimeMillis();
+
+    private static boolean exitTrapEnabled;
+
+    private static Path toolSet;
+
+    private static Path stateFile;
+
+    /**
+     * 工具调用System.exit时抛出的异常，用于在不退出进程的情况下获取退出码
+     */
+    static final class ExitTrappedException extends SecurityException {
+        final int status;
+
+        ExitTrappedException(int status) {
+            super("exit " + status);
+            this.status = status;
+        }
+    }
+
+    /**
+     * 将System.out、System.err的输出分发到当前任务的输出流中
+     */
+    static final class DispatchStream extends OutputStream {
+        private final OutputStream fallback;
+
+        DispatchStream(OutputStream fallback) {
+            this.fallback = fallback;
+        }
+
+        private OutputStream target() {
+            PrintStream out = JOB_OUT.get();
+            return out != null ? out : fallback;
+        }
+
+        @Override
+        public void write(int b) throws IOException {
+            target().write(b);
+        }
+
+        @Override
+        public void write(byte[] b, int off, int len) throws IOException {
+            target().write(b, off, len);
+        }
+
+        @Override
+        public void flush() throws IOException {
+            target().flush();
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        stateFile = Paths.get(args[0]).toAbsolutePath();
+        toolSet = Paths.get(args[1]).toAbsolutePath();
+        long idleMillis = (args.length > 2 ? Long.parseLong(args[2]) : 7200L) * 1000L;
+        String token = UUID.randomUUID().toString();
+
+        System.setOut(new PrintStream(new DispatchStream(System.out), true, "UTF-8"));
+        System.setErr(new PrintStream(new DispatchStream(System.err), true, "UTF-8"));
+        exitTrapEnabled = installExitTrap();
+
+        ServerSocket server = new ServerSocket(0, 50, InetAddress.getLoopbackAddress());
+        writeState(server.getLocalPort(), token);
+        startIdleWatcher(idleMillis);
+
+        ExecutorService pool = Executors.newCachedThreadPool(runnable -> {
+            Thread thread = new Thread(runnable, "checker-daemon-job");
+            thread.setDaemon(true);
+            return thread;
+        });
+        while (true) {
+            Socket socket = server.accept();
+            pool.submit(() -> handle(socket, token));
+        }
+    }
+
+    private static boolean installExitTrap() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkPermission(Permission perm) {
+                }
+
+                @Override
+                public void checkPermission(Permission perm, Object context) {
+                }
+
+                @Override
+                public void checkExit(int status) {
+                    if (JOB_OUT.get() != null) {
+                        throw new ExitTrappedException(status);
+                    }
+                }
+            });
+            return true;
+        } catch (UnsupportedOperationException | SecurityException e) {
+            return false;
+        }
+    }
+
+    private static void writeState(int port, String token) throws IOException {
+        String json = "{\"port\": " + port
+                + ", \"token\": \"" + token + "\""
+                + ", \"pid\": " + ProcessHandle.current().pid()
+                + ", \"tool_set\": \"" + escape(toolSet.toString()) + "\""
+                + ", \"exit_trap\": " + exitTrapEnabled + "}";
+        Files.createDirectories(stateFile.getParent());
+        Path temp = Files.createTempFile(stateFile.getParent(), "daemon", ".tmp");
+        temp.toFile().setReadable(false, false);
+        temp.toFile().setReadable(true, true);
+        Files.write(temp, json.getBytes(StandardCharsets.UTF_8));
+        Files.move(temp, stateFile, StandardCopyOption.REPLACE_EXISTING, StandardCopyOption.ATOMIC_MOVE);
+        stateFile.toFile().deleteOnExit();
+    }
+
+    private static void startIdleWatcher(long idleMillis) {
+        Thread watcher = new Thread(() -> {
+            while (true) {
+                try {
+                    Thread.sleep(Math.min(idleMillis, 60_000L));
+                } catch (InterruptedException e) {
+                    return;
+                }
+                if (ACTIVE_JOBS.get() == 0 && System.currentTimeMillis() - lastActive > idleMillis) {
+                    shutdown();
+                }
+            }
+        }, "checker-daemon-idle");
+        watcher.setDaemon(true);
+        watcher.start();
+    }
+
+    private static void shutdown() {
+        try {
+            Files.deleteIfExists(stateFile);
+        } catch (IOException ignored) {
+            // 状态文件删除失败不影响退出
+        }
+        Runtime.getRuntime().halt(0);
+    }
+
+    private static void handle(Socket socket, String token) {
+        try (Socket s = socket;
+             BufferedReader reader = new BufferedReader(
+                     new InputStreamReader(s.getInputStream(), StandardCharsets.UTF_8));
+             Writer writer = new OutputStreamWriter(s.getOutputStream(), StandardCharsets.UTF_8)) {
+            if (!token.equals(reader.readLine())) {
+                writer.write("ERROR invalid token\n");
+                return;
+            }
+            String command = reader.readLine();
+            if ("PING".equals(command)) {
+                writer.write("PONG\n");
+            } else if ("SHUTDOWN".equals(command)) {
+                writer.write("EXIT 0\n");
+                writer.flush();
+                shutdown();
+            } else if ("RUN".equals(command)) {
+                String tool = reader.readLine();
+                int count = Integer.parseInt(reader.readLine().trim());
+                List<String> args = new ArrayList<>();
+                for (int i = 0; i < count; i++) {
+                    args.add(reader.readLine());
+                }
+                runJob(tool, args, writer);
+            } else {
+                writer.write("ERROR unknown command\n");
+            }
+        } catch (IOException | RuntimeException e) {
+            // 客户端断开连接，任务结果丢弃
+        }
+    }
+
+    private static void runJob(String tool, List<String> args, Writer writer) throws IOException {
+        if ("simian".equals(tool) && !exitTrapEnabled) {
+            writer.write("UNSUPPORTED exit trap is not available on this jvm\n");
+            return;
+        }
+        Properties properties = new Properties();
+        List<String> toolArgs = new ArrayList<>();
+        for (String arg : args) {
+            if (toolArgs.isEmpty() && arg.startsWith("-D") && arg.contains("=")) {
+                int index = arg.indexOf('=');
+                properties.setProperty(arg.substring(2, index), arg.substring(index + 1));
+            } else {
+                toolArgs.add(arg);
+            }
+        }
+
+        ByteArrayOutputStream buffer = new ByteArrayOutputStream();
+        PrintStream out = new PrintStream(buffer, true, "UTF-8");
+        ACTIVE_JOBS.incrementAndGet();
+        JOB_OUT.set(out);
+        String result;
+        try {
+            int status;
+            switch (tool) {
+                case "checkstyle":
+                    status = runCheckstyle(toolArgs, properties, out);
+                    break;
+                case "pmd":
+                    status = runPmd(toolArgs);
+                    break;
+                case "simian":
+                    status = runMain("simian", "com.harukizaemon.simian.SimianMain", expandArgFiles(toolArgs));
+                    break;
+                default:
+                    throw new IllegalArgumentException("unknown tool " + tool);
+            }
+            result = "EXIT " + status;
+        } catch (Throwable e) {
+            e.printStackTrace(out);
+            result = "ERROR " + e;
+        } finally {
+            JOB_OUT.remove();
+            ACTIVE_JOBS.decrementAndGet();
+            lastActive = System.currentTimeMillis();
+        }
+        out.flush();
+        for (String line : buffer.toString("UTF-8").split("\\R", -1)) {
+            if (!line.isEmpty()) {
+                writer.write("OUT " + line + "\n");
+            }
+        }
+        writer.write(result.replace('\n', ' ') + "\n");
+    }
+
+    private static ClassLoader loader(String tool) {
+        return LOADERS.computeIfAbsent(tool, name -> {
+            List<URL> urls = new ArrayList<>();
+            try {
+                switch (name) {
+                    case "checkstyle":
+                        urls.add(toolSet.resolve("checkstyle-8.30").resolve("checkstyle-8.30-all.jar").toUri().toURL());
+                        break;
+                    case "pmd":
+                        File[] jars = toolSet.resolve("pmd-6.35.0").resolve("lib").toFile().listFiles();
+                        if (jars != null) {
+                            for (File jar : jars) {
+                                if (jar.getName().endsWith(".jar")) {
+                                    urls.add(jar.toURI().toURL());
+                                }
+                            }
+                        }
+                        break;
+                    case "simian":
+                        urls.add(toolSet.resolve("simian-2.3.33").resolve("simian-2.3.33.jar").toUri().toURL());
+                        break;
+                    default:
+                        throw new IllegalArgumentException("unknown tool " + name);
+                }
+            } catch (IOException e) {
+                throw new IllegalStateException(e);
+            }
+            return new URLClassLoader(urls.toArray(new URL[0]), ClassLoader.getPlatformClassLoader());
+        });
+    }
+
+    private static int runCheckstyle(List<String> args, Properties properties, PrintStream out) throws Exception {
+        String config = null;
+        String format = "plain";
+        String output = null;
+        List<File> files = new ArrayList<>();
+        for (int i = 0; i < args.size(); i++) {
+            String arg = args.get(i);
+            if ("-c".equals(arg)) {
+                config = args.get(++i);
+            } else if ("-f".equals(arg)) {
+                format = args.get(++i);
+            } else if ("-o".equals(arg)) {
+                output = args.get(++i);
+            } else if (arg.startsWith("@")) {
+                for (String name : readArgFile(arg.substring(1))) {
+                    collectFiles(new File(name), files);
+                }
+            } else {
+                collectFiles(new File(arg), files);
+            }
+        }
+        if (config == null) {
+            throw new IllegalArgumentException("missing checkstyle config");
+        }
+
+        ClassLoader cl = loader("checkstyle");
+        ClassLoader previous = Thread.currentThread().getContextClassLoader();
+        Thread.currentThread().setContextClassLoader(cl);
+        try {
+            Object configuration = loadCheckstyleConfig(cl, config, properties);
+            Class<?> checkerClass = cl.loadClass("com.puppycrawl.tools.checkstyle.Checker");
+            Object checker = checkerClass.getConstructor().newInstance();
+            checkerClass.getMethod("setModuleClassLoader", ClassLoader.class).invoke(checker, cl);
+            checkerClass.getMethod("configure", cl.loadClass("com.puppycrawl.tools.checkstyle.api.Configuration"))
+                    .invoke(checker, configuration);
+
+            Class<?> optionsClass = cl.loadClass(
+                    "com.puppycrawl.tools.checkstyle.api.AutomaticBean$OutputStreamOptions");
+            OutputStream stream = output == null ? out : new FileOutputStream(output);
+            Object options = enumValue(optionsClass, output == null ? "NONE" : "CLOSE");
+            String loggerName = "xml".equals(format)
+                    ? "com.puppycrawl.tools.checkstyle.XMLLogger"
+                    : "com.puppycrawl.tools.checkstyle.DefaultLogger";
+            Object listener = cl.loadClass(loggerName).getConstructor(OutputStream.class, optionsClass)
+                    .newInstance(stream, options);
+            checkerClass.getMethod("addListener", cl.loadClass("com.puppycrawl.tools.checkstyle.api.AuditListener"))
+                    .invoke(checker, listener);
+            try {
+                return (Integer) checkerClass.getMethod("process", List.class).invoke(checker, files);
+            } finally {
+                checkerClass.getMethod("destroy").invoke(checker);
+            }
+        } catch (InvocationTargetException e) {
+            throw unwrap(e);
+        } finally {
+            Thread.currentThread().setContextClassLoader(previous);
+        }
+    }
+
+    private static Object loadCheckstyleConfig(ClassLoader cl, String config, Properties properties) throws Exception {
+        Properties merged = new Properties();
+        merged.putAll(System.getProperties());
+        merged.putAll(properties);
+        MessageDigest digest = MessageDigest.getInstance("SHA-256");
+        digest.update(Files.readAllBytes(Paths.get(config)));
+        digest.update(new java.util.TreeMap<>(properties).toString().getBytes(StandardCharsets.UTF_8));
+        StringBuilder key = new StringBuilder();
+        for (byte b : digest.digest()) {
+            key.append(String.format("%02x", b));
+        }
+        Object cached = CHECKSTYLE_CONFIGS.get(key.toString());
+        if (cached != null) {
+            return cached;
+        }
+        Class<?> resolverClass = cl.loadClass("com.puppycrawl.tools.checkstyle.PropertyResolver");
+        Object resolver = cl.loadClass("com.puppycrawl.tools.checkstyle.PropertiesExpander")
+                .getConstructor(Properties.class).newInstance(merged);
+        Class<?> ignoredClass = cl.loadClass(
+                "com.puppycrawl.tools.checkstyle.ConfigurationLoader$IgnoredModulesOptions");
+        Method load = cl.loadClass("com.puppycrawl.tools.checkstyle.ConfigurationLoader")
+                .getMethod("loadConfiguration", String.class, resolverClass, ignoredClass);
+        Object configuration = load.invoke(null, config, resolver, enumValue(ignoredClass, "OMIT"));
+        CHECKSTYLE_CONFIGS.put(key.toString(), configuration);
+        return configuration;
+    }
+
+    private static int runPmd(List<String> args) throws Exception {
+        ClassLoader cl = loader("pmd");
+        ClassLoader previous = Thread.currentThread().getContextClassLoader();
+        Thread.currentThread().setContextClassLoader(cl);
+        try {
+            Method run = cl.loadClass("net.sourceforge.pmd.PMD").getMethod("run", String[].class);
+            return (Integer) run.invoke(null, (Object) args.toArray(new String[0]));
+        } catch (InvocationTargetException e) {
+            throw unwrap(e);
+        } finally {
+            Thread.currentThread().setContextClassLoader(previous);
+        }
+    }
+
+    private static int runMain(String tool, String mainClass, List<String> args) throws Exception {
+        ClassLoader cl = loader(tool);
+        ClassLoader previous = Thread.currentThread().getContextClassLoader();
+        Thread.currentThread().setContextClassLoader(cl);
+        try {
+            Method main = cl.loadClass(mainClass).getMethod("main", String[].class);
+            main.invoke(null, (Object) args.toArray(new String[0]));
+            return 0;
+        } catch (InvocationTargetException e) {
+            if (e.getCause() instanceof ExitTrappedException) {
+                return ((ExitTrappedException) e.getCause()).status;
+            }
+            throw unwrap(e);
+        } finally {
+            Thread.currentThread().setContextClassLoader(previous);
+        }
+    }
+
+    private static void collectFiles(File file, List<File> files) {
+        if (file.isDirectory()) {
+            File[] children = file.listFiles();
+            if (children != null) {
+                for (File child : children) {
+                    collectFiles(child, files);
+                }
+            }
+        } else if (file.isFile()) {
+            files.add(file.getAbsoluteFile());
+        }
+    }
+
+    /**
+     * 读取picocli格式的@argfile，每行一个参数，包含空格的参数使用双引号包围
+     */
+    private static List<String> readArgFile(String argFile) throws IOException {
+        List<String> values = new ArrayList<>();
+        for (String line : Files.readAllLines(Paths.get(argFile), StandardCharsets.UTF_8)) {
+            line = line.trim();
+            if (line.isEmpty() || line.startsWith("#")) {
+                continue;
+            }
+            if (line.length() > 1 && line.startsWith("\"") && line.endsWith("\"")) {
+                line = line.substring(1, line.length() - 1).replace("\\\"", "\"").replace("\\\\", "\\");
+            }
+            values.add(line);
+        }
+        return values;
+    }
+
+    /**
+     * 展开参数中的@argfile，用于本身不支持@argfile的工具
+     */
+    private static List<String> expandArgFiles(List<String> args) throws IOException {
+        List<String> expanded = new ArrayList<>();
+        for (String arg : args) {
+            if (arg.startsWith("@")) {
+                expanded.addAll(readArgFile(arg.substring(1)));
+            } else {
+                expanded.add(arg);
+            }
+        }
+        return expanded;
+    }
+
+    @SuppressWarnings({"unchecked", "rawtypes"})
+    private static Object enumValue(Class<?> enumClass, String name) {
+        return Enum.valueOf((Class) enumClass, name);
+    }
+
+    private static Exception unwrap(InvocationTargetException e) {
+        Throwable cause = e.getCause();
+        return cause instanceof Exception ? (Exception) cause : e;
+    }
+
+    private static String escape(String value) {
+        return value.replace("\\", "\\\\").replace("\"", "\\\"");
+    }
+}
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import namedtuple
+from os import path
+
+import git
+
+from util.cache import hash_config
+from util.source import get_files_list
+from util.trace import trace_span
+from util.util import get_cache_dir
+from util.xml_stream import local_name, rewrite_xml
+
+# 支持基线增量检查的插件及其检查结果文件
+BASELINE_REPORTS = {
+    'checkstyle': 'Checkstyle_Result.xml',
+    'pmd': 'JavaPMD_Result.xml',
+}
+
+IncrementalScope = namedtuple('IncrementalScope', ['baseline_file', 'changed_files', 'replaced_files'])
+
+
+def get_baseline_dir(project_path):
+    """
+    获取工程基线的存放目录，每个工程目录对应一个基线
+    :param project_path: 工程目录
+    :return:
+    """
+    project_key = hashlib.sha1(path.abspath(project_path).encode()).hexdigest()[:16]
+    return get_cache_dir('baseline', project_key)
+
+
+def get_baseline_config_hash(tool_set_path, exclude_files_path, enable_exclude, exclude_test):
+    """
+    计算影响全量检查结果的配置的hash，配置变化之后基线失效
+    :param tool_set_path: 工具集根目录
+    :param exclude_files_path: 例外文件目录
+    :param enable_exclude: 是否开启例外配置
+    :param exclude_test: 是否排除测试代码
+    :return:
+    """
+    return hash_config(
+        path.join(tool_set_path, 'checkstyle-8.30', 'google_checks.xml'),
+        path.join(tool_set_path, 'checkstyle-8.30', 'suppressions.xml'),
+        path.join(tool_set_path, 'pmd-6.35.0', 'rulesets', 'quickstart.xml'),
+        path.join(exclude_files_path, 'CheckStyle_Conf.txt') if enable_exclude else '',
+        path.join(exclude_files_path, 'JavaPMD_Conf.txt') if enable_exclude else '',
+        enable_exclude,
+        exclude_test,
+    )
+
+
+def load_baseline(project_path, config_hash):
+    """
+    读取工程的基线，基线中每个插件的检查结果分别记录了对应的提交
+    :param project_path: 工程目录
+    :param config_hash: 当前的配置hash
+    :return: dict，插件名称到基线记录的映射，基线不存在或者配置已变化时返回空字典
+    """
+    try:
+        with open(path.join(get_baseline_dir(project_path), 'baseline.json'), 'r', encoding='utf-8') as fp:
+            baseline = json.load(fp)
+    except (OSError, ValueError):
+        return {}
+    if baseline.get('config_hash') != config_hash:
+        print('check config changed since the baseline was recorded')
+        return {}
+    return baseline.get('reports', {})
+
+
+def _parse_name_status(output):
+    """
+    解析git diff --name-status -z的输出
+    :param output: 命令输出
+    :return: [(status, path)]
+    """
+    items = output.split('\0')
+    return [(items[i], items[i + 1]) for i in range(0, len(items) - 1, 2) if items[i]]
+
+
+def get_dirty_files(repo):
+    """
+    获取工作区中相对于HEAD有变动的文件和未跟踪的文件
+    :param repo: git仓库
+    :return: 相对于仓库根目录的路径列表
+    """
+    dirty_files = [name for name in repo.git.diff('--name-only', '-z', 'HEAD').split('\0') if name]
+    dirty_files.extend(repo.untracked_files)
+    return dirty_files
+
+
+@trace_span('source')
+def get_incremental_scopes(repo, project_path, baseline, exclude_test=False):
+    """
+    计算每个插件相对于基线需要重新检查的文件
+    :param repo: git仓库
+    :param project_path: 工程目录
+    :param baseline: 插件名称到基线记录的映射
+    :param exclude_test: 不检查测试代码，与记录基线时的全量检查使用相同的文件范围
+    :return: dict，插件名称到IncrementalScope的映射，基线结果文件或者提交已不存在的插件不包含在内
+    """
+    scopes = {}
+    diffs = {}
+    untracked_files = None
+    for tool, record in baseline.items():
+        baseline_file = path.join(get_baseline_dir(project_path), record['report'])
+        if not path.exists(baseline_file):
+            continue
+        commit = record['commit']
+        if commit not in diffs:
+            try:
+                diffs[commit] = repo.git.diff('--name-status', '-z', '--no-renames', commit)
+            except git.GitCommandError as e:
+                print(f'can not diff against the baseline commit {commit}: {e}')
+                diffs[commit] = None
+        if diffs[commit] is None:
+            continue
+        if untracked_files is None:
+            untracked_files = repo.untracked_files
+        names = {name for _, name in _parse_name_status(diffs[commit])}
+        names.update(untracked_files)
+        # 记录基线时工作区中未提交的变动，同样需要重新检查
+        names.update(record.get('dirty_files', []))
+        scopes[tool] = _get_scope(repo, project_path, baseline_file, names, exclude_test)
+        print(f'{tool}: {len(scopes[tool].changed_files)} files changed since baseline commit {commit}')
+    return scopes
+
+
+def _get_scope(repo, project_path, baseline_file, names, exclude_test=False):
+    """
+    从变动的文件中筛选出工程目录下的java文件，排除测试代码时使用与get_all_files相同的规则
+    :return: IncrementalScope
+    """
+    git_address = repo.working_tree_dir
+    project_path = path.join(path.abspath(project_path), '')
+    changed_files = []
+    replaced_files = []
+    for full_name in get_files_list(git_address, sorted(names), exclude_test)[0]:
+        if not path.abspath(full_name).startswith(project_path):
+            continue
+        replaced_files.append(full_name)
+        if path.exists(full_name):
+            changed_files.append(full_name)
+    return IncrementalScope(baseline_file, changed_files, replaced_files)
+
+
+def patch_report(scope, output_file):
+    """
+    使用本次检查的结果修补基线中的检查结果，生成完整的检查结果文件
+    :param scope: IncrementalScope
+    :param output_file: 本次检查的结果文件，修补后的结果写回到该文件
+    :return:
+    """
+    replaced = set(scope.replaced_files)
+
+    def keep_baseline(node):
+        if local_name(node) == 'file' and node.attrib.get('name') in replaced:
+            return None
+        return node
+
+    def keep_files(node):
+        return node if local_name(node) == 'file' else None
+
+    rewrite_xml(output_file, [(scope.baseline_file, keep_baseline), (output_file, keep_files)])
+
+
+@trace_span('baseline')
+def save_baseline(repo, project_path, output_path, config_hash, tools):
+    """
+    将本次全量检查的结果记录为工程的基线
+    :param repo: git仓库
+    :param project_path: 工程目录
+    :param output_path: 检查结果目录
+    :param config_hash: 配置hash
+    :param tools: 执行成功的插件名称列表
+    :return:
+    """
+    baseline_dir = get_baseline_dir(project_path)
+    tools = [tool for tool in tools
+             if tool in BASELINE_REPORTS and path.exists(path.join(output_path, BASELINE_REPORTS[tool]))]
+    if not tools:
+        return
+    reports = load_baseline(project_path, config_hash)
+    commit = repo.head.commit.hexsha
+    dirty_files = get_dirty_files(repo)
+    for tool in tools:
+        report = BASELINE_REPORTS[tool]
+        shutil.copy(path.join(output_path, report), path.join(baseline_dir, report))
+        reports[tool] = {
+            'report': report,
+            'commit': commit,
+            'dirty_files': dirty_files,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+    temp_file = path.join(baseline_dir, 'baseline.json.tmp')
+    with open(temp_file, 'w', encoding='utf-8') as fp:
+        json.dump({'config_hash': config_hash, 'reports': reports}, fp, ensure_ascii=False, indent=2)
+    os.replace(temp_file, path.join(baseline_dir, 'baseline.json'))
+    print(f'baseline recorded at commit {commit} for {", ".join(tools)}')
@@ -0,0 +1,81 @@
+import json
+import os
+import re
+from os import path
+
+from util.service import parse_job_params
+
+
+def load_manifest(manifest_file):
+    """
+    读取批量检查清单
+    清单是json列表，或者包含defaults和entries的json对象；每一项的参数与检查服务提交任务的参数相同，
+    另外可以使用name指定结果目录名称
+    project为相对路径时相对于清单文件所在目录
+    :param manifest_file: 清单文件路径
+    :return: 列表，每一项为(名称, check参数)
+    """
+    with open(manifest_file, 'r', encoding='utf-8') as fp:
+        manifest = json.load(fp)
+    defaults = {}
+    if isinstance(manifest, dict):
+        defaults = manifest.get('defaults', {})
+        manifest = manifest.get('entries')
+    if not isinstance(manifest, list) or not manifest:
+        raise ValueError('manifest must contain a non-empty list of entries')
+    base_dir = path.dirname(path.abspath(manifest_file))
+    entries = []
+    for index, item in enumerate(manifest):
+        if isinstance(item, str):
+            item = {'project': item}
+        if not isinstance(item, dict):
+            raise ValueError(f'entry {index} must be a json object or a project path')
+        body = {**defaults, **item}
+        name = body.pop('name', None)
+        if isinstance(body.get('project'), str):
+            body['project'] = path.join(base_dir, body['project'])
+        try:
+            params = parse_job_params(body)
+        except ValueError as e:
+            raise ValueError(f'entry {index}: {e}') from e
+        if params.get('commit_range') and params.get('files'):
+            raise ValueError(f'entry {index}: range and files can not be used together')
+        name = name or path.basename(params['project_path'].rstrip(os.sep))
+        name = re.sub(r'[^\w.-]+', '_', f"{index + 1:03d}-{name}")
+        entries.append((name, params))
+    return entries
+
+
+def schedule_entries(entries):
+    """
+    按工程轮流排列检查项，避免同一个工程的多个检查项占满队列，其他工程长时间等待
+    :param entries: load_manifest返回的列表
+    :return: 重新排列的列表
+    """
+    groups = {}
+    for entry in entries:
+        groups.setdefault(entry[1]['project_path'], []).append(entry)
+    ordered = []
+    queues = list(groups.values())
+    while queues:
+        ordered.extend(queue.pop(0) for queue in queues)
+        queues = [queue for queue in queues if queue]
+    return ordered
+
+
+def write_summary(output_path, records):
+    """
+    输出批量检查的汇总结果
+    :param output_path: 批量检查结果目录
+    :param records: 每个检查项的结果dict
+    :return: 汇总文件路径
+    """
+    summary_file = path.join(output_path, 'summary.json')
+    with open(summary_file, 'w', encoding='utf-8') as fp:
+        json.dump(records, fp, ensure_ascii=False, indent=2)
+    name_width = max(len(record['name']) for record in records)
+    for record in records:
+        results = ', '.join(f'{k}:{v}' for k, v in (record['results'] or {}).items())
+        print(f"{record['name']:<{name_width}}  {record['status']:<9}  exit:{record['exit_status']}  "
+              f"{record['duration']:.1f}s  {results}")
+    return summary_file
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from os import path
+
+from util.trace import trace_span
+from util.util import get_cache_dir
+
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024
+
+
+def hash_file(file_path):
+    """
+    按照git blob的方式计算文件内容的hash，与git索引中记录的blob id一致
+    :param file_path: 文件路径
+    :return: 40位16进制字符串
+    """
+    sha = hashlib.sha1()
+    sha.update(f'blob {path.getsize(file_path)}\0'.encode())
+    with open(file_path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_config(*items):
+    """
+    计算检查配置的hash，配置项可以是文件路径或者字符串，文件路径使用文件内容参与计算
+    :param items: 配置项
+    :return: 16进制字符串
+    """
+    sha = hashlib.sha256()
+    for item in items:
+        if item and path.isfile(item):
+            with open(item, 'rb') as fp:
+                sha.update(fp.read())
+        else:
+            sha.update(str(item).encode())
+        sha.update(b'\0')
+    return sha.hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    检查结果缓存，按照(文件blob hash, 工具, 配置hash)缓存单个文件的检查结果
+    使用sqlite存储，总大小超过上限时按照最近访问时间淘汰
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_CACHE_SIZE, blob_ids=None):
+        """
+
+        :param cache_dir: 缓存目录，为空时使用用户缓存目录
+        :param max_size: 缓存的最大字节数
+        :param blob_ids: 已知的文件blob id，通常来自git索引，未知的文件计算内容hash
+        """
+        cache_dir = cache_dir or get_cache_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = path.join(cache_dir, 'results.sqlite3')
+        self.max_size = max_size
+        self.blob_ids = dict(blob_ids or {})
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS results '
+                           '(key TEXT PRIMARY KEY, size INTEGER NOT NULL, atime REAL NOT NULL, value TEXT NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS results_atime ON results (atime)')
+        self._conn.commit()
+        self._owner = True
+
+    def fork(self, blob_ids=None):
+        """
+        创建共享同一个数据库连接的缓存对象，用于服务模式下多次检查复用已打开的缓存
+        :param blob_ids: 本次检查已知的文件blob id
+        :return: ResultCache
+        """
+        cache = object.__new__(ResultCache)
+        cache.db_path = self.db_path
+        cache.max_size = self.max_size
+        cache.blob_ids = dict(blob_ids or {})
+        cache._lock = self._lock
+        cache._conn = self._conn
+        cache._owner = False
+        return cache
+
+    def get_blob_id(self, file_path):
+        """
+        获取文件的blob id
+        :param file_path: 文件路径
+        :return:
+        """
+        blob_id = self.blob_ids.get(file_path)
+        if blob_id is None:
+            blob_id = hash_file(file_path)
+            self.blob_ids[file_path] = blob_id
+        return blob_id
+
+    def _key(self, tool, config_hash, file_path, blob_id=None):
+        # 部分检查规则与文件名相关（如类名与文件名一致），文件名也作为缓存key的一部分
+        blob_id = blob_id or self.get_blob_id(file_path)
+        return f'{tool}:{config_hash}:{blob_id}:{path.basename(file_path)}'
+
+    @trace_span('cache')
+    def lookup(self, tool, config_hash, files, blob_ids=None):
+        """
+        查询文件的缓存结果
+        :param tool: 工具名称
+        :param config_hash: 配置hash
+        :param files: 文件列表
+        :param blob_ids: 使用指定的内容hash代替文件的blob id，如class文件的hash
+        :return: (hits, misses)，hits为文件到缓存结果的映射，misses为未命中的文件列表
+        """
+        keys = {}
+        for file in files:
+            try:
+                keys[file] = self._key(tool, config_hash, file, (blob_ids or {}).get(file))
+            except OSError:
+                pass
+        hits = {}
+        with self._lock:
+            for file, key in keys.items():
+                row = self._conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    hits[file] = json.loads(row[0])
+            if hits:
+                now = time.time()
+                self._conn.executemany('UPDATE results SET atime = ? WHERE key = ?',
+                                       [(now, keys[file]) for file in hits])
+                self._conn.commit()
+        misses = [file for file in files if file not in hits]
+        print(f'{tool} cache: {len(hits)} hits, {len(misses)} misses')
+        return hits, misses
+
+    @trace_span('cache')
+    def store(self, tool, config_hash, results, blob_ids=None):
+        """
+        保存文件的检查结果
+        :param tool: 工具名称
+        :param config_hash: 配置hash
+        :param results: 文件到检查结果的映射，检查结果需要能够序列化为json
+        :param blob_ids: 使用指定的内容hash代替文件的blob id
+        :return:
+        """
+        now = time.time()
+        rows = []
+        for file, value in results.items():
+            try:
+                key = self._key(tool, config_hash, file, (blob_ids or {}).get(file))
+            except OSError:
+                continue
+            data = json.dumps(value, ensure_ascii=False)
+            rows.append((key, len(data), now, data))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO results (key, size, atime, value) VALUES (?, ?, ?, ?)',
+                                   rows)
+            self._conn.commit()
+            self._evict()
+
+    def _evict(self):
+        """
+        缓存总大小超过上限时，按照最近访问时间淘汰，直到总大小低于上限的90%
+        :return:
+        """
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_size:
+            return
+        target = total - int(self.max_size * 0.9)
+        removed = 0
+        keys = []
+        for key, size in self._conn.execute('SELECT key, size FROM results ORDER BY atime'):
+            keys.append((key,))
+            removed += size
+            if removed >= target:
+                break
+        self._conn.executemany('DELETE FROM results WHERE key = ?', keys)
+        self._conn.commit()
+
+    def close(self):
+        # 共享连接的缓存对象不关闭连接，由创建连接的对象关闭
+        if not self._owner:
+            return
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,156 @@
+import re
+from bisect import bisect_right
+from os import path
+
+from util.source import split_commit_range
+from util.trace import trace_span
+from util.xml_stream import local_name, rewrite_xml
+
+# git中空树的id，用于没有父提交的提交
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+HUNK_PATTERN = re.compile(r'^@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+class ChangedLines:
+    """
+    文件中新增或修改的行，按起始行排序的不相交区间，支持二分查找
+    """
+
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(intervals):
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def overlaps(self, start, end=None):
+        """
+        判断[start, end]中是否有新增或修改的行
+        :param start: 起始行
+        :param end: 结束行，为空时只判断起始行
+        :return:
+        """
+        end = start if end is None else end
+        index = bisect_right(self.starts, end) - 1
+        return index >= 0 and self.ends[index] >= start
+
+    def __len__(self):
+        return len(self.starts)
+
+
+def _unquote(name):
+    """
+    还原git输出中使用双引号和转义字符表示的路径
+    """
+    if name.startswith('"') and name.endswith('"'):
+        name = name[1:-1].encode().decode('unicode_escape').encode('latin-1').decode('utf-8', 'replace')
+    return name
+
+
+def parse_hunks(output, root):
+    """
+    解析 git diff -U0 的输出，记录每个文件中新增或修改的行
+    :param output: 命令输出
+    :param root: 文件路径的根目录
+    :return: dict，文件全路径到ChangedLines的映射；只有删除的文件不包含在内
+    """
+    intervals = {}
+    current = None
+    # 当前hunk中剩余的删除行和新增行数量，hunk中内容以+++开头的新增行不是文件头
+    remaining = 0
+    for line in output.splitlines():
+        if remaining > 0:
+            if line[:1] in ('+', '-', ' '):
+                remaining -= 1
+            continue
+        if line.startswith('+++ '):
+            name = _unquote(line[4:].rstrip('\t'))
+            if name == '/dev/null':
+                current = None
+                continue
+            current = intervals.setdefault(path.normpath(path.join(root, name[2:])), [])
+        elif line.startswith('@@'):
+            match = HUNK_PATTERN.match(line)
+            if match:
+                start, count = int(match.group(2)), int(match.group(3) or 1)
+                remaining = int(match.group(1) or 1) + count
+                if count > 0 and current is not None:
+                    current.append((start, start + count - 1))
+    return {name: ChangedLines(items) for name, items in intervals.items()}
+
+
+@trace_span('source')
+def get_changed_lines(repo, mode, commit_range=None, extract_path=None):
+    """
+    一次执行git diff，获取检查的文件中新增或修改的行
+    mode为1时相对于上一次提交之前的版本，mode为2时相对于HEAD，都与工作区比较；
+    指定提交范围时相对于起始版本，结束版本不是HEAD时与提取到extract_path中的文件对应
+    :param repo: git仓库
+    :param mode: 检查模式
+    :param commit_range: 提交范围
+    :param extract_path: 提交范围的结束版本中文件的提取目录
+    :return: dict，文件全路径到ChangedLines的映射，不在其中的文件（如未跟踪的文件）全部行都视为变动
+    """
+    root = repo.working_tree_dir
+    if commit_range:
+        start, end = split_commit_range(commit_range)
+        if '...' in commit_range:
+            start = repo.git.merge_base(start, end)
+        revisions = [start]
+        if repo.commit(end) != repo.head.commit:
+            revisions.append(end)
+            root = extract_path
+    elif mode == '1':
+        head = repo.head.commit
+        revisions = [head.parents[0].hexsha if head.parents else EMPTY_TREE]
+    else:
+        revisions = ['HEAD']
+    output = repo.git.diff('-U0', '-M', '--no-color', '--no-ext-diff', '--src-prefix=a/', '--dst-prefix=b/',
+                           *revisions)
+    return parse_hunks(output, root)
+
+
+def _get_lines(node):
+    """
+    获取问题所在的行，checkstyle使用line，pmd使用beginline和endline
+    :return: (起始行, 结束行)，没有行号的问题返回None
+    """
+    start = node.attrib.get('line') or node.attrib.get('beginline')
+    if not start:
+        return None
+    return int(start), int(node.attrib.get('endline') or start)
+
+
+def filter_report(report_file, changed_lines):
+    """
+    过滤checkstyle或pmd的检查结果，只保留新增或修改的行上的问题
+    没有行号的问题和不在changed_lines中的文件的问题全部保留
+    :param report_file: checkstyle或pmd xml格式的检查结果文件
+    :param changed_lines: 文件全路径到ChangedLines的映射
+    :return: 保留的错误级别的问题数量，checkstyle只统计severity为error的问题
+    """
+    if not path.exists(report_file):
+        return 0
+    errors = 0
+
+    def filter_file(file_node):
+        nonlocal errors
+        if local_name(file_node) != 'file':
+            return file_node
+        lines = changed_lines.get(path.normpath(file_node.attrib.get('name', '')))
+        for node in list(file_node):
+            if not isinstance(node.tag, str):
+                continue
+            span = _get_lines(node)
+            if lines is not None and span is not None and not lines.overlaps(*span):
+                file_node.remove(node)
+            elif node.attrib.get('severity', 'error') == 'error':
+                errors += 1
+        return file_node
+
+    rewrite_xml(report_file, [(report_file, filter_file)])
+    return errors
@@ -0,0 +1,161 @@
+import os
+import struct
+from os import path
+
+from util.trace import trace_span
+
+# 源代码目录到编译输出目录的映射，按照maven、gradle、旧版gradle的顺序查找
+SOURCE_ROOTS = {
+    path.join('src', 'main', 'java'): (path.join('target', 'classes'),
+                                       path.join('build', 'classes', 'java', 'main'),
+                                       path.join('build', 'classes')),
+    path.join('src', 'test', 'java'): (path.join('target', 'test-classes'),
+                                       path.join('build', 'classes', 'java', 'test'),
+                                       path.join('build', 'test-classes')),
+}
+
+# 常量池中各类型常量除tag之外占用的字节数，utf8常量的长度不固定
+CONSTANT_SIZES = {3: 4, 4: 4, 5: 8, 6: 8, 7: 2, 8: 2, 9: 4, 10: 4, 11: 4, 12: 4, 15: 3, 16: 2, 17: 4, 18: 4,
+                  19: 2, 20: 2}
+
+
+def read_source_file(class_file):
+    """
+    读取class文件中的SourceFile属性，即编译生成该class文件的源代码文件名
+    :param class_file: class文件
+    :return: 源代码文件名，如Foo.java；文件无法解析或者没有SourceFile属性时返回None
+    """
+    try:
+        with open(class_file, 'rb') as fp:
+            data = fp.read()
+        if data[:4] != b'\xca\xfe\xba\xbe':
+            return None
+        count = struct.unpack_from('>H', data, 8)[0]
+        offset = 10
+        utf8 = {}
+        index = 1
+        while index < count:
+            tag = data[offset]
+            if tag == 1:
+                length = struct.unpack_from('>H', data, offset + 1)[0]
+                utf8[index] = data[offset + 3:offset + 3 + length]
+                offset += 3 + length
+            else:
+                offset += 1 + CONSTANT_SIZES[tag]
+                # long和double常量占用两个常量池位置
+                if tag in (5, 6):
+                    index += 1
+            index += 1
+        # access_flags, this_class, super_class
+        offset += 6
+        offset += 2 + 2 * struct.unpack_from('>H', data, offset)[0]
+        # 跳过字段和方法
+        for _ in range(2):
+            members = struct.unpack_from('>H', data, offset)[0]
+            offset += 2
+            for _ in range(members):
+                attributes = struct.unpack_from('>H', data, offset + 6)[0]
+                offset += 8
+                for _ in range(attributes):
+                    offset += 6 + struct.unpack_from('>I', data, offset + 2)[0]
+        attributes = struct.unpack_from('>H', data, offset)[0]
+        offset += 2
+        for _ in range(attributes):
+            name_index, length = struct.unpack_from('>HI', data, offset)
+            if utf8.get(name_index) == b'SourceFile':
+                return utf8[struct.unpack_from('>H', data, offset + 6)[0]].decode('utf-8', 'replace')
+            offset += 6 + length
+    except (OSError, struct.error, KeyError, IndexError):
+        pass
+    return None
+
+
+def split_source_path(java_file):
+    """
+    将java源代码文件的路径拆分为模块目录、源代码目录和相对路径
+    :param java_file: java源代码文件全路径
+    :return: (模块目录, 源代码目录相对于模块目录的路径, 文件相对于源代码目录的路径)，不在源代码目录中时返回None
+    """
+    java_file = path.normpath(java_file)
+    for source_root in SOURCE_ROOTS:
+        marker = os.sep + source_root + os.sep
+        if marker in java_file:
+            module, _, relative = java_file.partition(marker)
+            return module, source_root, relative
+    return None
+
+
+def _walk_class_files(root, skipped_dirs):
+    """
+    遍历编译输出目录中的全部class文件
+    :param root: 编译输出目录
+    :param skipped_dirs: 不遍历的子目录，如build/classes中的build/classes/java/main
+    :return: class文件全路径的生成器
+    """
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [name for name in dir_names if path.join(dir_path, name) not in skipped_dirs]
+        for name in file_names:
+            if name.endswith('.class'):
+                yield path.join(dir_path, name)
+
+
+class ClassIndex:
+    """
+    编译输出目录的索引，记录每个java源代码文件编译生成的全部class文件，包括内部类和匿名类
+    每个模块的编译输出目录只在第一次查询时遍历一次
+    """
+
+    def __init__(self):
+        self._modules = {}
+
+    def get_class_files(self, java_file):
+        """
+        获取java源代码文件编译生成的class文件
+        :param java_file: java源代码文件全路径
+        :return: class文件全路径列表，没有编译输出时返回空列表
+        """
+        parts = split_source_path(java_file)
+        if parts is None:
+            return []
+        module, source_root, relative = parts
+        key = (module, source_root)
+        if key not in self._modules:
+            self._modules[key] = build_module_index(module, source_root, SOURCE_ROOTS[source_root])
+        return self._modules[key].get(relative, [])
+
+
+@trace_span('class_index')
+def build_module_index(module, source_root, output_dirs):
+    """
+    遍历模块的编译输出目录，建立源代码文件到class文件的映射
+    class文件按照命名规则对应到源代码文件，Foo$Bar.class和Foo$1.class对应Foo.java；
+    命名规则对应的源代码文件不存在时（如同一个文件中的非public类），使用class文件中的SourceFile属性
+    同一个源代码文件在多种目录结构中都有编译输出时，使用SOURCE_ROOTS中靠前的目录
+    :param module: 模块目录
+    :param source_root: 源代码目录相对于模块目录的路径
+    :param output_dirs: 编译输出目录相对于模块目录的路径
+    :return: dict，源代码文件相对于源代码目录的路径到class文件全路径列表的映射
+    """
+    source_dir = path.join(module, source_root)
+    all_output_dirs = {path.join(module, output_dir) for dirs in SOURCE_ROOTS.values() for output_dir in dirs}
+    source_exists = {}
+    index = {}
+    for output_dir in output_dirs:
+        root = path.join(module, output_dir)
+        if not path.isdir(root):
+            continue
+        found = {}
+        for class_file in _walk_class_files(root, all_output_dirs - {root}):
+            relative = path.relpath(class_file, root)
+            package_dir = path.dirname(relative)
+            source = path.join(package_dir, path.basename(relative)[:-len('.class')].split('$')[0] + '.java')
+            if source not in source_exists:
+                source_exists[source] = path.isfile(path.join(source_dir, source))
+            if not source_exists[source]:
+                source_file = read_source_file(class_file)
+                if source_file:
+                    source = path.join(package_dir, source_file)
+            found.setdefault(source, []).append(class_file)
+        for source, class_files in found.items():
+            index.setdefault(source, sorted(class_files))
+    return index
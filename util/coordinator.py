@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import secrets
+import socket
+import threading
+from os import path
+
+from util.util import get_cache_dir, is_windows
+
+if is_windows():
+    import msvcrt
+else:
+    import fcntl
+
+# 由持有锁的进程自己决定的参数，其他进程提交的任务中的这些参数会被忽略，避免通过提交任务读写其他目录
+LOCAL_PARAMS = ('project_path', 'tool_set_path', 'output_path')
+
+
+def merge_jobs(pending, job):
+    """
+    合并等待执行的任务和新提交的任务，后提交的任务优先
+    只有两个任务都是检查指定文件，并且其他参数相同时，才合并文件列表
+    :param pending: 等待执行的任务，可以为空
+    :param job: 新提交的任务
+    :return: 合并后的任务
+    """
+    if not pending or not pending.get('files') or not job.get('files'):
+        return job
+    if {k: v for k, v in pending.items() if k != 'files'} != {k: v for k, v in job.items() if k != 'files'}:
+        return job
+    files = list(dict.fromkeys(pending['files'].split(',') + job['files'].split(',')))
+    return {**job, 'files': ','.join(files)}
+
+
+class InstanceCoordinator:
+    """
+    同一个工程只运行一个检查进程，进程持有工程对应的锁文件，并在本地端口上接收其他进程提交的任务
+    """
+
+    def __init__(self, project_path):
+        """
+
+        :param project_path: 工程目录
+        """
+        key = hashlib.sha1(path.abspath(project_path).encode()).hexdigest()[:16]
+        instance_dir = get_cache_dir('instances')
+        self.lock_file = path.join(instance_dir, f'{key}.lock')
+        self.state_file = path.join(instance_dir, f'{key}.json')
+        self._lock_fp = None
+        self._server = None
+        self._pending = None
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        尝试获取工程的锁，获取成功之后开始接收其他进程提交的任务
+        :return: 获取成功返回True，已有其他进程持有锁时返回False
+        """
+        fp = open(self.lock_file, 'a+')
+        try:
+            if is_windows():
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fp.close()
+            return False
+        self._lock_fp = fp
+        self._start_server()
+        return True
+
+    def _start_server(self):
+        self._server = socket.create_server(('127.0.0.1', 0))
+        token = secrets.token_hex(16)
+        state = {'pid': os.getpid(), 'port': self._server.getsockname()[1], 'token': token}
+        temp_file = f'{self.state_file}.{os.getpid()}.tmp'
+        # 状态文件中包含访问令牌，只允许当前用户读写
+        fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'w', encoding='utf-8') as fp:
+            json.dump(state, fp)
+        os.replace(temp_file, self.state_file)
+        threading.Thread(target=self._serve, args=(token,), name='coordinator', daemon=True).start()
+
+    def _serve(self, token):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    self._handle(conn, token)
+                except (OSError, ValueError) as e:
+                    print(f'failed to receive job: {e}')
+
+    def _handle(self, conn, token):
+        conn.settimeout(10)
+        with conn.makefile('rw', encoding='utf-8') as fp:
+            request = json.loads(fp.readline())
+            if request.get('token') != token:
+                return
+            with self._condition:
+                accepted = not self._closed
+                if accepted:
+                    replaced = self._pending is not None
+                    job = {k: v for k, v in request['job'].items() if k not in LOCAL_PARAMS}
+                    self._pending = merge_jobs(self._pending, job)
+                    self._condition.notify_all()
+            if accepted:
+                print(f"received job from pid {request.get('pid')}"
+                      f"{', replacing the pending job' if replaced else ''}")
+            fp.write(json.dumps({'accepted': accepted, 'pid': os.getpid()}) + '\n')
+            fp.flush()
+
+    def hand_over(self, job):
+        """
+        将任务提交给持有锁的进程
+        :param job: 任务参数
+        :return: 提交成功时返回持有锁的进程id，否则返回None
+        """
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as fp:
+                state = json.load(fp)
+            with socket.create_connection(('127.0.0.1', state['port']), timeout=10) as conn:
+                with conn.makefile('rw', encoding='utf-8') as fp:
+                    fp.write(json.dumps({'token': state['token'], 'pid': os.getpid(), 'job': job}) + '\n')
+                    fp.flush()
+                    response = json.loads(fp.readline() or '{}')
+        except (OSError, ValueError, KeyError):
+            return None
+        return response.get('pid') if response.get('accepted') else None
+
+    def next_job(self, wait=False):
+        """
+        获取等待执行的任务；不等待并且没有任务时停止接收任务，之后提交的任务会被拒绝
+        :param wait: 没有任务时是否一直等待
+        :return: 任务参数，不包含LOCAL_PARAMS中的参数，没有任务时返回None
+        """
+        with self._condition:
+            while self._pending is None and wait:
+                # 使用超时等待，保证Ctrl+C可以中断等待
+                self._condition.wait(1)
+            job, self._pending = self._pending, None
+            if job is None:
+                self._closed = True
+            return job
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+        if self._server is not None:
+            self._server.close()
+            try:
+                os.remove(self.state_file)
+            except OSError:
+                pass
+        if self._lock_fp is not None:
+            self._lock_fp.close()
+            self._lock_fp = None
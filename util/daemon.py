@@ -0,0 +1,198 @@
+import json
+import os
+import socket
+import subprocess
+import time
+from os import path
+
+from util.toolchain import get_java_version
+from util.trace import span
+from util.util import get_cache_dir, run, is_windows
+
+DAEMON_SOURCE = path.join('daemon', 'CheckerDaemon.java')
+STATE_FILE_NAME = 'jvm-daemon.json'
+DAEMON_TOOLS = ('checkstyle', 'pmd', 'simian')
+
+
+def get_state_file():
+    """
+    获取常驻JVM进程的状态文件路径，文件中记录了进程监听的端口和访问令牌
+    :return:
+    """
+    return path.join(get_cache_dir(), STATE_FILE_NAME)
+
+
+def read_daemon_state():
+    """
+    读取常驻JVM进程的状态
+    :return: dict，进程未启动时返回None
+    """
+    try:
+        with open(get_state_file(), 'r', encoding='utf-8') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def _request(state, lines, timeout=None):
+    """
+    向常驻JVM进程发送请求，并读取全部响应
+    :param state: 进程状态
+    :param lines: 请求内容，每个元素为一行
+    :param timeout: 超时时间，为空时不限制
+    :return: 响应行列表
+    """
+    with socket.create_connection(('127.0.0.1', state['port']), timeout=timeout or 5) as sock:
+        sock.settimeout(timeout)
+        payload = '\n'.join([state['token'], *lines]) + '\n'
+        sock.sendall(payload.encode('utf-8'))
+        with sock.makefile('r', encoding='utf-8', errors='replace') as fp:
+            return [line.rstrip('\n') for line in fp]
+
+
+def is_daemon_running(state=None):
+    """
+    检查常驻JVM进程是否可用
+    :param state: 进程状态，为空时从状态文件读取
+    :return:
+    """
+    state = state or read_daemon_state()
+    if not state:
+        return False
+    try:
+        return _request(state, ['PING'], timeout=2) == ['PONG']
+    except OSError:
+        return False
+
+
+def start_daemon(tool_set_path, idle_timeout=7200, wait_seconds=30):
+    """
+    启动常驻JVM进程，进程在空闲idle_timeout秒之后自动退出
+    :param tool_set_path: 工具集根目录
+    :param idle_timeout: 空闲超时时间，单位秒
+    :param wait_seconds: 等待进程就绪的时间，单位秒
+    :return: 启动成功返回0，否则返回-1
+    """
+    tool_set_path = path.abspath(tool_set_path)
+    state = read_daemon_state()
+    if is_daemon_running(state) and state.get('tool_set') == tool_set_path:
+        print(f"jvm daemon is already running, pid {state.get('pid')}")
+        return 0
+    stop_daemon()
+    source = path.join(tool_set_path, DAEMON_SOURCE)
+    if not path.exists(source):
+        print(f'jvm daemon source {source} does not exist')
+        return -1
+    java_version = get_java_version()
+    if java_version < 11:
+        print('jvm daemon requires java 11 or later')
+        return -1
+    cmd = ['java', '-Dfile.encoding=UTF-8']
+    # java 18之后默认禁止在运行时安装SecurityManager，simian的退出拦截依赖于SecurityManager
+    if 18 <= java_version < 24:
+        cmd.append('-Djava.security.manager=allow')
+    cmd.extend([source, get_state_file(), tool_set_path, str(idle_timeout)])
+    print(' '.join(cmd), end=os.linesep)
+    kwargs = {}
+    if is_windows():
+        kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **kwargs)
+
+    deadline = time.monotonic() + wait_seconds
+    while time.monotonic() < deadline:
+        state = read_daemon_state()
+        if state and is_daemon_running(state):
+            print(f"jvm daemon started, pid {state.get('pid')}, port {state.get('port')}")
+            return 0
+        time.sleep(0.2)
+    print('jvm daemon failed to start')
+    return -1
+
+
+def stop_daemon():
+    """
+    停止常驻JVM进程
+    :return:
+    """
+    state = read_daemon_state()
+    if state:
+        try:
+            _request(state, ['SHUTDOWN'], timeout=5)
+            print(f"jvm daemon stopped, pid {state.get('pid')}")
+        except OSError:
+            pass
+    try:
+        os.remove(get_state_file())
+    except OSError:
+        pass
+    return 0
+
+
+def daemon_status():
+    """
+    输出常驻JVM进程的状态
+    :return: 进程运行中返回0，否则返回1
+    """
+    state = read_daemon_state()
+    if is_daemon_running(state):
+        print(f"jvm daemon is running, pid {state.get('pid')}, port {state.get('port')}, "
+              f"tool set {state.get('tool_set')}")
+        return 0
+    print('jvm daemon is not running')
+    return 1
+
+
+def run_in_daemon(tool, tool_set_path, tool_args, properties=None):
+    """
+    在常驻JVM进程中执行检查工具
+    :param tool: 工具名称，checkstyle、pmd或simian
+    :param tool_set_path: 工具集根目录，需要与常驻进程加载的工具集一致
+    :param tool_args: 工具的命令行参数
+    :param properties: 传递给工具的系统属性
+    :return: 工具的退出码；常驻进程不可用或者不支持该任务时返回None
+    """
+    if tool not in DAEMON_TOOLS:
+        return None
+    state = read_daemon_state()
+    if not state or state.get('tool_set') != path.abspath(tool_set_path):
+        return None
+    args = [f'-D{key}={value}' for key, value in (properties or {}).items()]
+    args.extend(tool_args)
+    if any('\n' in arg for arg in args):
+        return None
+    try:
+        with span(tool, 'daemon', args=' '.join(tool_args)[:1000]):
+            response = _request(state, ['RUN', tool, str(len(args)), *args])
+    except OSError:
+        return None
+    print(f"[jvm daemon] {tool} {' '.join(tool_args)}", end=os.linesep)
+    for line in response:
+        if line.startswith('OUT '):
+            print(line[4:])
+        elif line.startswith('EXIT '):
+            return int(line[5:])
+        elif line.startswith('UNSUPPORTED '):
+            print(f'jvm daemon can not run {tool}: {line[12:]}')
+            return None
+        elif line.startswith('ERROR '):
+            print(f'jvm daemon failed to run {tool}: {line[6:]}')
+            return None
+    return None
+
+
+def run_java_tool(tool, tool_set_path, tool_args, cmd, properties=None):
+    """
+    执行java检查工具，常驻JVM进程可用时交给常驻进程执行，否则启动新的进程执行
+    :param tool: 工具名称
+    :param tool_set_path: 工具集根目录
+    :param tool_args: 工具的命令行参数，不包括java程序和jar包
+    :param cmd: 启动新进程时使用的完整命令
+    :param properties: 传递给工具的系统属性
+    :return: 工具的退出码
+    """
+    ret = run_in_daemon(tool, tool_set_path, tool_args, properties)
+    if ret is None:
+        return run(cmd)
+    return ret
@@ -0,0 +1,275 @@
+import hashlib
+import re
+import sqlite3
+from array import array
+from collections import namedtuple
+from os import path
+
+from lxml import etree
+
+from util.trace import trace_span
+from util.util import get_cache_dir
+
+# 重复代码的最小行数，与simian的-threshold=20一致，行数为去掉空行、注释、import和package之后的有效行数
+THRESHOLD = 20
+# 每个指纹覆盖的行数和winnowing的窗口大小，保证不少于K_GRAM + WINDOW - 1 = THRESHOLD行的重复代码至少有一个相同的指纹
+K_GRAM = 16
+WINDOW = THRESHOLD - K_GRAM + 1
+# 滚动hash使用的模数和基数，模数小于2^63，指纹可以直接保存为sqlite的整数
+MODULUS = (1 << 61) - 1
+BASE = 1000003
+# 索引格式的版本，阈值、指纹参数或规范化规则变化之后重新建立索引
+INDEX_VERSION = f'1:{THRESHOLD}:{K_GRAM}'
+# 索引数据库使用内存映射读取的最大字节数
+MMAP_SIZE = 256 * 1024 * 1024
+
+COMMENT_PATTERN = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.S)
+IMPORT_PATTERN = re.compile(r'\s*(?:import|package)\s')
+
+SourceFile = namedtuple('SourceFile', ['path', 'raw_lines', 'line_numbers', 'line_hashes'])
+
+
+def _strip_comment(match):
+    # 注释替换为相同数量的换行，保持行号不变；字符串中的//和/*不是注释，原样保留
+    token = match.group(0)
+    if token.startswith('/'):
+        return '\n' * token.count('\n')
+    return token
+
+
+def _hash_line(line):
+    return int.from_bytes(hashlib.blake2b(line.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def analyze_file(file):
+    """
+    规范化java源代码文件并计算每个有效行的hash
+    去掉注释和全部空白字符，忽略空行、import和package语句，与simian的默认规则一致
+    :param file: java源代码文件
+    :return: SourceFile，文件无法读取时返回None
+    """
+    try:
+        with open(file, 'rb') as fp:
+            text = fp.read().decode('utf-8', 'replace')
+    except OSError:
+        return None
+    text = COMMENT_PATTERN.sub(_strip_comment, text.replace('\r\n', '\n'))
+    line_numbers = array('I')
+    line_hashes = array('Q')
+    lines = text.split('\n')
+    for number, line in enumerate(lines, 1):
+        if IMPORT_PATTERN.match(line):
+            continue
+        normalized = ''.join(line.split())
+        if normalized:
+            line_numbers.append(number)
+            line_hashes.append(_hash_line(normalized))
+    return SourceFile(file, len(lines), line_numbers, line_hashes)
+
+
+def get_fingerprints(line_hashes):
+    """
+    使用Rabin-Karp滚动hash计算每K_GRAM个连续行的hash，再通过winnowing在每个窗口中选出最小的hash作为指纹
+    :param line_hashes: 有效行的hash
+    :return: 列表，元素为(指纹, 起始的有效行序号)
+    """
+    if len(line_hashes) < THRESHOLD:
+        return []
+    values = [value % MODULUS for value in line_hashes]
+    high = pow(BASE, K_GRAM - 1, MODULUS)
+    current = 0
+    for value in values[:K_GRAM]:
+        current = (current * BASE + value) % MODULUS
+    grams = [current]
+    for index in range(K_GRAM, len(values)):
+        current = ((current - values[index - K_GRAM] * high) * BASE + values[index]) % MODULUS
+        grams.append(current)
+    fingerprints = []
+    selected = -1
+    for start in range(len(grams) - WINDOW + 1):
+        # 相同的最小值取最右边的一个，相邻窗口选中同一个位置时只记录一次
+        position = min(range(start, start + WINDOW), key=lambda index: (grams[index], -index))
+        if position != selected:
+            fingerprints.append((grams[position], position))
+            selected = position
+    return fingerprints
+
+
+class DuplicateIndex:
+    """
+    工程中全部java文件的重复代码指纹索引，使用sqlite存储，读取时使用内存映射
+    每次检查只重新分析blob id变化的文件，变动的文件直接在索引中查找与整个工程的重复代码
+    """
+
+    def __init__(self, project_path):
+        """
+
+        :param project_path: 工程目录，每个工程一个索引
+        """
+        project_key = hashlib.sha1(path.abspath(project_path).encode()).hexdigest()[:16]
+        self.db_path = path.join(get_cache_dir('duplicates', project_key), 'index.sqlite3')
+        self._conn = sqlite3.connect(self.db_path, timeout=30)
+        self._conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, blob TEXT NOT NULL, '
+            'raw_lines INTEGER NOT NULL, line_numbers BLOB NOT NULL, line_hashes BLOB NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS fingerprints (hash INTEGER NOT NULL, file_id INTEGER NOT NULL, '
+            'position INTEGER NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS fingerprints_hash ON fingerprints (hash);'
+            'CREATE INDEX IF NOT EXISTS fingerprints_file ON fingerprints (file_id);')
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != INDEX_VERSION:
+            self._conn.execute('DELETE FROM fingerprints')
+            self._conn.execute('DELETE FROM files')
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (INDEX_VERSION,))
+        self._conn.commit()
+        self._sources = {}
+
+    def close(self):
+        self._conn.close()
+
+    @trace_span('duplicates')
+    def sync(self, blob_ids):
+        """
+        使索引与工程中的文件一致，只重新分析新增和blob id变化的文件，删除已经不存在的文件
+        :param blob_ids: dict，工程中全部需要索引的文件到blob id的映射
+        :return:
+        """
+        indexed = {file: (file_id, blob_id)
+                   for file_id, file, blob_id in self._conn.execute('SELECT id, path, blob FROM files')}
+        stale = [file_id for file, (file_id, blob_id) in indexed.items() if blob_ids.get(file) != blob_id]
+        changed = [file for file, blob_id in blob_ids.items()
+                   if file not in indexed or indexed[file][1] != blob_id]
+        with self._conn:
+            self._conn.executemany('DELETE FROM fingerprints WHERE file_id = ?', [(file_id,) for file_id in stale])
+            self._conn.executemany('DELETE FROM files WHERE id = ?', [(file_id,) for file_id in stale])
+            for file in changed:
+                source = analyze_file(file)
+                if source is None:
+                    continue
+                cursor = self._conn.execute(
+                    'INSERT INTO files (path, blob, raw_lines, line_numbers, line_hashes) VALUES (?, ?, ?, ?, ?)',
+                    (file, blob_ids[file], source.raw_lines, source.line_numbers.tobytes(),
+                     source.line_hashes.tobytes()))
+                self._conn.executemany('INSERT INTO fingerprints (hash, file_id, position) VALUES (?, ?, ?)',
+                                       [(fingerprint, cursor.lastrowid, position)
+                                        for fingerprint, position in get_fingerprints(source.line_hashes)])
+                self._sources[cursor.lastrowid] = source
+        self._sources = {file_id: source for file_id, source in self._sources.items()
+                         if file_id not in stale}
+        removed = len([file for file in indexed if file not in blob_ids])
+        print(f'duplicate index: {len(changed)} files analyzed, {removed} files removed, '
+              f'{len(blob_ids)} files indexed')
+
+    def get_source(self, file_id):
+        """
+        读取索引中文件的有效行信息
+        :param file_id: 文件id
+        :return: SourceFile
+        """
+        if file_id not in self._sources:
+            file, raw_lines, line_numbers, line_hashes = self._conn.execute(
+                'SELECT path, raw_lines, line_numbers, line_hashes FROM files WHERE id = ?', (file_id,)).fetchone()
+            self._sources[file_id] = SourceFile(file, raw_lines, array('I', line_numbers), array('Q', line_hashes))
+        return self._sources[file_id]
+
+    def get_source_by_path(self, file):
+        """
+        读取索引中文件的有效行信息
+        :param file: 文件全路径
+        :return: SourceFile，文件不在索引中时返回None
+        """
+        row = self._conn.execute('SELECT id FROM files WHERE path = ?', (file,)).fetchone()
+        return self.get_source(row[0]) if row else None
+
+    def find_matches(self, source, ignored_paths=()):
+        """
+        在索引中查找与文件重复的代码，相同指纹的位置逐行比较之后向前后扩展为最长的重复区间
+        :param source: 需要查找的文件
+        :param ignored_paths: 不作为重复对象的文件，如提交范围中提取的文件在工作区中的原文件
+        :return: 列表，元素为(重复的文件, 本文件的起始有效行序号, 对方的起始有效行序号, 有效行数)
+        """
+        hashes = source.line_hashes
+        matches = []
+        covered = {}
+        for fingerprint, position in get_fingerprints(hashes):
+            for file_id, other_position in self._conn.execute(
+                    'SELECT file_id, position FROM fingerprints WHERE hash = ?', (fingerprint,)):
+                other = self.get_source(file_id)
+                if other.path in ignored_paths or (other.path == source.path and other_position == position):
+                    continue
+                diagonal = (file_id, other_position - position)
+                if any(start <= position < end for start, end in covered.get(diagonal, ())):
+                    continue
+                other_hashes = other.line_hashes
+                if hashes[position:position + K_GRAM] != other_hashes[other_position:other_position + K_GRAM]:
+                    continue
+                start, other_start = position, other_position
+                while start > 0 and other_start > 0 and hashes[start - 1] == other_hashes[other_start - 1]:
+                    start -= 1
+                    other_start -= 1
+                end, other_end = position + K_GRAM, other_position + K_GRAM
+                while end < len(hashes) and other_end < len(other_hashes) and hashes[end] == other_hashes[other_end]:
+                    end += 1
+                    other_end += 1
+                covered.setdefault(diagonal, []).append((start, end))
+                # 同一个文件中的重复区间不能重叠
+                if other.path == source.path and start < other_end and other_start < end:
+                    continue
+                if end - start >= THRESHOLD:
+                    matches.append((other, start, other_start, end - start))
+        return matches
+
+
+def _block(source, start, count):
+    return source.path, source.line_numbers[start], source.line_numbers[start + count - 1]
+
+
+@trace_span('duplicates')
+def find_duplicates(index, sources, ignored_paths=None):
+    """
+    查找文件与整个工程之间的重复代码，内容相同的重复区间合并为一组
+    :param index: DuplicateIndex
+    :param sources: 需要检查的文件列表，元素为SourceFile
+    :param ignored_paths: dict，文件到不作为重复对象的文件集合的映射
+    :return: 列表，元素为(有效行数, 重复区间列表)，重复区间为(文件, 起始行号, 结束行号)
+    """
+    groups = {}
+    for source in sources:
+        for other, start, other_start, count in index.find_matches(source, (ignored_paths or {}).get(source.path, ())):
+            key = (count, source.line_hashes[start:start + count].tobytes())
+            blocks = groups.setdefault(key, set())
+            blocks.add(_block(source, start, count))
+            blocks.add(_block(other, other_start, count))
+    return [(count, sorted(blocks)) for (count, _), blocks in sorted(groups.items(), key=lambda item: -item[0][0])]
+
+
+@trace_span('xml')
+def write_simian_xml(output_file, duplicates, sources):
+    """
+    按照simian的xml格式写入重复代码检查结果，可以使用simian.xsl转换为html
+    :param output_file: 结果文件
+    :param duplicates: find_duplicates的结果
+    :param sources: 检查的文件列表
+    :return:
+    """
+    root = etree.Element('simian', {'version': '2.3.33'})
+    check = etree.SubElement(root, 'check', {'failOnDuplication': 'true', 'ignoreCurlyBraces': 'false',
+                                             'ignoreModifiers': 'false', 'threshold': str(THRESHOLD)})
+    files = set()
+    for count, blocks in duplicates:
+        duplicate_set = etree.SubElement(check, 'set', {'lineCount': str(count)})
+        for file, start_line, end_line in blocks:
+            files.add(file)
+            etree.SubElement(duplicate_set, 'block', {'sourceFile': file, 'startLineNumber': str(start_line),
+                                                      'endLineNumber': str(end_line)})
+    etree.SubElement(check, 'summary', {
+        'duplicateFileCount': str(len(files)),
+        'duplicateLineCount': str(sum(count * len(blocks) for count, blocks in duplicates)),
+        'duplicateBlockCount': str(sum(len(blocks) for _, blocks in duplicates)),
+        'totalFileCount': str(len(sources)),
+        'totalRawLineCount': str(sum(source.raw_lines for source in sources)),
+        'totalSignificantLineCount': str(sum(len(source.line_hashes) for source in sources)),
+    })
+    etree.ElementTree(root).write(output_file, encoding='utf-8', xml_declaration=True)
@@ -0,0 +1,156 @@
+import os
+import re
+import threading
+from os import path
+
+from util.trace import trace_span
+from util.util import ant_to_regex, read_from_exclude_files
+
+# 插件名称到(例外文件名称, 匹配方式)的映射
+# gitwildmatch: 按照.gitignore的规则匹配文件全路径；regex: 正则表达式在文件全路径中搜索；
+# substring: 文件全路径中包含配置的字符串；class_substring: java文件对应的class文件路径中包含配置的字符串；
+# ant: ant风格的路径规则转换为正则表达式后在文件全路径中搜索，与checkstyle suppressions中files属性的规则一致
+EXCLUDE_CONFIGS = {
+    'checkstyle': ('CheckStyle_Conf.txt', 'gitwildmatch'),
+    'pmd': ('JavaPMD_Conf.txt', 'regex'),
+    'javancss': ('JavaNCSS_Conf.txt', 'regex'),
+    'spotbugs': ('FindBugs_Conf.txt', 'class_substring'),
+    'simian': ('Simian_Conf.txt', 'substring'),
+}
+
+# 编号或命名的反向引用，合并为一个正则表达式之后分组编号会改变，这些规则单独匹配
+BACKREFERENCE_PATTERN = re.compile(r'\\[1-9]|\(\?P=')
+
+_matchers = {}
+_lock = threading.Lock()
+
+
+def _gitwildmatch_regex(pattern):
+    """
+    将gitwildmatch规则转换为正则表达式，去掉命名分组，以便多个规则合并为一个正则表达式
+    :param pattern: gitwildmatch规则
+    :return: 正则表达式字符串，不匹配任何文件的规则（如注释和取反规则）返回None
+    """
+    from pathspec.patterns import GitWildMatchPattern
+
+    compiled = GitWildMatchPattern(pattern)
+    if not compiled.include or compiled.regex is None:
+        return None
+    return re.sub(r'\(\?P<\w+>', '(?:', compiled.regex.pattern)
+
+
+def _compile_each(regexes):
+    """
+    逐个编译正则表达式，无法编译的规则输出错误并忽略，不影响其他规则
+    :param regexes: 正则表达式字符串列表
+    :return: 编译后的正则表达式列表
+    """
+    compiled = []
+    for regex in regexes:
+        try:
+            compiled.append(re.compile(regex))
+        except re.error as e:
+            print(f'invalid exclude pattern {regex}: {e}')
+    return compiled
+
+
+class ExcludeMatcher:
+    """
+    将一个插件的全部例外规则编译为一个正则表达式，每个文件只需要匹配一次
+    包含反向引用的规则，以及合并后无法编译时（如不在开头的(?i)）的全部规则，逐个匹配
+    """
+
+    def __init__(self, patterns, kind):
+        """
+
+        :param patterns: 例外规则列表
+        :param kind: 匹配方式，见EXCLUDE_CONFIGS
+        """
+        self.kind = kind
+        if kind == 'gitwildmatch':
+            regexes = [_gitwildmatch_regex(pattern) for pattern in patterns]
+        elif kind == 'regex':
+            regexes = patterns
+        elif kind == 'ant':
+            regexes = [ant_to_regex(pattern) for pattern in patterns]
+        else:
+            regexes = [re.escape(pattern) for pattern in patterns]
+        regexes = [regex for regex in regexes if regex is not None]
+        merged = [regex for regex in regexes if not BACKREFERENCE_PATTERN.search(regex)]
+        separate = [regex for regex in regexes if BACKREFERENCE_PATTERN.search(regex)]
+        self.regex = None
+        if merged:
+            try:
+                self.regex = re.compile('|'.join(f'(?:{regex})' for regex in merged))
+            except re.error:
+                separate = regexes
+        self.separate = _compile_each(separate)
+
+    def _normalize(self, file):
+        if self.kind == 'gitwildmatch':
+            from pathspec.util import normalize_file
+
+            return normalize_file(file)
+        if self.kind == 'class_substring':
+            return file.replace('.java', '.class')
+        return file
+
+    def matches(self, file):
+        file = self._normalize(file)
+        if self.regex is not None and self.regex.search(file) is not None:
+            return True
+        return any(regex.search(file) is not None for regex in self.separate)
+
+    def filter(self, files):
+        """
+        过滤掉匹配例外规则的文件
+        :param files: 文件列表
+        :return: 不匹配例外规则的文件列表
+        """
+        if self.regex is None and not self.separate:
+            return list(files)
+        return [file for file in files if not self.matches(file)]
+
+
+def get_exclude_matcher(exclude_files_path, tool, kind=None, extra_patterns=()):
+    """
+    获取插件的例外规则匹配器，例外文件只在内容变化之后重新读取和编译
+    :param exclude_files_path: 例外文件目录
+    :param tool: 插件名称
+    :param kind: 匹配方式，为空时使用插件默认的匹配方式
+    :param extra_patterns: 例外文件之外的规则
+    :return: ExcludeMatcher
+    """
+    file_name, default_kind = EXCLUDE_CONFIGS[tool]
+    kind = kind or default_kind
+    exclude_file = path.join(exclude_files_path, file_name)
+    key = (exclude_file, kind, tuple(extra_patterns))
+    try:
+        mtime = os.stat(exclude_file).st_mtime_ns
+    except OSError:
+        mtime = None
+    with _lock:
+        cached = _matchers.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    patterns = read_from_exclude_files(exclude_file) if mtime is not None else []
+    matcher = ExcludeMatcher([*patterns, *extra_patterns], kind)
+    with _lock:
+        _matchers[key] = (mtime, matcher)
+    return matcher
+
+
+@trace_span('exclude')
+def filter_excluded(exclude_files_path, tool, files, kind=None, extra_patterns=()):
+    """
+    根据例外文件，过滤插件需要进行检查的文件
+    :param exclude_files_path: 例外文件目录
+    :param tool: 插件名称
+    :param files: 文件列表
+    :param kind: 匹配方式，为空时使用插件默认的匹配方式
+    :param extra_patterns: 例外文件之外的规则
+    :return: 过滤后的文件列表
+    """
+    if not exclude_files_path:
+        return list(files)
+    return get_exclude_matcher(exclude_files_path, tool, kind, extra_patterns).filter(files)
@@ -0,0 +1,193 @@
+import io
+import math
+import os
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from util.trace import span
+
+_local = threading.local()
+_stream_lock = threading.Lock()
+
+
+class _ThreadRoutedStream:
+    """
+    按线程分发输出的流对象，处于插件任务中的线程写入各自的缓冲区，其余线程写入原始流
+    """
+
+    def __init__(self, stream):
+        """
+
+        :param stream: 原始输出流
+        """
+        self._stream = stream
+
+    def write(self, text):
+        buffer = getattr(_local, 'buffer', None)
+        if buffer is not None:
+            return buffer.write(text)
+        return self._stream.write(text)
+
+    def flush(self):
+        if getattr(_local, 'buffer', None) is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def install_output_routing():
+    """
+    将标准输出和标准错误替换为按线程分发的流对象，重复调用不会重复替换
+    替换之后不再恢复，多个线程同时执行检查时，恢复原始流会导致其他线程的输出不再被隔离
+    :return:
+    """
+    with _stream_lock:
+        if not isinstance(sys.stdout, _ThreadRoutedStream):
+            sys.stdout = _ThreadRoutedStream(sys.stdout)
+        if not isinstance(sys.stderr, _ThreadRoutedStream):
+            sys.stderr = _ThreadRoutedStream(sys.stderr)
+
+
+@contextmanager
+def capture_output(buffer):
+    """
+    将当前线程的输出写入到指定的缓冲区中
+    :param buffer: 具有write方法的对象
+    :return:
+    """
+    install_output_routing()
+    previous = getattr(_local, 'buffer', None)
+    _local.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        _local.buffer = previous
+
+
+def is_output_captured():
+    """
+    判断当前线程的输出是否被隔离到缓冲区中
+    :return: 输出被隔离返回True，否则返回False
+    """
+    return getattr(_local, 'buffer', None) is not None
+
+
+def get_cpu_count():
+    """
+    获取当前进程可使用的cpu数量，同时考虑cpu亲和性和cgroup配额
+    :return: cpu数量，至少为1
+    """
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+    quota = read_cgroup_cpu_quota()
+    if quota:
+        count = min(count, math.ceil(quota))
+    return max(1, count)
+
+
+def read_cgroup_cpu_quota():
+    """
+    读取cgroup中配置的cpu配额
+    :return: 可使用的cpu数量（可能为小数），未配置时返回None
+    """
+    try:
+        with open('/sys/fs/cgroup/cpu.max', 'r', encoding='utf-8') as fp:
+            quota, period = fp.read().split()[:2]
+        if quota != 'max' and int(period) > 0:
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', 'r', encoding='utf-8') as fp:
+            quota = int(fp.read().strip())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us', 'r', encoding='utf-8') as fp:
+            period = int(fp.read().strip())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def resolve_jobs(jobs):
+    """
+    计算实际使用的并发数量
+    :param jobs: 用户指定的并发数量，为空或者小于1的时候自动探测
+    :return: 并发数量
+    """
+    if jobs is None or int(jobs) < 1:
+        return get_cpu_count()
+    return int(jobs)
+
+
+def _run_isolated(name, func, args, kwargs):
+    """
+    在当前线程中执行任务，并将任务的输出收集到独立的缓冲区中
+    :return: (name, ret, output)
+    """
+    with capture_output(io.StringIO()) as buffer:
+        try:
+            with span(name, 'plugin'):
+                ret = func(*args, **kwargs)
+        except Exception:
+            traceback.print_exc(file=buffer)
+            ret = None
+    return name, ret, buffer.getvalue()
+
+
+def run_tasks(tasks, jobs=1):
+    """
+    使用有界的线程池执行插件任务
+    并发执行时，每个任务的输出都被隔离，在任务结束后整体输出，避免不同插件的日志交错
+    :param tasks: 任务列表，元素为(name, func, args, kwargs)
+    :param jobs: 并发数量
+    :return: dict，任务名称到返回值的映射，任务抛出异常时返回值为None
+    """
+    results = {}
+    jobs = max(1, min(int(jobs), len(tasks) or 1))
+    if jobs == 1:
+        for name, func, args, kwargs in tasks:
+            try:
+                with span(name, 'plugin'):
+                    results[name] = func(*args, **kwargs)
+            except Exception:
+                traceback.print_exc()
+                results[name] = None
+        return results
+
+    install_output_routing()
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='checker') as executor:
+        futures = [executor.submit(_run_isolated, name, func, args, kwargs)
+                   for name, func, args, kwargs in tasks]
+        for future in as_completed(futures):
+            name, ret, output = future.result()
+            results[name] = ret
+            # 当前线程的输出也可能被隔离（如服务模式下的检查任务），通过sys.stdout写入
+            with _stream_lock:
+                sys.stdout.write(f'----- {name} -----\n')
+                sys.stdout.write(output)
+                sys.stdout.flush()
+    return {name: results[name] for name, _, _, _ in tasks}
+
+
+def combine_status(results):
+    """
+    合并各个插件的返回值，得到整体的退出码
+    返回-1表示插件因为没有需要检查的文件而跳过，不作为失败处理
+    :param results: dict，插件名称到返回值的映射
+    :return: 全部成功返回0；有插件返回非0退出码返回1；有插件抛出异常返回2
+    """
+    status = 0
+    for ret in results.values():
+        if ret is None:
+            status = 2
+        elif ret > 0:
+            status = max(status, 1)
+    return status
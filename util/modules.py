@@ -0,0 +1,187 @@
+import glob
+import os
+import re
+from os import path
+
+from lxml import etree
+
+from util.cache import hash_config
+from util.class_index import SOURCE_ROOTS
+from util.trace import trace_span
+
+# gradle构建脚本中声明的外部依赖，如implementation 'group:name:version'
+GRADLE_DEPENDENCY_PATTERN = re.compile(
+    r'''\b(?:api|implementation|compile|compileOnly|runtimeOnly|testImplementation|testCompileOnly|provided)\s*\(?\s*'''
+    r'''['"]([^:'"\s]+):([^:'"\s]+):([^:'"@\s]+)''')
+# gradle settings文件中包含的子模块，如include ':a', ':b:c'
+GRADLE_INCLUDE_PATTERN = re.compile(r'''\binclude(?!\w)\s*\(?([^\n]*)''')
+GRADLE_PROJECT_PATTERN = re.compile(r'''['"]:?([^'"]+)['"]''')
+PROPERTY_PATTERN = re.compile(r'\$\{([^}]+)\}')
+# 模块中直接存放依赖jar包的目录
+LOCAL_JAR_DIRS = ('lib', 'libs', path.join('target', 'dependency'))
+
+
+def get_maven_repository():
+    """
+    获取maven本地仓库目录，可通过环境变量M2_REPO指定
+    :return:
+    """
+    return os.environ.get('M2_REPO') or path.join(path.expanduser('~'), '.m2', 'repository')
+
+
+def get_gradle_cache():
+    """
+    获取gradle依赖缓存目录，与gradle一样使用环境变量GRADLE_USER_HOME
+    :return:
+    """
+    gradle_home = os.environ.get('GRADLE_USER_HOME') or path.join(path.expanduser('~'), '.gradle')
+    return path.join(gradle_home, 'caches', 'modules-2', 'files-2.1')
+
+
+def _read_pom(pom_file):
+    """
+    读取pom文件，去掉命名空间以便查找节点
+    :param pom_file: pom文件
+    :return: 根节点，文件不存在或者无法解析时返回None
+    """
+    try:
+        root = etree.parse(pom_file).getroot()
+    except (OSError, etree.XMLSyntaxError):
+        return None
+    for node in root.iter():
+        if isinstance(node.tag, str):
+            node.tag = etree.QName(node).localname
+    return root
+
+
+def _read_text(file):
+    try:
+        with open(file, 'r', encoding='utf-8', errors='replace') as fp:
+            return fp.read()
+    except OSError:
+        return ''
+
+
+@trace_span('modules')
+def discover_modules(project_path):
+    """
+    根据maven的modules配置和gradle的settings文件，查找工程中的全部模块
+    :param project_path: 工程目录
+    :return: 模块目录列表，包括工程目录本身
+    """
+    project_path = path.normpath(path.abspath(project_path))
+    modules = [project_path]
+    pending = [project_path]
+    while pending:
+        module = pending.pop()
+        pom = _read_pom(path.join(module, 'pom.xml'))
+        if pom is not None:
+            for node in pom.iterfind('.//modules/module'):
+                child = path.normpath(path.join(module, (node.text or '').strip()))
+                if child not in modules and path.isdir(child):
+                    modules.append(child)
+                    pending.append(child)
+    for settings in ('settings.gradle', 'settings.gradle.kts'):
+        for match in GRADLE_INCLUDE_PATTERN.finditer(_read_text(path.join(project_path, settings))):
+            for name in GRADLE_PROJECT_PATTERN.findall(match.group(1)):
+                child = path.normpath(path.join(project_path, *name.split(':')))
+                if child not in modules and path.isdir(child):
+                    modules.append(child)
+    return modules
+
+
+def get_output_dirs(module, source_root=path.join('src', 'main', 'java')):
+    """
+    获取模块已存在的编译输出目录
+    :param module: 模块目录
+    :param source_root: 源代码目录相对于模块目录的路径
+    :return: 编译输出目录列表
+    """
+    return [path.join(module, output_dir) for output_dir in SOURCE_ROOTS[source_root]
+            if path.isdir(path.join(module, output_dir))]
+
+
+def _maven_dependency_jars(module):
+    """
+    根据pom文件中声明的依赖，在maven本地仓库中查找依赖的jar包
+    版本使用属性或者由父模块管理时，无法确定版本的依赖使用本地仓库中最新的版本
+    """
+    pom = _read_pom(path.join(module, 'pom.xml'))
+    if pom is None:
+        return []
+    properties = {node.tag: (node.text or '').strip() for node in pom.iterfind('properties/*')
+                  if isinstance(node.tag, str)}
+    properties['project.version'] = pom.findtext('version') or pom.findtext('parent/version') or ''
+
+    def resolve(value):
+        return PROPERTY_PATTERN.sub(lambda match: properties.get(match.group(1), match.group(0)), (value or '').strip())
+
+    repository = get_maven_repository()
+    jars = []
+    for dependency in pom.iterfind('dependencies/dependency'):
+        group = resolve(dependency.findtext('groupId'))
+        artifact = resolve(dependency.findtext('artifactId'))
+        version = resolve(dependency.findtext('version'))
+        if not group or not artifact:
+            continue
+        artifact_dir = path.join(repository, *group.split('.'), artifact)
+        jar = path.join(artifact_dir, version, f'{artifact}-{version}.jar')
+        if version and '${' not in version and path.isfile(jar):
+            jars.append(jar)
+            continue
+        candidates = sorted(glob.glob(path.join(glob.escape(artifact_dir), '*', f'{glob.escape(artifact)}-*.jar')))
+        candidates = [candidate for candidate in candidates
+                      if not candidate.endswith(('-sources.jar', '-javadoc.jar', '-tests.jar'))]
+        if candidates:
+            jars.append(candidates[-1])
+    return jars
+
+
+def _gradle_dependency_jars(module):
+    """
+    根据gradle构建脚本中声明的依赖，在gradle依赖缓存中查找依赖的jar包
+    """
+    cache = get_gradle_cache()
+    jars = []
+    for script in ('build.gradle', 'build.gradle.kts'):
+        for group, artifact, version in GRADLE_DEPENDENCY_PATTERN.findall(_read_text(path.join(module, script))):
+            pattern = path.join(glob.escape(path.join(cache, group, artifact, version)), '*',
+                                glob.escape(f'{artifact}-{version}.jar'))
+            jars.extend(sorted(glob.glob(pattern))[:1])
+    return jars
+
+
+def get_aux_classpath(module, modules):
+    """
+    获取分析模块时需要的辅助类路径，使spotbugs能够加载被分析的类所依赖的类
+    包括模块自身和其他模块的编译输出目录、构建配置中声明的依赖jar包以及模块中直接存放的jar包
+    :param module: 模块目录
+    :param modules: 工程中的全部模块目录
+    :return: 类路径列表
+    """
+    classpath = []
+    for other in [module, *[item for item in modules if item != module]]:
+        classpath.extend(get_output_dirs(other)[:1])
+    classpath.extend(_maven_dependency_jars(module))
+    classpath.extend(_gradle_dependency_jars(module))
+    for jar_dir in LOCAL_JAR_DIRS:
+        classpath.extend(sorted(glob.glob(path.join(glob.escape(path.join(module, jar_dir)), '*.jar'))))
+    return list(dict.fromkeys(classpath))
+
+
+def hash_classpath(classpath):
+    """
+    计算辅助类路径的hash，作为spotbugs缓存key的一部分，依赖的jar包变化之后重新分析
+    jar包使用路径、大小和修改时间；目录只使用路径，避免每次检查遍历编译输出目录
+    :param classpath: 类路径列表
+    :return: 16进制字符串
+    """
+    items = []
+    for entry in classpath:
+        try:
+            stat = os.stat(entry)
+        except OSError:
+            items.append(f'{entry}:missing')
+            continue
+        items.append(entry if path.isdir(entry) else f'{entry}:{stat.st_size}:{stat.st_mtime_ns}')
+    return hash_config(*items)
@@ -1,13 +1,16 @@
 import os
 import socket
-import webbrowser
-from http.server import HTTPServer
-import psutil
 
-from handler.RequestHandler import RequestHandler
+from util.util import get_cache_dir
 
 
-def run_server(server_class=HTTPServer, handler_class=RequestHandler, port=8000, base_dir='.'):
+def run_server(server_class=None, handler_class=None, port=8000, base_dir='.'):
+    # http.server导入耗时较长，只在启动web server时导入
+    from http.server import HTTPServer
+    from handler.RequestHandler import RequestHandler
+
+    server_class = server_class or HTTPServer
+    handler_class = handler_class or RequestHandler
     server_address = ('', port)
     handler_class.base_dir = base_dir
 
@@ -22,6 +25,66 @@ def run_server(server_class=HTTPServer, handler_class=RequestHandler, port=8000,
     httpd.serve_forever()
 
 
+def get_service_token_file(port):
+    """
+    获取检查服务的令牌文件路径，客户端从该文件中读取访问令牌
+    :param port: 服务端口
+    :return:
+    """
+    return os.path.join(get_cache_dir('service'), f'{port}.json')
+
+
+def write_service_token(port):
+    """
+    生成检查服务的访问令牌，写入只允许当前用户读写的令牌文件
+    :param port: 服务端口
+    :return: 令牌
+    """
+    import json
+    import secrets
+
+    token = secrets.token_hex(16)
+    token_file = get_service_token_file(port)
+    temp_file = f'{token_file}.{os.getpid()}.tmp'
+    fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, 'w', encoding='utf-8') as fp:
+        json.dump({'pid': os.getpid(), 'port': port, 'token': token}, fp)
+    os.replace(temp_file, token_file)
+    return token
+
+
+def run_service_server(service, port=12345, host='127.0.0.1', roots=None):
+    """
+    启动检查服务的json接口，每个请求在独立的线程中处理
+    请求需要在Authorization头中携带令牌文件中的令牌，提交任务的请求体必须是application/json
+    :param service: CheckService
+    :param port: 端口号
+    :param host: 监听地址，默认只允许本机访问
+    :param roots: 允许检查的目录列表，为空时不限制工程目录；任务中的其他路径必须在工程目录或者这些目录之中
+    :return:
+    """
+    from http.server import ThreadingHTTPServer
+    from handler.JobRequestHandler import JobRequestHandler
+
+    class ServiceRequestHandler(JobRequestHandler):
+        pass
+
+    ServiceRequestHandler.service = service
+    ServiceRequestHandler.roots = list(roots or [])
+    httpd = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    httpd.daemon_threads = True
+    ServiceRequestHandler.token = write_service_token(port)
+    print(f'check service listening on http://{host}:{port}, token in {get_service_token_file(port)}')
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        try:
+            os.remove(get_service_token_file(port))
+        except OSError:
+            pass
+
+
 def port_is_valid(web_port):
     """
     检查端口是否被占用
@@ -36,55 +99,43 @@ def port_is_valid(web_port):
         return False
 
 
-def kill_process_using_port(port):
+def get_pids_using_port(port):
     """
-    杀掉占用端口的进程
+    获取占用端口的进程id
     :param port: 端口号
-    :return:
+    :return: 进程id集合
     """
-    for proc in psutil.process_iter(['pid', 'name']):
-        try:
-            for conns in proc.connections(kind='inet'):
-                if conns.laddr.port == port:
-                    proc.terminate()
-                    print(f"Process with PID {proc.pid} killed successfully.")
-        except psutil.NoSuchProcess:
-            pass
-        except psutil.AccessDenied:
-            pass
+    import psutil
+
+    try:
+        # 一次获取全部连接，避免对每个进程分别查询
+        return {conn.pid for conn in psutil.net_connections(kind='inet')
+                if conn.pid and conn.laddr and conn.laddr.port == port}
+    except psutil.AccessDenied:
+        # macOS等平台上获取全部连接需要管理员权限，逐个查询当前用户的进程
+        pids = set()
+        for proc in psutil.process_iter(['pid']):
+            try:
+                if any(conn.laddr.port == port for conn in proc.connections(kind='inet')):
+                    pids.add(proc.pid)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        return pids
 
 
-def kill_process_using_name(name):
+def kill_process_using_port(port):
     """
-    根据进程名称杀死进程
-    :param name:
+    杀掉占用端口的进程
+    :param port: 端口号
     :return:
     """
-    proc_list = []
-    for proc in psutil.process_iter(['pid', 'name', 'ppid']):
-        try:
-            if name.lower() in proc.name().lower():
-                proc_list.append(proc)
-        except psutil.NoSuchProcess:
-            pass
-        except psutil.AccessDenied:
-            pass
-    pid = os.getpid()
-    current_process_list = []
-    current_process_id_list = []
-    current_process = list(filter(lambda x: x.pid == pid, proc_list))
-    if len(current_process) > 0:
-        current_process_list.extend(current_process)
-        current_process_list.extend(list(filter(lambda x: x.pid == current_process[0].ppid(), proc_list)))
-        current_process_id_list.extend([p.pid for p in current_process_list])
-    for proc in proc_list:
+    import psutil
+
+    for pid in get_pids_using_port(port) - {os.getpid()}:
         try:
-            if proc.pid not in current_process_id_list:
-                proc.terminate()
-                print(f"Process with PID {proc.pid} killed successfully, By PID {pid}")
-        except psutil.NoSuchProcess:
-            pass
-        except psutil.AccessDenied:
+            psutil.Process(pid).terminate()
+            print(f"Process with PID {pid} killed successfully.")
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
             pass
 
 
@@ -99,6 +150,8 @@ def start_web_page(output_folder, web_port, auto_open):
     print(f'visit http://localhost:{web_port}')
     kill_process_using_port(web_port)
     if auto_open:
+        import webbrowser
+
         webbrowser.open_new_tab(f'http://localhost:{web_port}')
     run_server(port=web_port, base_dir=output_folder)
     return 0
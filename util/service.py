@@ -0,0 +1,329 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from os import path
+
+from util.executor import capture_output
+
+# 任务参数名称到check参数名称的映射
+JOB_PARAMS = {
+    'project': 'project_path',
+    'output': 'output_path',
+    'mode': 'mode',
+    'files': 'files',
+    'plugins': 'plugins',
+    'enable_exclude': 'enable_exclude',
+    'exclude_files_path': 'exclude_files_path',
+    'exclude_test': 'exclude_test',
+    'use_baseline': 'use_baseline',
+    'rebuild_baseline': 'rebuild_baseline',
+    'jobs': 'jobs',
+    'range': 'commit_range',
+    'changed_lines_only': 'changed_lines_only',
+    'checkstyle_shards': 'checkstyle_shards',
+    'duplicate_engine': 'duplicate_engine',
+}
+BOOL_PARAMS = ('enable_exclude', 'exclude_test', 'use_baseline', 'rebuild_baseline', 'changed_lines_only')
+FINISHED_STATES = ('finished', 'failed', 'cancelled')
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def is_within(file, root):
+    """
+    判断路径是否在目录之中
+    :param file: 已经解析过符号链接的路径
+    :param root: 已经解析过符号链接的目录
+    :return:
+    """
+    return file == root or file.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def resolve_job_path(project_path, value, roots):
+    """
+    解析任务参数中的路径，相对路径相对于工程目录
+    :param project_path: 工程目录
+    :param value: 路径参数
+    :param roots: 允许访问的目录，为None时不限制；否则路径必须在工程目录或者这些目录之中
+    :return: 解析符号链接之后的全路径
+    """
+    full_path = path.realpath(path.join(project_path, value))
+    if roots is not None and not any(is_within(full_path, root) for root in (project_path, *roots)):
+        raise ValueError(f'{value} is outside the project')
+    return full_path
+
+
+def parse_job_params(body, roots=None):
+    """
+    校验并转换提交的任务参数
+    :param body: 请求的json内容
+    :param roots: 允许检查的目录，为None时不限制路径；否则工程必须在这些目录之中（为空时不限制工程），
+        files、output和exclude_files_path必须在工程目录或者这些目录之中
+    :return: check的参数
+    """
+    if not isinstance(body, dict):
+        raise ValueError('request body must be a json object')
+    unknown = [key for key in body if key not in JOB_PARAMS]
+    if unknown:
+        raise ValueError(f"unknown parameters: {', '.join(unknown)}")
+    project = body.get('project')
+    if not isinstance(project, str) or not path.isdir(project):
+        raise ValueError('project must be an existing directory')
+    params = {JOB_PARAMS[key]: value for key, value in body.items()}
+    if roots is None:
+        params['project_path'] = path.abspath(project)
+    else:
+        roots = [path.realpath(root) for root in roots]
+        params['project_path'] = path.realpath(project)
+        if roots and not any(is_within(params['project_path'], root) for root in roots):
+            raise ValueError('project must be inside the service root')
+    params['mode'] = str(params.get('mode', '1'))
+    if params['mode'] not in ('1', '2', '3'):
+        raise ValueError('mode must be 1, 2 or 3')
+    files = params.get('files')
+    if isinstance(files, list):
+        files = ','.join(files)
+    if files is not None:
+        if not isinstance(files, str):
+            raise ValueError('files must be a list or a comma separated string')
+        params['files'] = ','.join(resolve_job_path(params['project_path'], item, roots)
+                                   for item in files.split(',') if item)
+    if params.get('commit_range') is not None and not isinstance(params['commit_range'], str):
+        raise ValueError('range must be a string')
+    if 'checkstyle_shards' in params and not isinstance(params['checkstyle_shards'], int):
+        raise ValueError('checkstyle_shards must be an integer')
+    if params.get('duplicate_engine', 'index') not in ('index', 'simian'):
+        raise ValueError('duplicate_engine must be index or simian')
+    plugins = params.get('plugins')
+    if isinstance(plugins, list):
+        params['plugins'] = ','.join(plugins)
+    for key in ('output_path', 'exclude_files_path'):
+        if params.get(key):
+            if not isinstance(params[key], str):
+                raise ValueError(f'{key} must be a string')
+            params[key] = resolve_job_path(params['project_path'], params[key], roots)
+    for key in BOOL_PARAMS:
+        if key in params and not isinstance(params[key], bool):
+            raise ValueError(f'{key} must be a boolean')
+    return params
+
+
+class JobLog:
+    """
+    任务日志，支持按照偏移量读取和等待新的输出
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._size = 0
+        self._condition = threading.Condition()
+
+    def write(self, text):
+        with self._condition:
+            self._parts.append(text)
+            self._size += len(text)
+            self._condition.notify_all()
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def read(self, offset=0):
+        with self._condition:
+            return ''.join(self._parts)[offset:]
+
+    def wait(self, offset, timeout):
+        """
+        等待日志长度超过offset
+        :param offset: 已读取的长度
+        :param timeout: 超时时间，单位秒
+        :return:
+        """
+        with self._condition:
+            if self._size <= offset:
+                self._condition.wait(timeout)
+
+    def notify(self):
+        with self._condition:
+            self._condition.notify_all()
+
+
+class Job:
+    """
+    检查任务
+    """
+
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.params = params
+        self.status = 'queued'
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.exit_status = None
+        self.results = None
+        self.output_path = None
+        self.log = JobLog()
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'project': self.params['project_path'],
+            'mode': self.params.get('mode'),
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'exit_status': self.exit_status,
+            'results': self.results,
+            'output_path': self.output_path,
+        }
+
+
+class CheckService:
+    """
+    检查服务，按照提交顺序执行任务，同一个工程的任务依次执行，不同工程的任务最多同时执行workers个
+    """
+
+    def __init__(self, run_job, workers=2, max_queue=100, history=200):
+        """
+
+        :param run_job: 执行任务的函数，参数为(check参数, 检查详情dict)，返回退出码
+        :param workers: 同时执行的任务数量
+        :param max_queue: 等待执行的任务数量上限
+        :param history: 保留的已结束任务数量
+        """
+        self.run_job = run_job
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.history = history
+        self.jobs = OrderedDict()
+        self._queue = []
+        self._running_projects = set()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'service-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def submit(self, params):
+        """
+        提交任务
+        :param params: check参数
+        :return: Job
+        """
+        job = Job(params)
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                raise QueueFullError(f'too many queued jobs, limit {self.max_queue}')
+            self.jobs[job.id] = job
+            self._queue.append(job)
+            self._trim_history()
+            self._condition.notify_all()
+        return job
+
+    def get(self, job_id):
+        with self._condition:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self._condition:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        """
+        取消等待执行的任务，正在执行的任务不能取消
+        :param job_id: 任务id
+        :return: 取消成功返回True
+        """
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != 'queued':
+                return False
+            self._queue.remove(job)
+            job.status = 'cancelled'
+            job.finished = time.time()
+        job.done.set()
+        job.log.notify()
+        return True
+
+    def stats(self):
+        with self._condition:
+            return {
+                'queued': len(self._queue),
+                'running': len(self._running_projects),
+                'workers': self.workers,
+            }
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
+
+    def _take(self):
+        with self._condition:
+            while not self._stopped:
+                for job in self._queue:
+                    if job.params['project_path'] not in self._running_projects:
+                        self._queue.remove(job)
+                        self._running_projects.add(job.params['project_path'])
+                        job.status = 'running'
+                        job.started = time.time()
+                        return job
+                self._condition.wait()
+            return None
+
+    def _work(self):
+        while True:
+            job = self._take()
+            if job is None:
+                return
+            report = {}
+            try:
+                with capture_output(job.log):
+                    job.exit_status = self.run_job(dict(job.params), report)
+                status = 'finished'
+            except Exception:
+                job.log.write(traceback.format_exc())
+                status = 'failed'
+            job.results = report.get('results')
+            job.output_path = report.get('output_path')
+            job.finished = time.time()
+            with self._condition:
+                job.status = status
+                self._running_projects.discard(job.params['project_path'])
+                self._trim_history()
+                self._condition.notify_all()
+            job.done.set()
+            job.log.notify()
+
+
+def get_job_file(job, name):
+    """
+    获取任务检查结果目录中的文件，不允许访问目录之外的文件
+    :param job: 任务
+    :param name: 文件名称
+    :return: 文件全路径，文件不存在时返回None
+    """
+    if not job.output_path:
+        return None
+    base = path.realpath(job.output_path)
+    full_name = path.realpath(path.join(base, name))
+    if not full_name.startswith(base + os.sep) or not path.isfile(full_name):
+        return None
+    return full_name
@@ -1,13 +1,15 @@
+import os
 from os import path, sep
 import git
 
-import lizard
+from util.trace import trace_span
 
 
 def get_repo_from_file(file_path):
     parent_dir = sep.join(file_path.split(sep)[:-1])
     return get_repo(parent_dir)
 
+@trace_span('source')
 def get_repo(project_path):
     """
     从工程目录中获取git repo
@@ -19,26 +21,30 @@ def get_repo(project_path):
 
 def get_files_list(git_address, changed_files, exclude_test=False):
     """
-    从文件列表中，删选出java文件和js文件
+    从文件列表中，删选出java文件、js文件和python文件
     :param git_address: 仓库地址
     :param changed_files: 变动的文件列表
     :param exclude_test: 不对测试代码进行检测
-    :return: (changed_java_files, changed_js_files)
+    :return: (changed_java_files, changed_js_files, changed_python_files)
     """
     changed_java_files = list()
     changed_js_files = list()
+    changed_python_files = list()
     for a_path in changed_files:
         full_path = path.join(git_address, a_path)
         if a_path.endswith('.java') and (not exclude_test or 'src/test/' not in a_path):
             changed_java_files.append(full_path)
         elif a_path.endswith('.js'):
             changed_js_files.append(full_path)
-    return changed_java_files, changed_js_files
+        elif a_path.endswith('.py') and (not exclude_test or '/tests/' not in f'/{a_path}'):
+            changed_python_files.append(full_path)
+    return changed_java_files, changed_js_files, changed_python_files
 
 
+@trace_span('source')
 def get_given_files(file, exclude_test=False):
     """
-    从给定的分析文件字符串中，提取出java文件列表和js文件列表
+    从给定的分析文件字符串中，提取出java文件列表、js文件列表和python文件列表
     :param file:   分析文件字符串，多个文件使用','分割
     :param exclude_test: 是否排除掉测试文件
     :return:
@@ -46,15 +52,19 @@ def get_given_files(file, exclude_test=False):
     changed_files = file.split(',')
     changed_java_files = list()
     changed_js_files = list()
+    changed_python_files = list()
     for a_path in changed_files:
         if path.exists(a_path):
             if a_path.endswith('.java') and (not exclude_test or 'src/test/' not in a_path):
                 changed_java_files.append(a_path)
             elif a_path.endswith('.js'):
                 changed_js_files.append(a_path)
-    return changed_java_files, changed_js_files
+            elif a_path.endswith('.py') and (not exclude_test or '/tests/' not in a_path):
+                changed_python_files.append(a_path)
+    return changed_java_files, changed_js_files, changed_python_files
 
 
+@trace_span('source')
 def get_last_committed_files(repo, exclude_test=False):
     """
     从repo中根据commit，获取变动的文件列表
@@ -69,33 +79,202 @@ def get_last_committed_files(repo, exclude_test=False):
     return get_files_list(git_address, [item.a_path for item in changed_files if item.change_type != 'D'], exclude_test)
 
 
+def _read_records(stream, chunk_size=65536):
+    """
+    从输出流中逐个读取以\0分隔的记录，不需要等待命令执行结束
+    :param stream: 二进制输出流
+    :param chunk_size: 每次读取的字节数
+    :return: 记录字符串的生成器
+    """
+    rest = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        records = (rest + chunk).split(b'\0')
+        rest = records.pop()
+        for record in records:
+            yield record.decode('utf-8', 'surrogateescape')
+    if rest:
+        yield rest.decode('utf-8', 'surrogateescape')
+
+
+def parse_status(records):
+    """
+    解析 git status --porcelain=v2 -z 的输出
+    :param records: 以\0分隔的记录
+    :return: 列表，每一项为(文件相对路径, blob id)；工作区文件与索引一致时blob id为索引中的id，否则为None；
+             已删除的文件不包含在内
+    """
+    changes = []
+    records = iter(records)
+    for record in records:
+        kind = record[:1]
+        if kind == '?':
+            changes.append((record[2:], None))
+        elif kind in ('1', '2', 'u'):
+            # 1 XY sub mH mI mW hH hI path；2 XY sub mH mI mW hH hI Xscore path\0origPath；
+            # u XY sub m1 m2 m3 mW h1 h2 h3 path
+            fields = record.split(' ', {'1': 8, '2': 9, 'u': 10}[kind])
+            if kind == '2':
+                next(records, None)
+            xy = fields[1]
+            if 'D' in xy:
+                continue
+            blob_id = fields[7] if kind in ('1', '2') and xy[1] == '.' else None
+            changes.append((fields[-1], blob_id))
+    return changes
+
+
+@trace_span('source')
+def get_status(repo):
+    """
+    执行一次git status，获取暂存区、工作区中变动的文件和未跟踪的文件
+    开启untracked cache，仓库配置了fsmonitor时由git直接使用
+    :param repo: git仓库
+    :return: 列表，每一项为(文件相对路径, blob id)
+    """
+    process = repo.git.execute(
+        ['git', '-c', 'core.untrackedCache=true', 'status', '--porcelain=v2', '-z', '--untracked-files=all',
+         '--ignore-submodules=all'],
+        as_process=True)
+    try:
+        return parse_status(_read_records(process.stdout))
+    finally:
+        process.wait()
+
+
+@trace_span('source')
 def get_changed_files(repo, exclude_test=False):
     """
-    从repo中提取更改，还没提交的文件列表
+    从repo中提取更改，还没提交的文件列表，包括暂存区和工作区中的变动以及未跟踪的文件
     :param repo:
     :param exclude_test: 不对测试代码进行检测
-    :return:
+    :return: (changed_java_files, changed_js_files, changed_python_files, blob_ids)
     """
     git_address = repo.working_tree_dir
-    changed_files = [item.a_path for item in repo.index.diff(None)]
-    changed_files.extend(repo.untracked_files)
-    return get_files_list(git_address, changed_files, exclude_test)
+    changes = get_status(repo)
+    blob_ids = {path.join(git_address, name): blob_id for name, blob_id in changes if blob_id}
+    return (*get_files_list(git_address, [name for name, _ in changes], exclude_test), blob_ids)
 
 
-def get_all_files(project_path, exclude_test=False):
+def split_commit_range(commit_range):
     """
-    获取工程目录下的所有代码文件
-    :param project_path:  工程目录
-    :param exclude_test:  是否屏蔽测试代码
-    :return:
+    拆分提交范围，只指定一个版本时表示从该版本到HEAD
+    :param commit_range: 提交范围，如 origin/main..HEAD、origin/main...HEAD 或 origin/main
+    :return: (起始版本, 结束版本)
     """
-    changed_java_files = list()
-    changed_js_files = list()
+    for separator in ('...', '..'):
+        if separator in commit_range:
+            start, end = commit_range.split(separator, 1)
+            return start or 'HEAD', end or 'HEAD'
+    return commit_range, 'HEAD'
+
 
-    all_source_files = lizard.get_all_source_files([project_path], [], ['java', 'js'])
-    for source_file in all_source_files:
-        if source_file.endswith('.java') and (not exclude_test or 'src/test' not in source_file):
-            changed_java_files.append(source_file)
-        elif source_file.endswith('.js'):
-            changed_js_files.append(source_file)
-    return changed_java_files, changed_js_files
+def parse_raw_diff(output):
+    """
+    解析 git diff --raw -z 的输出
+    :param output: 命令输出
+    :return: 列表，每一项为(变动类型, 文件相对路径, 变动之后的blob id)，重命名和复制的文件使用新的路径
+    """
+    tokens = output.split('\0')
+    changes = []
+    i = 0
+    while i < len(tokens) and tokens[i].startswith(':'):
+        fields = tokens[i][1:].split()
+        status = fields[4][0]
+        # 重命名和复制类型后面有两个路径，最后一个是新的路径
+        i += 3 if status in ('R', 'C') else 2
+        changes.append((status, tokens[i - 1], fields[3]))
+    return changes
+
+
+@trace_span('source')
+def get_range_files(repo, commit_range, extract_path, exclude_test=False):
+    """
+    获取提交范围内变动的文件，多次提交修改同一个文件时只检查一次，不包括最终已删除的文件
+    结束版本是HEAD时检查工作区中的文件，否则将结束版本中的文件内容提取到extract_path中检查
+    :param repo: git仓库
+    :param commit_range: 提交范围，如 origin/main..HEAD，三个点时从两个版本的共同祖先开始
+    :param extract_path: 提取文件内容的目录
+    :param exclude_test: 不对测试代码进行检测
+    :return: (changed_java_files, changed_js_files, changed_python_files, blob_ids)，
+             结束版本是HEAD时blob_ids为None，由调用方根据工作区计算
+    """
+    git_address = repo.working_tree_dir
+    _, end = split_commit_range(commit_range)
+    diff_range = commit_range if '..' in commit_range else f'{commit_range}..HEAD'
+    output = repo.git.diff('--raw', '-z', '--no-abbrev', '--no-ext-diff', '--diff-filter=d', diff_range)
+    changes = parse_raw_diff(output)
+    if repo.commit(end) == repo.head.commit:
+        names = [name for _, name, _ in changes if path.exists(path.join(git_address, name))]
+        return (*get_files_list(git_address, names, exclude_test), None)
+
+    files = get_files_list(extract_path, [name for _, name, _ in changes], exclude_test)
+    selected = set(files[0] + files[1] + files[2])
+    blob_ids = {}
+    for _, name, blob_id in changes:
+        target = path.join(extract_path, name)
+        if target not in selected:
+            continue
+        os.makedirs(path.dirname(target), exist_ok=True)
+        # 通过常驻的 git cat-file --batch 进程读取文件内容
+        with open(target, 'wb') as fp:
+            fp.write(repo.odb.stream(bytes.fromhex(blob_id)).read())
+        blob_ids[target] = blob_id
+    return (*files, blob_ids)
+
+
+@trace_span('source')
+def get_all_files(repo, project_path, exclude_test=False):
+    """
+    通过一次 git ls-files 获取工程目录下已跟踪和未跟踪的代码文件，.gitignore中忽略的文件和工作区中已删除的文件不包含在内
+    :param repo: git仓库
+    :param project_path: 工程目录
+    :param exclude_test: 是否屏蔽测试代码
+    :return: (java_files, js_files, python_files)
+    """
+    git_address = repo.working_tree_dir
+    pathspec = path.relpath(path.abspath(project_path), git_address)
+    # -t 输出文件状态，已删除的文件同时以H和R两种状态出现
+    output = repo.git.ls_files('-z', '-t', '--cached', '--others', '--deleted', '--exclude-standard', '--', pathspec)
+    names = []
+    deleted = set()
+    for item in output.split('\0'):
+        if item:
+            tag, name = item.split(' ', 1)
+            if tag == 'R':
+                deleted.add(name)
+            else:
+                names.append(name)
+    return get_files_list(git_address, [name for name in dict.fromkeys(names) if name not in deleted], exclude_test)
+
+
+@trace_span('source')
+def get_blob_ids(repo, files):
+    """
+    获取文件的blob id，工作区文件与git索引中记录的大小和修改时间一致时直接使用索引中的blob id，不再重新计算hash
+    :param repo: git仓库
+    :param files: 文件全路径列表
+    :return: dict，文件全路径到blob id的映射，不在索引中或已修改的文件不包含在内
+    """
+    git_address = repo.working_tree_dir
+    try:
+        entries = repo.index.entries
+        index_mtime = int(os.stat(repo.index.path).st_mtime)
+    except (OSError, ValueError):
+        return {}
+    blob_ids = {}
+    for file in files:
+        entry = entries.get((path.relpath(file, git_address).replace(sep, '/'), 0))
+        if entry is None:
+            continue
+        try:
+            stat = os.stat(file)
+        except OSError:
+            continue
+        # 修改时间不早于索引文件的，可能在写入索引之后被修改过，需要重新计算hash
+        mtime = int(stat.st_mtime)
+        if entry.size == stat.st_size and entry.mtime[0] == mtime and mtime < index_mtime:
+            blob_ids[file] = entry.hexsha
+    return blob_ids
@@ -0,0 +1,78 @@
+import builtins
+import sys
+import time
+from contextlib import contextmanager
+
+# 导入耗时记录，元素为(层级, 模块名称, 自身耗时, 累计耗时)，耗时单位秒
+_records = []
+_stack = []
+_original_import = builtins.__import__
+_start = time.perf_counter()
+
+
+@contextmanager
+def record_import(name):
+    """
+    记录一次模块导入的耗时，嵌套的导入计入外层的累计耗时
+    :param name: 模块名称
+    :return:
+    """
+    depth = len(_stack)
+    _stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        children = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        _records.append((depth, name, elapsed - children, elapsed))
+
+
+def _profiled_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level == 0 and name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    with record_import(name if level == 0 else '.' * level + name):
+        return _original_import(name, globals, locals, fromlist, level)
+
+
+def install_import_profiler():
+    """
+    记录之后每个模块首次导入的耗时，打包后的程序无法使用python -X importtime，因此在导入时自行计时
+    :return:
+    """
+    global _start
+    _start = time.perf_counter()
+    builtins.__import__ = _profiled_import
+
+
+def print_startup_profile(min_cumulative=0.001):
+    """
+    按照导入顺序输出模块的导入耗时
+    :param min_cumulative: 累计耗时低于该值的模块不输出，单位秒
+    :return:
+    """
+    builtins.__import__ = _original_import
+    total = time.perf_counter() - _start
+    # 记录按照导入结束的顺序追加，同一层级内按照导入开始的顺序输出
+    ordered = []
+    pending = []
+    for record in _records:
+        depth = record[0]
+        children = []
+        while pending and pending[-1][0][0] > depth:
+            children.insert(0, pending.pop())
+        pending.append((record, children))
+
+    def flatten(items):
+        for record, children in items:
+            ordered.append(record)
+            flatten(children)
+
+    flatten(pending)
+    print(f"{'self(ms)':>10}{'cumulative(ms)':>16}  module")
+    for depth, name, self_time, cumulative in ordered:
+        if cumulative >= min_cumulative:
+            print(f'{self_time * 1000:>10.1f}{cumulative * 1000:>16.1f}  {"  " * depth}{name}')
+    print(f'startup finished in {total * 1000:.1f} ms')
@@ -0,0 +1,131 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+from os import path
+
+from util.trace import trace_span
+from util.util import get_cache_dir
+
+CACHE_FILE_NAME = 'toolchain.json'
+
+# 工具名称，探测版本的命令参数
+TOOLS = {
+    'java': ['-version'],
+    'git': ['--version'],
+}
+
+_probes = {}
+_lock = threading.Lock()
+
+
+def _probe_key(executable):
+    """
+    探测结果的缓存key，可执行文件、文件的修改时间或者PATH变化之后重新探测
+    :param executable: 可执行文件的全路径
+    :return: dict
+    """
+    real_path = path.realpath(executable)
+    stat = os.stat(real_path)
+    return {
+        'executable': real_path,
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'path': os.environ.get('PATH', ''),
+        'pathext': os.environ.get('PATHEXT', ''),
+    }
+
+
+def _read_cache():
+    try:
+        with open(path.join(get_cache_dir(), CACHE_FILE_NAME), 'r', encoding='utf-8') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(cache):
+    cache_file = path.join(get_cache_dir(), CACHE_FILE_NAME)
+    temp_file = f'{cache_file}.{os.getpid()}.tmp'
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as fp:
+            json.dump(cache, fp, indent=2)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        print(f'can not write toolchain cache: {e}')
+
+
+def parse_version(output):
+    """
+    从版本输出中解析版本号
+    :param output: 命令输出，如 openjdk version "17.0.2"、java version "1.8.0_292"、git version 2.40.1
+    :return: 版本号字符串，无法解析时返回空字符串
+    """
+    match = re.search(r'version "?(\d+(?:[._]\d+)*)', output)
+    return match.group(1) if match else ''
+
+
+def get_major_version(version):
+    """
+    获取主版本号，java 1.8之前的版本号以1.开头
+    :param version: 版本号字符串
+    :return: 主版本号，无法解析时返回0
+    """
+    parts = re.split(r'[._]', version)
+    if not parts[0].isdigit():
+        return 0
+    if parts[0] == '1' and len(parts) > 1 and parts[1].isdigit():
+        return int(parts[1])
+    return int(parts[0])
+
+
+@trace_span('toolchain')
+def probe_tool(name):
+    """
+    探测工具是否可执行，并获取版本号
+    探测结果缓存在用户缓存目录中，只在可执行文件或者PATH变化之后重新执行命令
+    :param name: 工具名称，java或git
+    :return: dict，包含executable、version、major；工具不可执行时返回None
+    """
+    with _lock:
+        if name in _probes:
+            return _probes[name]
+        executable = shutil.which(name)
+        if executable is None:
+            _probes[name] = None
+            return None
+        key = _probe_key(executable)
+        cache = _read_cache()
+        cached = cache.get(name)
+        if cached and cached.get('key') == key:
+            _probes[name] = cached['result']
+            return _probes[name]
+
+        try:
+            process = subprocess.run([executable, *TOOLS[name]], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     stdin=subprocess.DEVNULL, timeout=60)
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f'{name} is not executable: {e}')
+            _probes[name] = None
+            return None
+        if process.returncode != 0:
+            _probes[name] = None
+            return None
+        version = parse_version(process.stdout.decode(errors='replace'))
+        result = {'executable': key['executable'], 'version': version, 'major': get_major_version(version)}
+        cache[name] = {'key': key, 'result': result}
+        _write_cache(cache)
+        _probes[name] = result
+        return result
+
+
+def get_java_version():
+    """
+    获取java的主版本号，插件可以据此选择JVM参数
+    :return: 主版本号，java不可执行时返回0
+    """
+    result = probe_tool('java')
+    return result['major'] if result else 0
+
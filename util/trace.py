@@ -0,0 +1,109 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from os import path
+
+# 开启追踪之后记录的事件，格式为chrome trace event，可以使用chrome://tracing或者ui.perfetto.dev查看
+_events = []
+_thread_names = {}
+_lock = threading.Lock()
+_enabled = False
+
+
+def enable_trace():
+    """
+    开启追踪，之后执行的span都会被记录
+    :return:
+    """
+    global _enabled
+    with _lock:
+        _events.clear()
+        _thread_names.clear()
+    _enabled = True
+
+
+def is_trace_enabled():
+    return _enabled
+
+
+def _now():
+    return time.perf_counter_ns() // 1000
+
+
+@contextmanager
+def span(name, category='check', **args):
+    """
+    记录一个span，同一线程中嵌套的span在查看时显示为调用层级
+    :param name: span名称
+    :param category: span分类，如source、exclude、subprocess、xml
+    :param args: 附加在span上的参数
+    :return:
+    """
+    if not _enabled:
+        yield
+        return
+    thread = threading.current_thread()
+    start = _now()
+    try:
+        yield
+    finally:
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start,
+            'dur': _now() - start,
+            'pid': os.getpid(),
+            'tid': thread.ident,
+        }
+        if args:
+            event['args'] = {key: str(value) for key, value in args.items()}
+        with _lock:
+            _events.append(event)
+            _thread_names.setdefault(thread.ident, thread.name)
+
+
+def trace_span(category='check', name=None):
+    """
+    追踪装饰器，将函数的每次调用记录为一个span
+    :param category: span分类
+    :param name: span名称，为空时使用函数名称
+    :return:
+    """
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with span(span_name, category):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def write_trace(trace_file):
+    """
+    将记录的span写入trace文件
+    :param trace_file: trace文件路径
+    :return:
+    """
+    with _lock:
+        events = list(_events)
+        thread_names = dict(_thread_names)
+    pid = os.getpid()
+    metadata = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'style-checker'}}]
+    metadata.extend({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}}
+                    for tid, thread_name in thread_names.items())
+    trace_dir = path.dirname(path.abspath(trace_file))
+    os.makedirs(trace_dir, exist_ok=True)
+    with open(trace_file, 'w', encoding='utf-8') as fp:
+        json.dump({'traceEvents': metadata + sorted(events, key=lambda e: e['ts']), 'displayTimeUnit': 'ms'}, fp)
+    print(f'trace with {len(events)} spans written to {trace_file}')
@@ -1,37 +1,11 @@
 import os
-import sys
 from os import path
 import subprocess
 import platform
 import re
 
-
-def filter_files(exclude_path, exclude_file_name, changed_java_files, match):
-    """
-    根据例外文件，过滤需要进行检查的文件
-    :param exclude_path: 例外文件
-    :param exclude_file_name:
-    :param changed_java_files: 变动的文件
-    :param match 匹配函数
-    :return:
-    """
-
-    if not exclude_path:
-        return changed_java_files
-
-    left_java_files = []
-    exclude_files = read_from_exclude_files(path.join(exclude_path, exclude_file_name))
-    if len(exclude_files) == 0:
-        left_java_files = changed_java_files[:]
-        return left_java_files
-
-    for file in changed_java_files:
-        for pattern in exclude_files:
-            if match(pattern, file):
-                break
-        else:
-            left_java_files.append(file)
-    return left_java_files
+from util.executor import is_output_captured
+from util.trace import span
 
 
 def read_from_exclude_files(full_name_path):
@@ -68,10 +42,31 @@ def run(cmd):
     :return:
     """
     print(' '.join(cmd), end=os.linesep)
-    process = subprocess.run(cmd)
+    with span(path.basename(cmd[0]), 'subprocess', cmd=' '.join(cmd)[:1000]):
+        if not is_output_captured():
+            process = subprocess.run(cmd)
+            return process.returncode
+        # 并发执行时，子进程的输出需要收集到当前插件的输出中，避免与其他插件交错
+        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    print(process.stdout.decode(errors='replace'), end='')
     return process.returncode
 
 
+def save_file_list(full_name, files, quote=False):
+    """
+    将文件列表写入文件，每行一个文件，作为检查工具的文件列表参数，避免命令行过长
+    :param full_name: 写入文件的路径
+    :param files: 文件列表
+    :param quote: 是否使用双引号包围，picocli的@argfile中包含空格的路径需要使用引号
+    :return:
+    """
+    with open(full_name, 'w', encoding='utf-8') as fp:
+        for file in files:
+            if quote:
+                file = '"' + file.replace('\\', '\\\\').replace('"', '\\"') + '"'
+            fp.write(file + '\n')
+
+
 def is_windows():
     """
     判断是否是windows平台
@@ -81,24 +76,24 @@ def is_windows():
     return os_platform == 'Windows'
 
 
-def is_run_in_package_mode():
-    """
-    判断是否已打包的方式运行
-    :return: 打包方式运行，返回True；脚本方式运行，返回False
-    """
-    return getattr(sys, 'frozen', False)
-
-
-def check_app_executable(cmd):
+def get_cache_dir(*parts):
     """
-    测试应用是否可执行
-    :param cmd: 执行的指令
-    :return:
+    获取用户缓存目录，可通过环境变量STYLE_CHECKER_CACHE_DIR指定
+    :param parts: 缓存目录下的子目录
+    :return: 缓存目录的全路径，目录不存在时自动创建
     """
-    try:
-        run(cmd)
-    except FileNotFoundError | subprocess.CalledProcessError as e:
-        raise e
+    base_dir = os.environ.get('STYLE_CHECKER_CACHE_DIR')
+    if not base_dir:
+        if is_windows():
+            base_dir = os.environ.get('LOCALAPPDATA') or path.expanduser('~')
+        elif platform.system() == 'Darwin':
+            base_dir = path.expanduser(path.join('~', 'Library', 'Caches'))
+        else:
+            base_dir = os.environ.get('XDG_CACHE_HOME') or path.expanduser(path.join('~', '.cache'))
+        base_dir = path.join(base_dir, 'style-checker')
+    full_path = path.join(base_dir, *parts)
+    os.makedirs(full_path, exist_ok=True)
+    return full_path
 
 
 def delete_result_file(output_path):
@@ -0,0 +1,219 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from os import path
+
+# 监听时忽略的目录，这些目录中通常是构建产物或者工具生成的文件
+IGNORED_DIRS = {'.git', '.idea', '.vscode', '.svn', 'target', 'build', 'node_modules', '__pycache__', '.venv', 'venv'}
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _walk_dirs(root, ignored):
+    """
+    遍历目录树，跳过忽略的目录
+    :param root: 根目录
+    :param ignored: 忽略的目录全路径集合
+    :return: 目录全路径的生成器
+    """
+    for dir_path, dir_names, _ in os.walk(root):
+        dir_names[:] = [name for name in dir_names
+                        if name not in IGNORED_DIRS and path.join(dir_path, name) not in ignored]
+        yield dir_path
+
+
+class InotifyWatcher:
+    """
+    基于linux inotify的文件变动监听
+    """
+
+    def __init__(self, root, suffixes, ignored):
+        """
+
+        :param root: 监听的根目录
+        :param suffixes: 关注的文件后缀
+        :param ignored: 忽略的目录全路径集合
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._libc = libc
+        self.suffixes = suffixes
+        self.ignored = ignored
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = {}
+        for dir_path in _walk_dirs(root, ignored):
+            self._add_watch(dir_path)
+
+    def _add_watch(self, dir_path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd < 0:
+            # 超出max_user_watches等限制时，由调用方降级为轮询方式
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {dir_path}')
+        self.dirs[wd] = dir_path
+
+    def wait(self, timeout=None):
+        """
+        等待文件变动
+        :param timeout: 超时时间，单位秒，为空时一直等待
+        :return: 变动的文件全路径集合
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                raise OSError('inotify event queue overflow')
+            dir_path = self.dirs.get(wd)
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if dir_path is None or not name:
+                continue
+            full_name = path.join(dir_path, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and name not in IGNORED_DIRS and full_name not in self.ignored:
+                    for new_dir in _walk_dirs(full_name, self.ignored):
+                        self._add_watch(new_dir)
+                        changed.update(_scan_files(new_dir, self.suffixes, recursive=False))
+            elif name.endswith(self.suffixes):
+                changed.add(full_name)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _scan_files(root, suffixes, recursive=True, ignored=frozenset()):
+    """
+    扫描目录下关注的文件
+    :return: 文件全路径列表
+    """
+    dirs = _walk_dirs(root, ignored) if recursive else [root]
+    files = []
+    for dir_path in dirs:
+        try:
+            with os.scandir(dir_path) as entries:
+                files.extend(entry.path for entry in entries if entry.is_file() and entry.name.endswith(suffixes))
+        except OSError:
+            pass
+    return files
+
+
+class PollingWatcher:
+    """
+    基于定时扫描的文件变动监听，在不支持inotify的平台上使用
+    """
+
+    def __init__(self, root, suffixes, ignored, interval=1.0):
+        """
+
+        :param root: 监听的根目录
+        :param suffixes: 关注的文件后缀
+        :param ignored: 忽略的目录全路径集合
+        :param interval: 扫描间隔，单位秒
+        """
+        self.root = root
+        self.suffixes = suffixes
+        self.ignored = ignored
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for file in _scan_files(self.root, self.suffixes, ignored=self.ignored):
+            try:
+                stat = os.stat(file)
+            except OSError:
+                continue
+            snapshot[file] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = {file for file, stat in snapshot.items() if self.snapshot.get(file) != stat}
+        changed.update(file for file in self.snapshot if file not in snapshot)
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(root, suffixes, ignored=(), poll_interval=1.0):
+    """
+    创建文件变动监听，优先使用inotify，不可用时使用轮询方式
+    :param root: 监听的根目录
+    :param suffixes: 关注的文件后缀
+    :param ignored: 忽略的目录全路径
+    :param poll_interval: 轮询方式的扫描间隔，单位秒
+    :return:
+    """
+    ignored = {path.abspath(item) for item in ignored}
+    try:
+        watcher = InotifyWatcher(root, suffixes, ignored)
+        print(f'watching {root} with inotify')
+        return watcher
+    except (OSError, AttributeError) as e:
+        print(f'inotify is not available ({e}), watching {root} by polling')
+        return PollingWatcher(root, suffixes, ignored, poll_interval)
+
+
+def watch_project(project_path, on_change, *, suffixes=('.java', '.py'), ignored=(), debounce=0.5,
+                  poll_interval=1.0):
+    """
+    监听工程目录中的文件变动，一批连续的保存操作结束debounce秒之后，调用一次on_change
+    :param project_path: 工程目录
+    :param on_change: 回调函数，参数为变动且仍然存在的文件全路径列表
+    :param suffixes: 关注的文件后缀
+    :param ignored: 忽略的目录全路径，如检查结果输出目录
+    :param debounce: 防抖时间，单位秒
+    :param poll_interval: 轮询方式的扫描间隔，单位秒
+    :return:
+    """
+    project_path = path.abspath(project_path)
+    watcher = create_watcher(project_path, suffixes, ignored, poll_interval)
+    pending = set()
+    last_event = 0.0
+    try:
+        while True:
+            try:
+                changed = watcher.wait(debounce if pending else None)
+            except OSError as e:
+                # inotify队列溢出等异常，重新建立监听并全量扫描一次
+                print(f'file watcher failed ({e}), restarting')
+                watcher.close()
+                watcher = create_watcher(project_path, suffixes, ignored, poll_interval)
+                changed = set(_scan_files(project_path, suffixes, ignored={path.abspath(i) for i in ignored}))
+            if changed:
+                pending.update(changed)
+                last_event = time.monotonic()
+                continue
+            if pending and time.monotonic() - last_event >= debounce:
+                files = sorted(file for file in pending if path.isfile(file))
+                pending.clear()
+                if files:
+                    on_change(files)
+    finally:
+        watcher.close()
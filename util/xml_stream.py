@@ -0,0 +1,121 @@
+import os
+from contextlib import contextmanager
+from copy import deepcopy
+from os import path
+
+from lxml import etree
+
+from util.trace import trace_span
+
+
+def local_name(node):
+    """
+    获取节点不带命名空间的标签名称，pmd的检查结果带有命名空间
+    """
+    return etree.QName(node).localname
+
+
+@contextmanager
+def atomic_write(file):
+    """
+    先写入临时文件，写入成功后替换目标文件，读取方不会看到写了一半的文件
+    :param file: 目标文件
+    :return: 二进制文件对象
+    """
+    temp_file = f'{file}.{os.getpid()}.tmp'
+    try:
+        with open(temp_file, 'wb') as fp:
+            yield fp
+        os.replace(temp_file, file)
+    finally:
+        if path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def read_root(file):
+    """
+    只读取xml文件的根节点
+    :param file: xml文件
+    :return: (tag, attrib, nsmap)
+    """
+    for _, node in etree.iterparse(file, events=('start',), huge_tree=True):
+        return node.tag, dict(node.attrib), dict(node.nsmap)
+
+
+def iter_children(file):
+    """
+    流式读取xml文件中根节点的直接子节点，子节点处理完成后释放，内存占用与文件大小无关
+    :param file: xml文件
+    :return: 子节点的生成器，节点只在迭代过程中有效
+    """
+    depth = 0
+    for event, node in etree.iterparse(file, events=('start', 'end'), remove_comments=True, huge_tree=True):
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            yield node
+            node.clear()
+            parent = node.getparent()
+            while node.getprevious() is not None:
+                del parent[0]
+
+
+def strip_default_namespace(node, namespace):
+    """
+    复制节点，去掉其中属于根节点默认命名空间的标签的命名空间
+    单独写入的子节点会重复声明根节点已经声明的命名空间，去掉之后子节点直接继承根节点的默认命名空间
+    :param node: 子节点
+    :param namespace: 根节点的默认命名空间
+    :return: 新的节点，不属于默认命名空间的标签和属性保持不变
+    """
+
+    def copy(element):
+        qname = etree.QName(element)
+        result = etree.Element(qname.localname if qname.namespace == namespace else element.tag,
+                               dict(element.attrib))
+        result.text = element.text
+        for child in element:
+            result.append(copy(child) if isinstance(child.tag, str) else deepcopy(child))
+            result[-1].tail = child.tail
+        return result
+
+    result = copy(node)
+    result.tail = node.tail
+    return result
+
+
+@trace_span('xml')
+def rewrite_xml(output_file, sources, root=None, extra=()):
+    """
+    流式合并和过滤xml文件的子节点，只写入一次目标文件
+    :param output_file: 目标文件，可以同时是来源文件
+    :param sources: 来源列表，每一项为(文件, transform)；transform的参数为子节点，返回需要写入的节点、节点列表或None，
+                    transform为None时原样写入；不存在的文件跳过
+    :param root: 所有来源文件都不存在时使用的根节点(tag, attrib)，存在来源文件时使用第一个来源文件的根节点
+    :param extra: 最后追加写入的节点
+    :return:
+    """
+    sources = [(file, transform) for file, transform in sources if path.exists(file)]
+    tag, attrib, nsmap = read_root(sources[0][0]) if sources else (*root, None)
+    namespace = (nsmap or {}).get(None)
+
+    def write(xf, node):
+        if namespace and isinstance(node.tag, str) and node.nsmap:
+            node = strip_default_namespace(node, namespace)
+        xf.write(node)
+
+    with atomic_write(output_file) as fp, etree.xmlfile(fp, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element(tag, attrib, nsmap=nsmap):
+            for file, transform in sources:
+                for node in iter_children(file):
+                    result = node if transform is None else transform(node)
+                    if isinstance(result, (list, tuple)):
+                        for item in result:
+                            write(xf, item)
+                    elif result is not None:
+                        write(xf, result)
+            for node in extra:
+                write(xf, node)